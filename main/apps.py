@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
+
+    def ready(self):
+        """Warm the cache in the background when enabled, the first requests run warm then."""
+        if not settings.WARMUP_ON_START:
+            return
+        from main.warmup import is_serving, warm_in_background
+
+        if is_serving():
+            warm_in_background()
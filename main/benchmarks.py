@@ -0,0 +1,874 @@
+import asyncio
+import json
+import logging
+import math
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import combinations
+from operator import attrgetter
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+from unittest import mock
+
+import httpx
+import requests
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings, setup_test_environment
+from django.utils import timezone
+
+from main import http_client
+from main.constants import (
+    BILLBOARD_CHART_URLS,
+    RATING_ENGINE_BRADLEY_TERRY,
+    RATING_ENGINE_RATIO,
+)
+from main.http_client import HTTP_MODE_REPLAY, HttpClient
+from main.lyrics import parse_billboard
+from main.middleware.compression_middleware import (
+    ENCODING_BROTLI,
+    ENCODING_GZIP,
+    brotli,
+    compress,
+)
+from main.middleware.timing_middleware import RequestTimings
+from main.models import Rating, Song
+from main.player_state import PLAYER_COOKIE, load_player_state
+from main.plays import get_next_song, set_played
+from main.ratings import get_match, select_match, set_match_result
+from main.strengths import elo_step, fit_strengths, strength_to_rating
+from main.synthetic import generate_library
+
+logger = logging.getLogger(__name__)
+
+BENCH_DIR = settings.BASE_DIR / '.bench'
+# simulations give up when the top is not found after this many comparisons per song
+MAX_COMPARISONS_PER_SONG = 50
+# partials and tables the player loads
+COMPRESSION_ENDPOINTS = [
+    '/next-song/',
+    '/album/0/',
+    '/ranking/songs/',
+    '/ranking/albums/',
+    '/ranking/artists/',
+    '/list/song/',
+    '/list/album/',
+    '/list/artist/',
+    '/stats/',
+    '/stats/graph/album_ratings_by_year/',
+    '/stats/graph/songs_by_date/',
+]
+# what every manage.py command pays, and what a server pays before its first request
+STARTUP_SCRIPTS = {
+    'setup': 'import django; django.setup()',
+    'urls': 'import django; django.setup(); import speler2.urls',
+}
+# heavy modules imported on first use, loading them at startup is a regression
+LAZY_MODULES = ['bs4', 'httpx', 'mutagen', 'pylast', 'plotly']
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$')
+# lyrics page served by the simulated upstream, parsed and stored like a real one
+UPSTREAM_LYRICS_PAGE = (
+    b'<div class="container main-page"><b>Artist Lyrics</b><b>"Song"</b></div>'
+    b'<div>Simulated<br/>lyrics</div>'
+)
+
+
+def summarize(values: List[float]) -> dict:
+    """Get p50/p95/p99 and mean of values."""
+    if len(values) < 2:  # noqa: PLR2004
+        values = values * 2
+    quantiles = statistics.quantiles(values, n=100, method='inclusive')
+    return {
+        'p50': quantiles[49],
+        'p95': quantiles[94],
+        'p99': quantiles[98],
+        'mean': statistics.fmean(values),
+    }
+
+
+class StepRecorder:
+    def __init__(self):
+        """Latency and query count samples per step."""
+        self.durations = defaultdict(list)
+        self.queries = defaultdict(list)
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        """Time a step and count its queries."""
+        timings = RequestTimings()
+        start = time.perf_counter()
+        with connection.execute_wrapper(timings):
+            yield
+        self.durations[name].append((time.perf_counter() - start) * 1000)
+        self.queries[name].append(timings.queries)
+
+    def report(self) -> dict:
+        """Get summary per step."""
+        return {
+            name: {
+                'ms': summarize(durations),
+                'queries': statistics.fmean(self.queries[name]),
+                'samples': len(durations),
+            }
+            for name, durations in self.durations.items()
+        }
+
+
+@contextmanager
+def bench_database(test_name: Optional[str] = None) -> Iterator[None]:
+    """Run against a throwaway test database, never the real library.
+
+    The database is in memory unless named, threads of concurrent benchmarks need a file,
+    as they would otherwise lock each other out of tables.
+    """
+    setup_test_environment()
+    test_settings = connection.settings_dict['TEST']
+    previous_test_name = test_settings['NAME']
+    test_settings['NAME'] = test_name
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = previous_test_name
+
+
+def seed_database(size: int, seed: int, **activity_kwargs):
+    """Replace the database content with a synthetic library."""
+    call_command('flush', interactive=False, verbosity=0)
+    cache.clear()
+    generate_library(size, seed=seed, **activity_kwargs)
+
+
+def run_loop(iterations: int) -> dict:
+    """Drive the listening loop through the views and through the services directly."""
+    recorder = StepRecorder()
+    client = Client()
+    client.get('/next-song/')  # warm up and start the player
+
+    for _ in range(iterations):
+        with recorder.step('view next_song'):
+            client.get('/next-song/')
+        with recorder.step('view next_rating'):
+            client.get('/next-rating/')
+        match_ids = load_player_state(client.cookies[PLAYER_COOKIE].value).match_ids
+        if match_ids:
+            with recorder.step('view rate'):
+                client.get(f'/next-rating/?winner_id={match_ids[0]}')
+
+    for _ in range(iterations):
+        with recorder.step('get_next_song'):
+            song = get_next_song()
+        with recorder.step('set_played'):
+            set_played(song)
+        with recorder.step('get_match'):
+            match = get_match(song)
+        if match:
+            with recorder.step('set_match_result'):
+                set_match_result(match[0].id, [s.id for s in match])
+
+    return recorder.report()
+
+
+def bench_loop(sizes: List[int], iterations: int, seed: int, **kwargs) -> dict:
+    """Benchmark the listening loop against seeded databases of several sizes."""
+    results = {
+        'benchmark': 'loop',
+        'created_at': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'iterations': iterations,
+        'sizes': {},
+    }
+    # db-only libraries have no audio files, and nothing should be scrobbled or scraped
+    with (
+        bench_database(),
+        override_settings(LASTFM_ENABLE=False, LYRICS_PREFETCH=False),
+        mock.patch.object(Song, 'file_exists', return_value=True),
+    ):
+        for size in sizes:
+            logger.warning(f'Seeding {size} songs...')
+            seed_database(size, seed)
+            logging.disable(logging.INFO)
+            try:
+                results['sizes'][str(size)] = run_loop(iterations)
+            finally:
+                logging.disable(logging.NOTSET)
+    return results
+
+
+def bench_billboard(iterations: int, **kwargs) -> dict:
+    """Benchmark parsing of the billboard charts against recorded fixtures."""
+    client = HttpClient(
+        cache_dir=settings.HTTP_CACHE_DIR,
+        fixtures_dir=settings.HTTP_FIXTURES_DIR,
+        mode=HTTP_MODE_REPLAY,
+    )
+    pages = {}
+    for chart, url in BILLBOARD_CHART_URLS.items():
+        try:
+            pages[chart] = client.get(url).content
+        except requests.ConnectionError as exc:
+            raise CommandError(
+                f'{exc}, record it with: HTTP_MODE=record manage.py parsemusic scrapebillboards'
+            ) from exc
+
+    recorder = StepRecorder()
+    for chart, content in pages.items():
+        for _ in range(iterations):
+            # whole page parse of the previous scraper, as reference
+            with recorder.step(f'{chart} full page'):
+                BeautifulSoup(content, 'html.parser')
+            with recorder.step(f'{chart} chart rows'):
+                parse_billboard(content, chart)
+
+    return {
+        'benchmark': 'billboard',
+        'created_at': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'iterations': iterations,
+        'steps': recorder.report(),
+    }
+
+
+def bench_compression(size: int, iterations: int, seed: int, **kwargs) -> dict:
+    """Benchmark bytes sent per endpoint uncompressed and per encoding, and time to compress."""
+    encodings = [ENCODING_GZIP] + ([ENCODING_BROTLI] if brotli is not None else [])
+    endpoints = {}
+    with (
+        bench_database(),
+        override_settings(LASTFM_ENABLE=False, LYRICS_PREFETCH=False),
+        mock.patch.object(Song, 'file_exists', return_value=True),
+    ):
+        logger.warning(f'Seeding {size} songs...')
+        seed_database(size, seed)
+        logging.disable(logging.INFO)
+        try:
+            client = Client()
+            client.get('/next-song/')  # start the player, the partials show its song
+            for url in COMPRESSION_ENDPOINTS:
+                response = client.get(url, HTTP_ACCEPT_ENCODING='identity')
+                content = response.content
+                endpoint = {'identity': len(content), 'encodings': {}}
+                for encoding in encodings:
+                    response = client.get(url, HTTP_ACCEPT_ENCODING=encoding)
+                    durations = []
+                    for _ in range(iterations):
+                        start = time.perf_counter()
+                        compress(content, encoding)
+                        durations.append((time.perf_counter() - start) * 1000)
+                    endpoint['encodings'][encoding] = {
+                        'bytes': len(response.content),
+                        'compressed': response.get('Content-Encoding') == encoding,
+                        'ms': summarize(durations),
+                    }
+                endpoints[url] = endpoint
+        finally:
+            logging.disable(logging.NOTSET)
+
+    return {
+        'benchmark': 'compression',
+        'created_at': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'size': size,
+        'min_size': settings.COMPRESSION_MIN_SIZE,
+        'endpoints': endpoints,
+    }
+
+
+@contextmanager
+def slow_upstream(delay: float) -> Iterator[None]:
+    """Answer the requests of both http clients with a lyrics page, after delay seconds."""
+
+    def get(session, url, **kwargs):
+        time.sleep(delay)
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = UPSTREAM_LYRICS_PAGE
+        return response
+
+    async def aget(session, url, **kwargs):
+        await asyncio.sleep(delay)
+        return httpx.Response(200, content=UPSTREAM_LYRICS_PAGE, request=httpx.Request('GET', url))
+
+    http_client.get_client.cache_clear()
+    try:
+        with (
+            tempfile.TemporaryDirectory() as cache_dir,
+            override_settings(HTTP_CACHE_DIR=Path(cache_dir), HTTP_RATE_LIMITS={}),
+            mock.patch.object(requests.Session, 'get', get),
+            mock.patch.object(httpx.AsyncClient, 'get', aget),
+        ):
+            yield
+    finally:
+        http_client.get_client.cache_clear()
+
+
+def lyrics_urls(song_ids: List[int], offset: int, step: int) -> Iterator[str]:
+    """Get urls refetching the lyrics of songs, so every request goes upstream."""
+    ix = offset
+    while True:
+        yield f'/lyrics/{song_ids[ix % len(song_ids)]}/?refresh=1'
+        ix += step
+
+
+def run_wsgi(song_ids: List[int], iterations: int, concurrency: int, threads: int) -> dict:
+    """Play songs while other tabs fetch lyrics, served by a pool of threads like WSGI."""
+    latencies = defaultdict(list)
+    done = threading.Event()
+
+    def request(server: ThreadPoolExecutor, client: Client, url: str, kind: str):
+        start = time.perf_counter()
+        server.submit(client.get, url).result()
+        latencies[kind].append((time.perf_counter() - start) * 1000)
+
+    def fetch_lyrics(server: ThreadPoolExecutor, offset: int):
+        client = Client()
+        urls = lyrics_urls(song_ids, offset, concurrency)
+        while not done.is_set():
+            request(server, client, next(urls), 'lyrics')
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi') as server:
+        tabs = [
+            threading.Thread(target=fetch_lyrics, args=(server, offset))
+            for offset in range(concurrency)
+        ]
+        for tab in tabs:
+            tab.start()
+        player = Client()
+        for _ in range(iterations):
+            request(server, player, '/next-song/', 'player')
+            request(server, player, '/next-rating/', 'player')
+        done.set()
+        for tab in tabs:
+            tab.join()
+    return summarize_server(latencies, time.perf_counter() - start)
+
+
+async def run_asgi(song_ids: List[int], iterations: int, concurrency: int) -> dict:
+    """Play songs while other tabs fetch lyrics, served by a single event loop like ASGI."""
+    latencies = defaultdict(list)
+    done = asyncio.Event()
+
+    async def request(client: AsyncClient, url: str, kind: str):
+        start = time.perf_counter()
+        await client.get(url)
+        latencies[kind].append((time.perf_counter() - start) * 1000)
+
+    async def fetch_lyrics(offset: int):
+        client = AsyncClient()
+        urls = lyrics_urls(song_ids, offset, concurrency)
+        while not done.is_set():
+            await request(client, next(urls), 'lyrics')
+
+    async def play():
+        player = AsyncClient()
+        for _ in range(iterations):
+            await request(player, '/next-song/', 'player')
+            await request(player, '/next-rating/', 'player')
+        done.set()
+
+    start = time.perf_counter()
+    await asyncio.gather(play(), *(fetch_lyrics(offset) for offset in range(concurrency)))
+    return summarize_server(latencies, time.perf_counter() - start)
+
+
+def summarize_server(latencies: Dict[str, List[float]], duration: float) -> dict:
+    """Get latency summaries per kind of request and the throughput of a server run."""
+    return {
+        **{kind: summarize(values) for kind, values in latencies.items()},
+        'requests': sum(map(len, latencies.values())),
+        'per_second': sum(map(len, latencies.values())) / duration,
+    }
+
+
+def bench_asgi(
+    size: int, iterations: int, concurrency: int, threads: int, delay: float, seed: int, **kwargs
+) -> dict:
+    """Benchmark player latency while tabs fetch lyrics from a slow upstream, WSGI vs ASGI.
+
+    The WSGI run serves requests from a fixed pool of threads, so slow fetches hold threads
+    the player waits for. The ASGI run awaits the fetches on one event loop.
+    """
+    servers = {}
+    with (
+        tempfile.TemporaryDirectory() as db_dir,
+        bench_database(str(Path(db_dir) / 'bench.sqlite3')),
+        override_settings(LASTFM_ENABLE=False, LYRICS_PREFETCH=False),
+        mock.patch.object(Song, 'file_exists', return_value=True),
+        slow_upstream(delay),
+    ):
+        logger.warning(f'Seeding {size} songs...')
+        seed_database(size, seed)
+        song_ids = list(Song.objects.values_list('id', flat=True))
+        random.Random(seed).shuffle(song_ids)  # noqa: S311
+        logging.disable(logging.WARNING)
+        try:
+            servers['wsgi'] = run_wsgi(song_ids, iterations, concurrency, threads)
+            servers['asgi'] = asyncio.run(run_asgi(song_ids, iterations, concurrency))
+        finally:
+            logging.disable(logging.NOTSET)
+
+    return {
+        'benchmark': 'asgi',
+        'created_at': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'size': size,
+        'iterations': iterations,
+        'concurrency': concurrency,
+        'threads': threads,
+        'delay': delay,
+        'servers': servers,
+    }
+
+
+def parse_importtime(output: str) -> List[Tuple[str, int, float, float]]:
+    """Parse -X importtime output into module, nesting depth, self and cumulative ms."""
+    modules = []
+    for line in output.splitlines():
+        if match := IMPORTTIME_RE.match(line):
+            self_us, cumulative_us, indent, module = match.groups()
+            depth = (len(indent) - 1) // 2
+            modules.append((module, depth, int(self_us) / 1000, int(cumulative_us) / 1000))
+    return modules
+
+
+def run_importtime(script: str) -> List[Tuple[str, int, float, float]]:
+    """Run script in a fresh interpreter, and get the modules it imported with their times."""
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script],  # noqa: S603
+        capture_output=True,
+        text=True,
+        cwd=settings.BASE_DIR,
+        check=False,
+    )
+    if process.returncode:
+        raise CommandError(f'Startup script failed: {process.stderr.strip().splitlines()[-1]}')
+    return parse_importtime(process.stderr)
+
+
+def bench_startup(iterations: int, budget: float, top: int, **kwargs) -> dict:
+    """Benchmark import time of fresh processes, against a budget in ms for serving.
+
+    Time per package is the self time of its modules, so it is not counted again for the
+    packages importing it. Any lazy module imported at startup fails the budget too.
+    """
+    scripts = {}
+    for name, script in STARTUP_SCRIPTS.items():
+        run_importtime(script)  # compile and cache bytecode first
+        totals, package_ms = [], defaultdict(list)
+        for _ in range(iterations):
+            modules = run_importtime(script)
+            totals.append(sum(cumulative for _, depth, _, cumulative in modules if depth == 0))
+            per_package = defaultdict(float)
+            for module, _, self_ms, _ in modules:
+                per_package[module.split('.')[0]] += self_ms
+            for package, ms in per_package.items():
+                package_ms[package].append(ms)
+        packages = {package: statistics.median(ms) for package, ms in package_ms.items()}
+        heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+        scripts[name] = {
+            'ms': summarize(totals),
+            'modules': len(modules),
+            'packages': dict(heaviest),
+            'lazy_imported': sorted(set(LAZY_MODULES) & set(packages)),
+        }
+
+    failures = []
+    if (serving_ms := scripts['urls']['ms']['p50']) > budget:
+        failures.append(f'Import time {serving_ms:.0f}ms exceeds the budget of {budget:.0f}ms')
+    for name, stats in scripts.items():
+        if stats['lazy_imported']:
+            failures.append(f'{name} imports lazy modules: {", ".join(stats["lazy_imported"])}')
+
+    return {
+        'benchmark': 'startup',
+        'created_at': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'iterations': iterations,
+        'budget': budget,
+        'scripts': scripts,
+        'failures': failures,
+    }
+
+
+def replay_ratio(results: List[Tuple[int, int]]) -> Dict[int, float]:
+    """Get win ratios of the replayed results."""
+    wins = defaultdict(int)
+    games = defaultdict(int)
+    for winner_id, loser_id in results:
+        wins[winner_id] += 1
+        games[winner_id] += 1
+        games[loser_id] += 1
+    return {song_id: wins[song_id] / count for song_id, count in games.items()}
+
+
+def replay_bradley_terry(results: List[Tuple[int, int]]) -> Dict[int, float]:
+    """Get bradley-terry strengths fitted on the replayed results at once."""
+    pairs = defaultdict(lambda: [0, 0])
+    for winner_id, loser_id in results:
+        pairs[min(winner_id, loser_id), max(winner_id, loser_id)][winner_id > loser_id] += 1
+    if not pairs:
+        return {}
+    song_a_ids, song_b_ids = zip(*pairs.keys(), strict=True)
+    a_wins, b_wins = zip(*pairs.values(), strict=True)
+    return fit_strengths(song_a_ids, song_b_ids, a_wins, b_wins)
+
+
+def replay_incremental(results: List[Tuple[int, int]]) -> Dict[int, float]:
+    """Get strengths updated result by result, as set_match_result does."""
+    strengths = defaultdict(float)
+    counts = defaultdict(int)
+    for winner_id, loser_id in results:
+        delta_w, delta_l = elo_step(
+            strengths[winner_id], strengths[loser_id], counts[winner_id], counts[loser_id]
+        )
+        strengths[winner_id] += delta_w
+        strengths[loser_id] += delta_l
+        counts[winner_id] += 1
+        counts[loser_id] += 1
+    return strengths
+
+
+def prediction_accuracy(scores: Dict[int, float], results: List[Tuple[int, int]]) -> float:
+    """Get the share of results where the winner had the higher score, ties count half."""
+    correct = 0.0
+    for winner_id, loser_id in results:
+        winner_score = scores.get(winner_id, 0)
+        loser_score = scores.get(loser_id, 0)
+        if winner_score > loser_score:
+            correct += 1
+        elif winner_score == loser_score:
+            correct += 0.5
+    return correct / len(results)
+
+
+def top_overlap(scores: Dict[int, float], final_scores: Dict[int, float], top: int) -> float:
+    """Get the share of the final top songs that are already in the top."""
+    top_ids = sorted(scores, key=scores.get, reverse=True)[:top]
+    final_ids = sorted(final_scores, key=final_scores.get, reverse=True)[:top]
+    return len(set(top_ids).intersection(final_ids)) / len(final_ids)
+
+
+def bench_ratings(size: int, seed: int, ratings_per_song: float, top: int, **kwargs) -> dict:
+    """Benchmark how fast the rating engines converge when replaying the rating history.
+
+    The last fifth of the history is held out. At every checkpoint of the replay each engine
+    predicts those results, and its top songs are compared to its top after the whole replay.
+    """
+    with bench_database():
+        logger.warning(f'Seeding {size} songs...')
+        seed_database(size, seed, ratings_per_song=ratings_per_song)
+        ratings = Rating.objects.order_by('rated_at', 'id')
+        history = list(ratings.values_list('winner_id', 'loser_id'))
+    count_songs = len({song_id for result in history for song_id in result})
+    replayed = history[: len(history) * 4 // 5]
+    held_out = history[len(replayed) :]
+    if not held_out:
+        raise CommandError('Not enough ratings to replay, seed more songs or ratings')
+
+    logging.disable(logging.INFO)
+    engines = {
+        RATING_ENGINE_RATIO: replay_ratio,
+        RATING_ENGINE_BRADLEY_TERRY: replay_bradley_terry,
+        'incremental': replay_incremental,
+    }
+    final_scores = {engine: replay(replayed) for engine, replay in engines.items()}
+    checkpoints = {engine: [] for engine in engines}
+    per_song = 0
+    end = 0
+    while end < len(replayed):
+        per_song += 1
+        end = min(per_song * count_songs // 2, len(replayed))
+        for engine, replay in engines.items():
+            scores = replay(replayed[:end])
+            checkpoints[engine].append(
+                {
+                    'per_song': round(2 * end / count_songs, 2),
+                    'accuracy': prediction_accuracy(scores, held_out),
+                    'top': top_overlap(scores, final_scores[engine], top),
+                }
+            )
+    logging.disable(logging.NOTSET)
+
+    return {
+        'benchmark': 'ratings',
+        'created_at': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'songs': count_songs,
+        'replayed': len(replayed),
+        'held_out': len(held_out),
+        'top': top,
+        'engines': checkpoints,
+    }
+
+
+def select_first_match(
+    current_song: Song, songs: List[Song], rated_songs: Dict[int, Set[int]]
+) -> Optional[List[Song]]:
+    """Select the first unrated match in history order, the previous selector, as reference."""
+    songs_bag = [current_song]
+    for song in songs:
+        songs_bag.append(song)
+        for song_b, song_c in combinations(songs_bag[1:], 2):
+            triple = (current_song, song_b, song_c)
+            if not any(y.id in rated_songs[x.id] for x, y in combinations(triple, 2)):
+                return list(triple)
+
+
+def simulate_matches(
+    selector: Callable, count_songs: int, top: int, window: int, target: float, seed: int
+) -> dict:
+    """Simulate listening and rating until the estimated top songs overlap the true top.
+
+    Songs get a latent quality, plays are random and the listener picks the best of a match
+    by Luce's choice rule on that quality. Songs are rated by the configured engine.
+    """
+    rng = random.Random(seed)  # noqa: S311
+    songs = [
+        SimpleNamespace(id=ix, quality=rng.gauss(0, 1), rating=0.0, strength=0.0, count_rated=0)
+        for ix in range(count_songs)
+    ]
+    true_top = {s.id for s in sorted(songs, key=lambda s: s.quality, reverse=True)[:top]}
+    if settings.RATING_ENGINE == RATING_ENGINE_BRADLEY_TERRY:
+        score = attrgetter('strength')
+    else:
+        score = attrgetter('rating')
+
+    rated_songs = defaultdict(set)
+    wins = defaultdict(int)
+    recent = deque(maxlen=window)
+    trace = []
+    comparisons = 0
+    plays = 0
+    overlap = 0.0
+    checkpoint = count_songs
+    while comparisons < count_songs * MAX_COMPARISONS_PER_SONG:
+        current_song = rng.choice(songs)
+        plays += 1
+        if current_song in recent:
+            recent.remove(current_song)
+        match = selector(current_song, list(recent), rated_songs)
+        recent.appendleft(current_song)
+        if not match:
+            continue
+
+        winner = rng.choices(match, weights=[math.exp(s.quality) for s in match])[0]
+        for loser in match:
+            if loser is winner:
+                continue
+            delta_w, delta_l = elo_step(
+                winner.strength, loser.strength, winner.count_rated, loser.count_rated
+            )
+            winner.strength += delta_w
+            loser.strength += delta_l
+            wins[winner.id] += 1
+            for song in (winner, loser):
+                song.count_rated += 1
+                if settings.RATING_ENGINE == RATING_ENGINE_BRADLEY_TERRY:
+                    song.rating = strength_to_rating(song.strength)
+                else:
+                    song.rating = wins[song.id] / song.count_rated
+            rated_songs[winner.id].add(loser.id)
+            rated_songs[loser.id].add(winner.id)
+            comparisons += 1
+
+        if comparisons >= checkpoint:
+            checkpoint += count_songs
+            estimated_top = sorted(songs, key=score, reverse=True)[:top]
+            overlap = len(true_top.intersection(s.id for s in estimated_top)) / top
+            trace.append({'comparisons': comparisons, 'plays': plays, 'top': overlap})
+            if overlap >= target:
+                break
+    return {
+        'comparisons': comparisons,
+        'plays': plays,
+        'top': overlap,
+        'trace': trace,
+    }
+
+
+def bench_matches(songs: int, top: int, window: int, target: float, seed: int, **kwargs) -> dict:
+    """Benchmark offline how many comparisons the match selectors need for a stable top."""
+    selectors = {'first unrated': select_first_match, 'information': select_match}
+    return {
+        'benchmark': 'matches',
+        'created_at': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'engine': settings.RATING_ENGINE,
+        'songs': songs,
+        'top': top,
+        'window': window,
+        'target': target,
+        'selectors': {
+            name: simulate_matches(selector, songs, top, window, target, seed)
+            for name, selector in selectors.items()
+        },
+    }
+
+
+def save_results(results: dict, output: Optional[Path] = None) -> Path:
+    """Save results as JSON to compare between versions."""
+    if output is None:
+        BENCH_DIR.mkdir(exist_ok=True)
+        stamp = timezone.now().strftime('%Y%m%d-%H%M%S')
+        output = BENCH_DIR / f'{results["benchmark"]}-{stamp}.json'
+    output.write_text(json.dumps(results, indent=2))
+    return output
+
+
+def format_steps(steps: dict, baseline_steps: Optional[dict] = None) -> List[str]:
+    """Format step summaries as a table, with the change against a baseline run."""
+    lines = [f'{"step":<24} {"p50":>9} {"p95":>9} {"p99":>9} {"queries":>8}']
+    for step, stats in steps.items():
+        ms = stats['ms']
+        line = (
+            f'{step:<24} {ms["p50"]:>7.2f}ms {ms["p95"]:>7.2f}ms {ms["p99"]:>7.2f}ms '
+            f'{stats["queries"]:>8.1f}'
+        )
+        base = (baseline_steps or {}).get(step)
+        if base:
+            p50_delta = (ms['p50'] - base['ms']['p50']) / base['ms']['p50'] * 100
+            queries_delta = stats['queries'] - base['queries']
+            line += f'  ({p50_delta:+.0f}% p50, {queries_delta:+.1f} queries)'
+        lines.append(line)
+    return lines
+
+
+def format_loop_results(results: dict, baseline: Optional[dict] = None) -> List[str]:
+    """Format loop results per library size."""
+    lines = []
+    for size, steps in results['sizes'].items():
+        lines.append(f'--- {size} songs')
+        lines.extend(format_steps(steps, (baseline or {}).get('sizes', {}).get(size)))
+    return lines
+
+
+def format_rating_results(results: dict, baseline: Optional[dict] = None) -> List[str]:
+    """Format accuracy on the held out ratings and top stability per replay checkpoint."""
+    engines = results['engines']
+    lines = [
+        f'{results["songs"]} songs, {results["replayed"]} ratings replayed, '
+        f'{results["held_out"]} held out, top {results["top"]}',
+        f'{"per song":>8} ' + ' '.join(f'{engine:>24}' for engine in engines),
+    ]
+    for ix, checkpoint in enumerate(next(iter(engines.values()))):
+        line = f'{checkpoint["per_song"]:>8.1f}'
+        for checkpoints in engines.values():
+            line += f' {checkpoints[ix]["accuracy"]:>11.1%} acc {checkpoints[ix]["top"]:>6.0%} top'
+        lines.append(line)
+    # comparisons each engine needs to predict as well as the win ratio does at the end
+    target = engines[RATING_ENGINE_RATIO][-1]['accuracy']
+    for engine, checkpoints in engines.items():
+        per_song = next(c['per_song'] for c in checkpoints if c['accuracy'] >= target)
+        line = f'{engine}: {target:.1%} accuracy after {per_song} ratings per song'
+        base_engines = (baseline or {}).get('engines', {})
+        if base := base_engines.get(engine):
+            base_target = base_engines[RATING_ENGINE_RATIO][-1]['accuracy']
+            base_per_song = next(c['per_song'] for c in base if c['accuracy'] >= base_target)
+            line += f' (was {base_per_song})'
+        lines.append(line)
+    return lines
+
+
+def format_match_results(results: dict, baseline: Optional[dict] = None) -> List[str]:
+    """Format comparisons each match selector needed to find the true top songs."""
+    lines = [
+        f'{results["songs"]} songs rated by {results["engine"]}, {results["window"]} recent songs, '
+        f'target {results["target"]:.0%} of the true top {results["top"]}',
+        f'{"selector":<16} {"comparisons":>12} {"plays":>8} {"per song":>9} {"top":>6}',
+    ]
+    for name, selector in results['selectors'].items():
+        per_song = selector['comparisons'] / results['songs']
+        line = (
+            f'{name:<16} {selector["comparisons"]:>12} {selector["plays"]:>8} '
+            f'{per_song:>9.1f} {selector["top"]:>6.0%}'
+        )
+        base = (baseline or {}).get('selectors', {}).get(name)
+        if base:
+            delta = (selector['comparisons'] - base['comparisons']) / base['comparisons'] * 100
+            line += f'  ({delta:+.0f}% comparisons)'
+        lines.append(line)
+    return lines
+
+
+def format_compression_results(results: dict, baseline: Optional[dict] = None) -> List[str]:
+    """Format bytes saved per endpoint and encoding, and the time it took."""
+    lines = [
+        f'{results["size"]} songs, compressing responses from {results["min_size"]} bytes',
+        f'{"endpoint":<38} {"identity":>9} {"encoding":>8} {"bytes":>9} {"saved":>6} {"p50":>9}',
+    ]
+    for url, endpoint in results['endpoints'].items():
+        for encoding, stats in endpoint['encodings'].items():
+            saved = 1 - stats['bytes'] / endpoint['identity'] if endpoint['identity'] else 0
+            line = (
+                f'{url:<38} {endpoint["identity"]:>9} {encoding:>8} {stats["bytes"]:>9} '
+                f'{saved:>6.0%} {stats["ms"]["p50"]:>7.2f}ms'
+            )
+            if not stats['compressed']:
+                line += '  (sent as is)'
+            base = (baseline or {}).get('endpoints', {}).get(url, {}).get('encodings', {})
+            if base.get(encoding):
+                line += f'  ({stats["bytes"] - base[encoding]["bytes"]:+} bytes)'
+            lines.append(line)
+    return lines
+
+
+def format_asgi_results(results: dict, baseline: Optional[dict] = None) -> List[str]:
+    """Format player and lyrics latencies per server."""
+    lines = [
+        f'{results["size"]} songs, {results["concurrency"]} tabs fetching lyrics taking '
+        f'{results["delay"]}s, wsgi with {results["threads"]} threads',
+        f'{"server":<8} {"player p50":>11} {"p95":>9} {"lyrics p50":>11} {"p95":>9} {"req/s":>7}',
+    ]
+    for server, stats in results['servers'].items():
+        player, lyrics = stats['player'], stats.get('lyrics', {'p50': 0, 'p95': 0})
+        line = (
+            f'{server:<8} {player["p50"]:>9.1f}ms {player["p95"]:>7.1f}ms '
+            f'{lyrics["p50"]:>9.1f}ms {lyrics["p95"]:>7.1f}ms {stats["per_second"]:>7.1f}'
+        )
+        if base := (baseline or {}).get('servers', {}).get(server):
+            delta = (player['p50'] - base['player']['p50']) / base['player']['p50'] * 100
+            line += f'  ({delta:+.0f}% player p50)'
+        lines.append(line)
+    return lines
+
+
+def format_startup_results(results: dict, baseline: Optional[dict] = None) -> List[str]:
+    """Format import time per startup script, with its heaviest packages."""
+    lines = [f'fresh processes, budget {results["budget"]:.0f}ms to serve']
+    for name, stats in results['scripts'].items():
+        ms = stats['ms']
+        line = (
+            f'--- {name}: {ms["p50"]:.1f}ms p50, {ms["p95"]:.1f}ms p95, '
+            f'{stats["modules"]} modules'
+        )
+        if base := (baseline or {}).get('scripts', {}).get(name):
+            delta = (ms['p50'] - base['ms']['p50']) / base['ms']['p50'] * 100
+            line += f'  ({delta:+.0f}% p50)'
+        lines.append(line)
+        for package, package_ms in stats['packages'].items():
+            lines.append(f'{package:<32} {package_ms:>8.1f}ms')
+    lines.extend(f'FAIL {failure}' for failure in results['failures'])
+    return lines
+
+
+def format_step_results(results: dict, baseline: Optional[dict] = None) -> List[str]:
+    """Format results of a single set of steps."""
+    return format_steps(results['steps'], (baseline or {}).get('steps'))
@@ -1,5 +1,8 @@
 RATINGS_WINDOW = 60 * 40  # minutes
 
+RATING_ENGINE_RATIO = 'ratio'
+RATING_ENGINE_BRADLEY_TERRY = 'bradley_terry'
+
 GENRE_CHRISTIAN = 'christian'
 GENRE_POP_DANCE = 'pop and dance'
 GENRE_SOFT_ROCK = 'soft rock'
@@ -22,6 +25,28 @@ GENRE_CHOICES = [
     [GENRE_METAL, GENRE_METAL],
 ]
 
+LYRICS_SOURCE_AZLYRICS = 'azlyrics'
+LYRICS_SOURCE_CHARTLYRICS = 'chartlyrics'
+LYRICS_SOURCE_INSTRUMENTAL = 'instrumental'
+
+LYRICS_SOURCE_CHOICES = [
+    [LYRICS_SOURCE_AZLYRICS, LYRICS_SOURCE_AZLYRICS],
+    [LYRICS_SOURCE_CHARTLYRICS, LYRICS_SOURCE_CHARTLYRICS],
+    [LYRICS_SOURCE_INSTRUMENTAL, LYRICS_SOURCE_INSTRUMENTAL],
+]
+
+TASK_STATUS_PENDING = 'pending'
+TASK_STATUS_RUNNING = 'running'
+TASK_STATUS_DONE = 'done'
+TASK_STATUS_FAILED = 'failed'
+
+TASK_STATUS_CHOICES = [
+    [TASK_STATUS_PENDING, TASK_STATUS_PENDING],
+    [TASK_STATUS_RUNNING, TASK_STATUS_RUNNING],
+    [TASK_STATUS_DONE, TASK_STATUS_DONE],
+    [TASK_STATUS_FAILED, TASK_STATUS_FAILED],
+]
+
 BILLBOARD_CHART_ROCK = 'rock'
 BILLBOARD_CHART_ALTERNATIVE = 'alternative'
 BILLBOARD_CHART_HARD_ROCK = 'hard rock'
@@ -40,6 +65,7 @@ BILLBOARD_CHART_URLS = {
     BILLBOARD_CHART_HARD_ROCK: 'https://www.billboard.com/charts/hard-rock-albums/',
     BILLBOARD_CHART_CHRISTIAN: 'https://www.billboard.com/charts/christian-albums/',
 }
+BILLBOARD_TOP = 25
 
 AZLYRICS_ARTISTS = {
     'aperfectcircle': 'perfectcircle',
@@ -0,0 +1,102 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Tuple
+
+import requests
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from main.lastfm_service import (
+    fetch_similar_artists,
+    fetch_studio_albums,
+    save_missing_albums,
+    save_similars,
+)
+from main.models import Artist, Similar
+from main.tasks import task
+
+logger = logging.getLogger(__name__)
+
+CRAWL_DISCOGRAPHY = 'discography'
+CRAWL_SIMILARS = 'similars'
+
+# fetch runs on a worker thread without touching the database, save runs on the crawl thread
+CRAWLERS = {
+    CRAWL_DISCOGRAPHY: (fetch_studio_albums, save_missing_albums),
+    CRAWL_SIMILARS: (fetch_similar_artists, save_similars),
+}
+# set on every attempt, so artists that keep failing move to the back of the queue
+CRAWL_ATTEMPT_FIELDS = {
+    CRAWL_DISCOGRAPHY: 'disco_at',
+    CRAWL_SIMILARS: 'similars_at',
+}
+
+
+def get_work_queue(count_discographies: int, count_similars: int) -> List[Tuple[str, Artist]]:
+    """Get the next jobs: the stalest discographies and the best artists without similars."""
+    stalest_artists = Artist.objects.order_by(F('disco_at').asc(nulls_first=True))
+    jobs = [(CRAWL_DISCOGRAPHY, artist) for artist in stalest_artists[:count_discographies]]
+
+    if settings.LASTFM_ENABLE:
+        sim_artist_ids = Similar.objects.values('artist_id')
+        new_artists = Artist.objects.exclude(id__in=sim_artist_ids).order_by(
+            F('similars_at').asc(nulls_first=True), '-rating'
+        )
+        jobs += [(CRAWL_SIMILARS, artist) for artist in new_artists[:count_similars]]
+    return jobs
+
+
+def crawl_batch(count_discographies: int, count_similars: int, workers: int) -> int:
+    """Crawl a batch of jobs concurrently, saving each artist as soon as it is fetched.
+
+    Progress lives in the database (disco_at, similars_at and the similars of an artist), so
+    a stopped crawl picks up the remaining artists on the next run. Failed attempts count as
+    progress too, or artists unknown to last.fm would take a slot in every batch.
+    """
+    from pylast import PyLastError
+
+    jobs = get_work_queue(count_discographies, count_similars)
+    logger.info(f'Crawling {len(jobs)} jobs with {workers} workers')
+    count_done = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(CRAWLERS[kind][0], artist): (kind, artist) for kind, artist in jobs
+        }
+        for future in as_completed(futures):
+            kind, artist = futures[future]
+            try:
+                result = future.result()
+            except (requests.RequestException, PyLastError) as exc:
+                logger.warning(f'Failed to crawl {kind} of {artist}: {exc}')
+                Artist.objects.filter(id=artist.id).update(
+                    **{CRAWL_ATTEMPT_FIELDS[kind]: timezone.now()}
+                )
+                continue
+            CRAWLERS[kind][1](artist, result)
+            count_done += 1
+    logger.info(f'Crawled {count_done} of {len(jobs)} jobs')
+    return count_done
+
+
+def crawl(
+    discographies: int = 10,
+    similars: int = 10,
+    workers: int = 4,
+    forever: bool = False,
+    interval: float = 300,
+    **kwargs,
+):
+    """Crawl discographies and similar artists, once or every interval seconds."""
+    while True:
+        crawl_batch(discographies, similars, workers)
+        if not forever:
+            return
+        time.sleep(interval)
+
+
+@task(priority=-5, max_attempts=1, every=3600)
+def crawl_artists():
+    """Crawl a batch of discographies and similar artists every hour on the worker."""
+    crawl_batch(count_discographies=10, count_similars=10, workers=4)
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EVENT_PLAY = 'play'
+EVENT_RATING = 'rating'
+EVENT_GENRE = 'genre'
+
+# events kept to replay to reconnecting clients, and queued per client at most
+EVENT_HISTORY = 100
+# comment sent on idle streams, so proxies and browsers keep them open
+KEEPALIVE_SECONDS = 15
+# browsers reconnect after this many milliseconds when the stream drops
+RETRY_MS = 3000
+# sent by every tab with its requests, events carry it back so the tab skips its own
+TAB_ID_HEADER = 'X-Tab-Id'
+
+Event = Tuple[int, str, dict]
+
+current_origin: ContextVar[Optional[str]] = ContextVar('current_origin', default=None)
+
+
+def format_event(event: Event) -> str:
+    """Format event as a server-sent event."""
+    event_id, event_type, data = event
+    return f'id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n'
+
+
+def deliver(queue: asyncio.Queue, event: Event):
+    """Queue event for a client, dropping it when the client does not keep up."""
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        logger.warning(f'Dropped event {event[0]} for a slow client')
+
+
+class EventBroker:
+    def __init__(self):
+        """Publish events from any thread to the streams of the open tabs.
+
+        Subscribers live in this process, so events only reach tabs served by the process
+        that handled the change, like the locmem cache.
+        """
+        self.lock = threading.Lock()
+        self.last_id = 0
+        self.history = deque(maxlen=EVENT_HISTORY)
+        self.subscribers = set()
+
+    def publish(self, event_type: str, data: dict) -> int:
+        """Publish event to all subscribers, from sync code in any thread."""
+        with self.lock:
+            self.last_id += 1
+            event = (self.last_id, event_type, data)
+            self.history.append(event)
+            subscribers = list(self.subscribers)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(deliver, queue, event)
+            except RuntimeError:  # loop closed without unsubscribing
+                self.unsubscribe(loop, queue)
+        logger.debug(f'Published {event_type} event {self.last_id} to {len(subscribers)} streams')
+        return self.last_id
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> Tuple[asyncio.Queue, List[Event]]:
+        """Subscribe the running loop, with the events missed since last_event_id."""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=EVENT_HISTORY)
+        with self.lock:
+            self.subscribers.add((loop, queue))
+            missed = [e for e in self.history if last_event_id is not None and e[0] > last_event_id]
+        return queue, missed
+
+    def unsubscribe(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+        """Unsubscribe a stream."""
+        with self.lock:
+            self.subscribers.discard((loop, queue))
+
+
+broker = EventBroker()
+
+
+@contextmanager
+def published_by(request) -> Iterator[None]:
+    """Mark events published in this block as caused by the tab that sent request."""
+    token = current_origin.set(request.headers.get(TAB_ID_HEADER))
+    try:
+        yield
+    finally:
+        current_origin.reset(token)
+
+
+def publish(event_type: str, artist_ids: Iterable[int], **data) -> int:
+    """Publish event, with the artists changed so tabs can tell which fragments to refresh."""
+    return broker.publish(
+        event_type,
+        {'artist_ids': sorted(set(artist_ids)), 'origin': current_origin.get(), **data},
+    )
+
+
+async def stream_events(last_event_id: Optional[str] = None) -> AsyncIterator[str]:
+    """Stream events as they are published, after those missed by a reconnecting client."""
+    try:
+        last_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_id = None
+    queue, missed = broker.subscribe(last_id)
+    loop = asyncio.get_running_loop()
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        for event in missed:
+            yield format_event(event)
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+            except TimeoutError:
+                yield ': keepalive\n\n'
+            else:
+                yield format_event(event)
+    finally:
+        broker.unsubscribe(loop, queue)
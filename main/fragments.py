@@ -0,0 +1,91 @@
+import hashlib
+import logging
+import time
+from functools import wraps
+from typing import Callable, Iterable, List
+
+from django.core.cache import cache
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+
+logger = logging.getLogger(__name__)
+
+# bumped by scans and full stats rebuilds, every fragment depends on it
+SCOPE_LIBRARY = 'library'
+# bumped by plays, ratings and genre changes, for rankings and listings
+SCOPE_RANKINGS = 'rankings'
+# bumped by rating changes, which shift the ranks of items besides the rated ones
+SCOPE_RATINGS = 'ratings'
+
+
+def artist_scope(artist_id: int) -> str:
+    """Get scope of the fragments of an artist and its albums."""
+    return f'artist_{artist_id}'
+
+
+def version_cache_key(scope: str) -> str:
+    """Get cache key of the version counter of scope."""
+    return f'fragment_version_{scope}'
+
+
+def get_versions(scopes: List[str]) -> List[int]:
+    """Get the version counters of scopes, starting unknown ones."""
+    keys = [version_cache_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # start from the clock, so fragments cached before a restart never match
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_fragments(scopes: Iterable[str]):
+    """Invalidate the cached fragments of scopes, after an event changed their data."""
+    scopes = list(scopes)
+    for scope in scopes:
+        try:
+            cache.incr(version_cache_key(scope))
+        except ValueError:
+            cache.add(version_cache_key(scope), time.time_ns(), timeout=None)
+    logger.debug(f'Bumped fragment versions of {scopes}')
+
+
+def fragment_cache(get_scopes: Callable[..., List[str]]) -> Callable:
+    """Serve a partial from the fragment cache until the versions of its scopes change.
+
+    The cache key holds the versions of the scopes, the full path and the current song of
+    the player, which partials highlight. Responses carry its hash as ETag, so browsers
+    revalidate with a 304 instead of downloading the fragment again.
+    """
+
+    def decorator(view: Callable) -> Callable:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            scopes = [SCOPE_LIBRARY, *get_scopes(request, *args, **kwargs)]
+            versions = get_versions(scopes)
+            key_parts = [request.get_full_path(), request.player.song_id, *versions]
+            digest = hashlib.sha256(repr(key_parts).encode()).hexdigest()
+            etag = f'"{digest[:32]}"'
+            cache_key = f'fragment_{digest}'
+
+            if etag in request.headers.get('If-None-Match', ''):
+                response = HttpResponseNotModified()
+            elif (response := cache.get(cache_key)) is None:
+                response = view(request, *args, **kwargs)
+                if hasattr(response, 'render') and callable(response.render):
+                    response = response.render()
+                if response.status_code == 200:  # noqa: PLR2004
+                    cache.set(cache_key, response, timeout=None)
+            response['ETag'] = etag
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def ranking_scopes(request, *args, **kwargs) -> List[str]:
+    """Get scopes of rankings and listings, which any play or rating can reorder."""
+    return [SCOPE_RANKINGS]
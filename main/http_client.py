@@ -0,0 +1,306 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+import weakref
+from functools import cache
+from pathlib import Path
+from typing import TYPE_CHECKING, AsyncIterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+HTTP_MODE_LIVE = 'live'
+HTTP_MODE_RECORD = 'record'
+HTTP_MODE_REPLAY = 'replay'
+
+# response headers worth keeping with a cached body
+CACHED_HEADERS = ['Content-Type', 'ETag', 'Last-Modified', 'Cache-Control']
+
+
+class RateLimiter:
+    def __init__(self, intervals: Optional[dict] = None, default_interval: float = 0):
+        """Minimum seconds between requests per host, shared by all threads."""
+        self.intervals = intervals or {}
+        self.default_interval = default_interval
+        self.lock = threading.Lock()
+        self.next_at = {}
+
+    def reserve(self, host: str) -> float:
+        """Reserve the next slot for a request to host, and get the seconds until it."""
+        interval = self.intervals.get(host, self.default_interval)
+        if not interval:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at.get(host, now))
+            self.next_at[host] = at + interval
+        if at > now:
+            logger.debug(f'Rate limited {host} for {at - now:.2f}s')
+        return at - now
+
+    def wait(self, host: str):
+        """Block until the next request to host is allowed."""
+        # reserve a slot under the lock, then sleep outside of it
+        if delay := self.reserve(host):
+            time.sleep(delay)
+
+    async def await_slot(self, host: str):
+        """Wait without blocking the event loop until the next request to host is allowed."""
+        if delay := self.reserve(host):
+            await asyncio.sleep(delay)
+
+
+class HttpClient:
+    def __init__(
+        self,
+        cache_dir: Path,
+        fixtures_dir: Path,
+        mode: str = HTTP_MODE_LIVE,
+        ttls: Optional[dict] = None,
+        default_ttl: int = 3600,
+        pool_size: int = 10,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        """Shared client with pooled keep-alive connections and an on-disk response cache.
+
+        In record mode every response served is also written as a fixture, from the cache
+        too so a warm cache still records everything, and in replay
+        mode responses only come from those fixtures so scrapers can run offline.
+        """
+        self.cache_dir = cache_dir
+        self.fixtures_dir = fixtures_dir
+        self.mode = mode
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.limiter = limiter or RateLimiter()
+        self.pool_size = pool_size
+        # one async client per event loop, as connections are bound to the loop that opened them
+        self.async_clients = weakref.WeakKeyDictionary()
+        self.async_lock = threading.Lock()
+
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=['GET'],
+        )
+        # requests keeps a pool of keep-alive connections per host
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(
+        self,
+        url: str,
+        params: Optional[dict] = None,
+        timeout: float = 15,
+        refresh: bool = False,
+    ) -> requests.Response:
+        """Get url from fixtures, the cache or the network, revalidating stale entries."""
+        full_url, cached, entry, headers = self._lookup(url, params, refresh)
+        if cached is not None:
+            return cached
+
+        self.limiter.wait(urlsplit(full_url).hostname)
+        response = self.session.get(full_url, headers=headers, timeout=timeout)
+        return self._complete(full_url, entry, response)
+
+    async def aget(
+        self,
+        url: str,
+        params: Optional[dict] = None,
+        timeout: float = 15,
+        refresh: bool = False,
+    ) -> requests.Response:
+        """Get url like get, awaiting the network instead of blocking a worker thread.
+
+        Network errors are raised as their requests counterparts, so callers handle both
+        clients the same way.
+        """
+        full_url, cached, entry, headers = await asyncio.to_thread(
+            self._lookup, url, params, refresh
+        )
+        if cached is not None:
+            return cached
+
+        import httpx
+
+        await self.limiter.await_slot(urlsplit(full_url).hostname)
+        try:
+            async_response = await (await self.get_async_session()).get(
+                full_url, headers=headers, timeout=timeout
+            )
+        except httpx.TimeoutException as exc:
+            raise requests.Timeout(str(exc)) from exc
+        except httpx.HTTPError as exc:
+            raise requests.ConnectionError(str(exc)) from exc
+        meta = {
+            'url': str(async_response.url),
+            'status_code': async_response.status_code,
+            'headers': dict(async_response.headers),
+        }
+        response = self._build_response(meta, async_response.content)
+        return await asyncio.to_thread(self._complete, full_url, entry, response)
+
+    async def get_async_session(self) -> 'httpx.AsyncClient':
+        """Get the pooled async client of the running event loop.
+
+        The client is closed when its loop shuts down its async generators, as asyncio.run does
+        for ASGI servers. Under WSGI, async_to_sync runs every async view on a loop of its own,
+        so the client lives for a single request there.
+
+        httpx is imported here, only processes serving async views pay for it.
+        """
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        with self.async_lock:
+            if loop in self.async_clients:
+                return self.async_clients[loop][0]
+            client = httpx.AsyncClient(
+                transport=httpx.AsyncHTTPTransport(retries=3),
+                limits=httpx.Limits(max_connections=self.pool_size),
+                follow_redirects=True,
+            )
+            # the loop only tracks started async generators weakly, so keep the closer here
+            closer = self._close_with_loop(client)
+            self.async_clients[loop] = (client, closer)
+        await closer.asend(None)
+        return client
+
+    async def _close_with_loop(self, client: 'httpx.AsyncClient') -> AsyncIterator[None]:
+        """Wait for the running loop to shut down, then close its async client."""
+        try:
+            yield
+        finally:
+            with self.async_lock:
+                self.async_clients.pop(asyncio.get_running_loop(), None)
+            await client.aclose()
+
+    def _lookup(
+        self, url: str, params: Optional[dict], refresh: bool
+    ) -> Tuple[str, Optional[requests.Response], Optional[Tuple[dict, bytes]], dict]:
+        """Get the full url, the response when fresh or replayed, or the headers to revalidate.
+
+        The cached entry is passed along, to serve it again when the server answers 304.
+        """
+        full_url = requests.Request('GET', url, params=params).prepare().url
+        host = urlsplit(full_url).hostname
+
+        if self.mode == HTTP_MODE_REPLAY:
+            if not (entry := self._load(self.fixtures_dir, full_url)):
+                raise requests.ConnectionError(f'No fixture recorded for {full_url}')
+            return full_url, self._build_response(*entry), entry, {}
+
+        entry = self._load(self.cache_dir, full_url)
+        ttl = self.ttls.get(host, self.default_ttl)
+        headers = {}
+        if entry:
+            meta, body = entry
+            if not refresh and time.time() - meta['stored_at'] < ttl:
+                logger.debug(f'HTTP cache hit for {full_url}')
+                self._record(full_url, meta, body)
+                return full_url, self._build_response(meta, body), entry, {}
+            if etag := meta['headers'].get('ETag'):
+                headers['If-None-Match'] = etag
+            if last_modified := meta['headers'].get('Last-Modified'):
+                headers['If-Modified-Since'] = last_modified
+        return full_url, None, entry, headers
+
+    def _complete(
+        self, full_url: str, entry: Optional[Tuple[dict, bytes]], response: requests.Response
+    ) -> requests.Response:
+        """Store a fetched response, or serve the cached entry it revalidated."""
+        logger.info(f'HTTP {response.status_code} for {full_url}')
+
+        if response.status_code == 304 and entry:  # noqa: PLR2004
+            meta, body = entry
+            self._store(self.cache_dir, full_url, meta, body)
+            self._record(full_url, meta, body)
+            return self._build_response(meta, body)
+
+        if response.status_code == 200:  # noqa: PLR2004
+            headers = {k: response.headers[k] for k in CACHED_HEADERS if k in response.headers}
+            meta = {'url': response.url, 'status_code': response.status_code, 'headers': headers}
+            self._store(self.cache_dir, full_url, meta, response.content)
+            self._record(full_url, meta, response.content)
+        return response
+
+    def _record(self, full_url: str, meta: dict, body: bytes):
+        """Write response as a fixture in record mode."""
+        if self.mode == HTTP_MODE_RECORD:
+            self._store(self.fixtures_dir, full_url, meta, body)
+
+    def evict(self, url: str, params: Optional[dict] = None):
+        """Remove url from the cache, e.g. when the page turned out to be unusable."""
+        full_url = requests.Request('GET', url, params=params).prepare().url
+        for path in self._paths(self.cache_dir, full_url):
+            path.unlink(missing_ok=True)
+        logger.info(f'Evicted {full_url} from HTTP cache')
+
+    def _paths(self, base_dir: Path, full_url: str) -> Tuple[Path, Path]:
+        key = hashlib.sha256(full_url.encode()).hexdigest()
+        host_dir = base_dir / (urlsplit(full_url).hostname or 'unknown')
+        return host_dir / f'{key}.json', host_dir / f'{key}.body'
+
+    def _load(self, base_dir: Path, full_url: str) -> Optional[Tuple[dict, bytes]]:
+        meta_path, body_path = self._paths(base_dir, full_url)
+        try:
+            return json.loads(meta_path.read_text()), body_path.read_bytes()
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _store(self, base_dir: Path, full_url: str, meta: dict, body: bytes):
+        meta_path, body_path = self._paths(base_dir, full_url)
+        meta_path.parent.mkdir(parents=True, exist_ok=True)
+        meta = {**meta, 'stored_at': time.time()}
+        # write then rename, so concurrent readers never see half a file
+        for path, content in ((body_path, body), (meta_path, json.dumps(meta).encode())):
+            tmp_path = path.with_suffix(f'{path.suffix}.tmp')
+            tmp_path.write_bytes(content)
+            tmp_path.replace(path)
+
+    def _build_response(self, meta: dict, body: bytes) -> requests.Response:
+        response = requests.Response()
+        response.status_code = meta['status_code']
+        response.headers = CaseInsensitiveDict(meta['headers'])
+        response.url = meta['url']
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response._content = body
+        return response
+
+
+@cache
+def get_client() -> HttpClient:
+    """Get the shared client of this process."""
+    return HttpClient(
+        cache_dir=settings.HTTP_CACHE_DIR,
+        fixtures_dir=settings.HTTP_FIXTURES_DIR,
+        mode=settings.HTTP_MODE,
+        ttls=settings.HTTP_CACHE_TTLS,
+        default_ttl=settings.HTTP_CACHE_TTL,
+        limiter=RateLimiter(settings.HTTP_RATE_LIMITS),
+    )
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    """Get url with the shared client."""
+    return get_client().get(url, **kwargs)
+
+
+async def aget(url: str, **kwargs) -> requests.Response:
+    """Get url with the shared client, without blocking the event loop."""
+    return await get_client().aget(url, **kwargs)
@@ -1,22 +1,30 @@
 import logging
+from typing import TYPE_CHECKING, List, Optional, Tuple
 
-import requests
-from bs4 import BeautifulSoup
 from django.conf import settings
-from django.core.cache import cache
-from django.db.models import F, Max, Sum
+from django.db import transaction
 from django.utils import timezone
 from django.utils.text import slugify
-from pylast import LastFMNetwork
 from unidecode import unidecode
 
-from main.models import Album, Artist, History, Similar
+from main import http_client
+from main.models import Artist, History, MissingAlbum, Similar
+from main.rollups import record_similars
+from main.tasks import task
+
+if TYPE_CHECKING:
+    from pylast import LastFMNetwork
 
 logger = logging.getLogger(__name__)
 
+LASTFM_HOST = 'ws.audioscrobbler.com'
+
 
-def get_network() -> LastFMNetwork:
+def get_network() -> 'LastFMNetwork':
     """Get network."""
+    # pylast is slow to import, and only needed by processes that scrobble
+    from pylast import LastFMNetwork
+
     return LastFMNetwork(
         api_key=settings.LASTFM_API_KEY,
         api_secret=settings.LASTFM_SECRET,
@@ -41,46 +49,53 @@ def scrobble(history: History):
     logger.info(f'Scrobbled {history}')
 
 
-def update_next_similar_artist():
-    """Get similar albums."""
-    if not settings.LASTFM_ENABLE:
-        return
+@task(max_attempts=5)
+def scrobble_history(history_id: int):
+    """Scrobble a play in the background, retrying while last.fm is unreachable."""
+    scrobble(History.objects.select_related('song__album', 'song__artist').get(id=history_id))
 
-    # scrape artists that does not yet have similars
-    sim_artist_ids = Similar.objects.values('artist_id')
-    next_artist = Artist.objects.exclude(id__in=sim_artist_ids).order_by('-rating').first()
-
-    if next_artist:
-        logger.info(f'Getting similar artists for {next_artist}')
-        network = get_network()
-        lastfm_artist = network.get_artist(next_artist.name)
-        similar_artists = lastfm_artist.get_similar(limit=100)
-        logger.info(f'Processing {len(similar_artists)}...')
-        for similar_artist, match in similar_artists:
-            sim_artist_name = similar_artist.get_name()
-            sim_artist_slug = slugify(unidecode(sim_artist_name))
-            score = next_artist.rating * match
-            Similar.objects.create(
-                artist=next_artist,
-                artist_name=sim_artist_name,
-                artist_slug=sim_artist_slug,
-                match=match,
-                rating=next_artist.rating,
-                score=score,
-                scraped_at=timezone.now(),
-            )
-    else:
-        raise NotImplementedError('need to rehandle similar artists already done')
-
-    excluded_slugs = Artist.objects.values_list('slug', flat=True)
-    grouped_artists = (
-        Similar.objects.exclude(artist_slug__in=excluded_slugs)
-        .values('artist_slug')
-        .annotate(total_score=Sum('score'), artist_name=Max('artist_name'))
-        .order_by('-total_score')
-    )
 
-    return grouped_artists
+def fetch_similar_artists(artist: Artist) -> list:
+    """Get similar artists of artist from last.fm."""
+    http_client.get_client().limiter.wait(LASTFM_HOST)
+    network = get_network()
+    lastfm_artist = network.get_artist(artist.name)
+    similar_artists = lastfm_artist.get_similar(limit=100)
+    logger.info(f'Fetched {len(similar_artists)} similar artists of {artist}')
+    return similar_artists
+
+
+def save_similars(artist: Artist, similar_artists: list):
+    """Upsert similar artists of artist and update the candidates leaderboard."""
+    scraped_at = timezone.now()
+    similars = {}
+    for similar_artist, match in similar_artists:
+        sim_artist_name = similar_artist.get_name()
+        sim_artist_slug = slugify(unidecode(sim_artist_name))
+        if sim_artist_slug in similars and similars[sim_artist_slug].match >= match:
+            continue
+        similars[sim_artist_slug] = Similar(
+            artist=artist,
+            artist_name=sim_artist_name,
+            artist_slug=sim_artist_slug,
+            match=match,
+            rating=artist.rating,
+            score=artist.rating * match,
+            scraped_at=scraped_at,
+        )
+
+    with transaction.atomic():
+        previous_scores = dict(artist.similars.values_list('artist_slug', 'score'))
+        Similar.objects.bulk_create(
+            similars.values(),
+            update_conflicts=True,
+            unique_fields=['artist', 'artist_slug'],
+            update_fields=['artist_name', 'match', 'rating', 'score', 'scraped_at', 'updated_at'],
+        )
+        record_similars(list(similars.values()), previous_scores)
+        artist.similars_at = scraped_at
+        artist.save(update_fields=['similars_at', 'updated_at'])
+    logger.info(f'Saved {len(similars)} similar artists of {artist}')
 
 
 # class LastFm(LastFMNetwork):
@@ -140,49 +155,53 @@ def update_next_similar_artist():
 BAD_ALBUMS = ['Seether Disclaimer II', 'Nightwish Human. :II: Nature.']
 
 
-def scrape_studio_albums():
+def fetch_studio_albums(artist: Artist) -> Optional[List[Tuple[str, Optional[str]]]]:
     """Scrapes studio album names and their links from a Wikipedia discography page."""
-    cache_key = 'wiki_studio_albums'
-    if album_details := cache.get(cache_key):
-        logger.info(f'Cache found for {album_details}')
-        return album_details
-
-    artist = Artist.objects.order_by(F('disco_at').asc(nulls_first=True)).first()
     logger.info(f'Fetching studio albums from {artist.wiki_link}')
-    response = requests.get(artist.wiki_link, timeout=10)
+    response = http_client.get(artist.wiki_link, timeout=10)
     response.raise_for_status()
+    from bs4 import BeautifulSoup
+
     soup = BeautifulSoup(response.content, 'html.parser')
     album_tables = soup.find_all('table', {'class': 'wikitable'})
     if not album_tables:
-        album_details = (artist, ': cannot read wiki page')
-    else:
-        for row in album_tables[0].find_all('tr')[2:]:
-            th_cell = row.find('th')
-            if not th_cell:
-                logger.info(f'No th header for: {row.text}')
-                continue  # "—" denotes a release that did not chart or was not issued in that
-            album_title = th_cell.get_text()
-            if th_anchor := th_cell.find('a'):
-                album_link = f"https://en.wikipedia.org{th_anchor['href']}"
-            else:
-                album_link = None
-
-            album_slug = f'{artist.slug}-{slugify(unidecode(album_title))}'
-            try:
-                artist.albums.get(slug=album_slug)
-                logger.info(f'Studio album exists: {album_title}')
-            except Album.DoesNotExist:
-                logger.info(f'Missing album found: {album_title}')
-                if f'{artist.name} {album_title}' in BAD_ALBUMS:
-                    logger.info(f'Ignoring album {album_title}')
-                    continue
-                album_details = (artist, album_title, album_link)
-                cache.set(cache_key, album_details, timeout=3600)
-                break
+        logger.warning(f'Cannot read wiki page of {artist}')
+        return None
+
+    studio_albums = []
+    for row in album_tables[0].find_all('tr')[2:]:
+        th_cell = row.find('th')
+        if not th_cell:
+            logger.info(f'No th header for: {row.text}')
+            continue  # "—" denotes a release that did not chart or was not issued in that
+        album_title = th_cell.get_text()
+        if th_anchor := th_cell.find('a'):
+            album_link = f"https://en.wikipedia.org{th_anchor['href']}"
+        else:
+            album_link = None
+        studio_albums.append((album_title, album_link))
+    return studio_albums
+
+
+def save_missing_albums(artist: Artist, studio_albums: Optional[List[Tuple[str, Optional[str]]]]):
+    """Replace the missing albums of artist with the studio albums not in the library."""
+    missing_albums = []
+    for album_title, album_link in studio_albums or []:
+        album_slug = f'{artist.slug}-{slugify(unidecode(album_title))}'
+        if artist.albums.filter(slug=album_slug).exists():
+            logger.info(f'Studio album exists: {album_title}')
+        elif f'{artist.name} {album_title}' in BAD_ALBUMS:
+            logger.info(f'Ignoring album {album_title}')
         else:
-            album_details = (artist,)
-            logger.info(f'No missing studio albums found for {artist}')
+            logger.info(f'Missing album found: {album_title}')
+            missing_albums.append(
+                MissingAlbum(artist=artist, album_title=album_title, album_link=album_link)
+            )
 
-    artist.disco_at = timezone.now()
-    artist.save()
-    return album_details
+    with transaction.atomic():
+        artist.missing_albums.all().delete()
+        MissingAlbum.objects.bulk_create(missing_albums, ignore_conflicts=True)
+        # only the crawl column, plays and ratings may have changed the artist meanwhile
+        artist.disco_at = timezone.now()
+        artist.save(update_fields=['disco_at', 'updated_at'])
+    logger.info(f'Found {len(missing_albums)} missing studio albums for {artist}')
@@ -1,45 +1,64 @@
+import asyncio
+import functools
 import logging
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
+from typing import List, Optional, Tuple
 from xml.etree import ElementTree
 
 import requests
-from bs4 import BeautifulSoup
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
 from django.db.models import Max
 from django.utils import timezone
 from django.utils.text import slugify
 from unidecode import unidecode
 
+from main import http_client
 from main.constants import (
     AZLYRICS_ARTISTS,
     AZLYRICS_SONGS,
     BILLBOARD_CHART_URLS,
+    BILLBOARD_TOP,
+    LYRICS_SOURCE_AZLYRICS,
+    LYRICS_SOURCE_CHARTLYRICS,
+    LYRICS_SOURCE_INSTRUMENTAL,
 )
-from main.models import Billboard, Song
+from main.lyrics_index import index_lyrics, unindex_lyrics
+from main.models import Billboard, Lyric, Song
+from main.tasks import enqueue, get_failed_dedupe_keys, task
 
 logger = logging.getLogger(__name__)
 
+# song ids queued or being fetched by the prefetch pool
+PREFETCHING = set()
+PREFETCHING_LOCK = threading.Lock()
+
+# lyrics files of both sources end with the song id
+LYRICS_FILE_ID_RE = re.compile(r'-(\d+)\.txt$')
+
+BILLBOARD_WEEK_RE = re.compile(rb'Week of ([A-Z][a-z]+ \d{1,2}, \d{4})')
+
 
 def get_lyrics_chartlyrics(song: Song, use_cache: bool = True) -> str:
     """Get .lyric_txt from chartlyricsa api."""
-    # Define file path to store lyrics in settings.LYRICS_DIR
-    lyrics_file_path = Path(settings.LYRICS_DIR) / f'{song.artist.slug}-{song.slug}-{song.id}.txt'
-    if lyrics_file_path.exists():
-        if use_cache:
-            with Path.open(lyrics_file_path, 'r', encoding='utf-8') as file:
-                return file.read()
-        else:
-            logger.info(f'Removed existing lyrics file: {lyrics_file_path}')
-            lyrics_file_path.unlink()
+    if use_cache:
+        if (lyrics_txt := get_stored_lyrics(song.id)) is not None:
+            return lyrics_txt
+    else:
+        delete_stored_lyrics(song.id)
 
     url = 'http://api.chartlyrics.com/apiv1.asmx/SearchLyricDirect'
     params = {
         'artist': song.artist.name,
         'song': song.name,
     }
-    response = requests.get(url, params=params, timeout=15)
+    response = http_client.get(url, params=params, timeout=15, refresh=not use_cache)
     try:
         response.raise_for_status()
     except requests.RequestException as exc:
@@ -63,9 +82,7 @@ def get_lyrics_chartlyrics(song: Song, use_cache: bool = True) -> str:
         lyrics_txt = f'{artist_el.text} - {song_el.text}\n\n{lyrics_txt}'
         # store text
         if use_cache:
-            with Path.open(lyrics_file_path, 'w', encoding='utf-8') as file:
-                file.write(lyrics_txt)
-            logger.info(f'{len(lyrics_txt)} Lyrics written to {lyrics_file_path}')
+            store_lyrics(song, lyrics_txt, LYRICS_SOURCE_CHARTLYRICS)
         return lyrics_txt
     else:
         return 'Lyrics not found.'
@@ -95,36 +112,221 @@ def clean_text_with_paragraphs(html_text):
     return clean_text
 
 
-def search_azlyrics(song: Song, refresh: bool = False, instrument: bool = False) -> str:
-    """Scrape AZ Lyrics."""
+def get_azlyrics_names(song: Song) -> Tuple[str, str]:
+    """Get artist and song name as used in AZ Lyrics urls."""
     artist_name = unidecode(song.artist.name.casefold())
     artist_name = re.sub(r'[^a-z0-9]', '', artist_name)
     song_name = unidecode(song.name.casefold())
     song_name = re.sub(r'[^a-z0-9]', '', song_name)
-    lyrics_file_path = Path(settings.LYRICS_DIR) / f'{artist_name}-{song_name}-{song.id}.txt'
+    return artist_name, song_name
 
-    if lyrics_file_path.exists():
-        if refresh or instrument:
-            logger.info(f'Removed existing lyrics file: {lyrics_file_path}')
-            lyrics_file_path.unlink()
-        else:
-            with Path.open(lyrics_file_path, 'r', encoding='utf-8') as file:
-                return file.read()
+
+def get_stored_lyrics(song_id: int) -> Optional[str]:
+    """Get lyrics of song from the lyrics store."""
+    lyric = Lyric.objects.filter(song_id=song_id).only('text_compressed').first()
+    return lyric.text if lyric else None
+
+
+async def aget_stored_lyrics(song_id: int) -> Optional[str]:
+    """Get lyrics of song from the lyrics store, with the async ORM."""
+    lyric = await Lyric.objects.filter(song_id=song_id).only('text_compressed').afirst()
+    return lyric.text if lyric else None
+
+
+def store_lyrics(song: Song, lyrics: str, source: str, fetched_at: Optional[datetime] = None):
+    """Save lyrics of song compressed in the lyrics store."""
+    lyric = Lyric(source=source, fetched_at=fetched_at or timezone.now())
+    lyric.text = lyrics
+    with transaction.atomic():
+        Lyric.objects.update_or_create(
+            song=song,
+            defaults={
+                'text_compressed': lyric.text_compressed,
+                'source': lyric.source,
+                'fetched_at': lyric.fetched_at,
+            },
+        )
+        index_lyrics(song.id, lyrics)
+    logger.info(f'{len(lyrics)} Lyrics stored for {song}')
+
+
+def delete_stored_lyrics(song_id: int):
+    """Remove lyrics of song from the lyrics store."""
+    with transaction.atomic():
+        deleted, _ = Lyric.objects.filter(song_id=song_id).delete()
+        unindex_lyrics(song_id)
+    if deleted:
+        logger.info(f'Removed stored lyrics of song {song_id}')
+
+
+def lyrics_failure_key(song_id: int) -> str:
+    """Get cache key of a failed lyrics search."""
+    return f'lyrics_failure_{song_id}'
+
+
+def lyrics_task_key(song_id: int) -> str:
+    """Get dedupe key of the task prefetching lyrics of song."""
+    return f'lyrics_{song_id}'
+
+
+def search_azlyrics(song: Song, refresh: bool = False, instrument: bool = False) -> str:
+    """Scrape AZ Lyrics."""
+    artist_name, song_name = get_azlyrics_names(song)
+
+    if not refresh and not instrument and (lyrics := get_stored_lyrics(song.id)) is not None:
+        return lyrics
+
+    # do not hammer AZ Lyrics for songs it failed on recently
+    failure_key = lyrics_failure_key(song.id)
+    if not refresh and not instrument and (failure := cache.get(failure_key)):
+        raise ValueError(f'{failure} (failed recently, refresh to retry)')
 
     if instrument:
         lyrics = f'{artist_name} - {song_name}\n\n[Instrumental]'
+        source = LYRICS_SOURCE_INSTRUMENTAL
     else:
-        lyrics_txt = scrape_azlyrics(artist_name, song_name)
+        try:
+            lyrics_txt = scrape_azlyrics(artist_name, song_name, refresh=refresh)
+        except (requests.RequestException, ValueError) as exc:
+            cache.set(failure_key, str(exc), timeout=settings.LYRICS_FAILURE_TTL)
+            raise
+        cache.delete(failure_key)
         lyrics = clean_text_with_paragraphs(lyrics_txt)
+        source = LYRICS_SOURCE_AZLYRICS
 
-    with Path.open(lyrics_file_path, 'w', encoding='utf-8') as file:
-        file.write(lyrics)
-    logger.info(f'{len(lyrics)} Lyrics written to {lyrics_file_path}')
+    store_lyrics(song, lyrics, source)
 
     return lyrics
 
 
-def scrape_azlyrics(artist_name: str, song_name: str) -> str:
+async def asearch_azlyrics(song: Song, refresh: bool = False, instrument: bool = False) -> str:
+    """Scrape AZ Lyrics like search_azlyrics, awaiting the page instead of blocking."""
+    if instrument:
+        return await sync_to_async(search_azlyrics)(song, refresh, instrument)
+
+    if not refresh and (lyrics := await aget_stored_lyrics(song.id)) is not None:
+        return lyrics
+
+    failure_key = lyrics_failure_key(song.id)
+    if not refresh and (failure := await cache.aget(failure_key)):
+        raise ValueError(f'{failure} (failed recently, refresh to retry)')
+
+    artist_name, song_name = get_azlyrics_names(song)
+    try:
+        lyrics_txt = await ascrape_azlyrics(artist_name, song_name, refresh=refresh)
+    except (requests.RequestException, ValueError) as exc:
+        await cache.aset(failure_key, str(exc), timeout=settings.LYRICS_FAILURE_TTL)
+        raise
+    await cache.adelete(failure_key)
+    lyrics = clean_text_with_paragraphs(lyrics_txt)
+
+    # the store writes the search index in a transaction, which the async ORM cannot
+    await sync_to_async(store_lyrics)(song, lyrics, LYRICS_SOURCE_AZLYRICS)
+
+    return lyrics
+
+
+@functools.cache
+def get_prefetch_executor() -> ThreadPoolExecutor:
+    """Get the bounded pool that prefetches lyrics."""
+    return ThreadPoolExecutor(
+        max_workers=settings.LYRICS_PREFETCH_WORKERS, thread_name_prefix='lyrics'
+    )
+
+
+def fetch_lyrics(song: Song):
+    """Fetch lyrics of song into the lyrics store, failures are kept by search_azlyrics."""
+    try:
+        search_azlyrics(song)
+    except (requests.RequestException, ValueError) as exc:
+        logger.info(f'Prefetching lyrics of {song} failed: {exc}')
+    finally:
+        with PREFETCHING_LOCK:
+            PREFETCHING.discard(song.id)
+        # worker threads get their own connection, do not leave it open
+        connection.close()
+
+
+@task(priority=-1, max_attempts=1)
+def prefetch_song_lyrics(song_id: int):
+    """Fetch lyrics of song on the worker.
+
+    Failures are raised, the failed task tells other processes not to queue it again.
+    """
+    search_azlyrics(Song.objects.get(id=song_id))
+
+
+def prefetch_lyrics(songs: List[Song]):
+    """Fetch lyrics of songs in the background, unless fetched or failed before.
+
+    Songs are queued for the worker when tasks are async, otherwise fetched by a pool of
+    this process. The artists of songs are loaded here, the pool only stores the lyrics.
+    """
+    stored_ids = set(Lyric.objects.filter(song__in=songs).values_list('song_id', flat=True))
+    failed_keys = set()
+    if settings.TASKS_ASYNC:
+        # the worker caches its failures in its own process, its failed tasks are shared
+        task_keys = [lyrics_task_key(song.id) for song in songs]
+        failed_keys = get_failed_dedupe_keys(task_keys, settings.LYRICS_FAILURE_TTL)
+    for song in songs:
+        if song.id in stored_ids or cache.get(lyrics_failure_key(song.id)):
+            continue
+        if settings.TASKS_ASYNC:
+            if lyrics_task_key(song.id) not in failed_keys:
+                enqueue(prefetch_song_lyrics, song_id=song.id, dedupe_key=lyrics_task_key(song.id))
+            continue
+        with PREFETCHING_LOCK:
+            if song.id in PREFETCHING:
+                continue
+            PREFETCHING.add(song.id)
+        logger.info(f'Prefetching lyrics of {song}')
+        get_prefetch_executor().submit(fetch_lyrics, song)
+
+
+def import_lyrics_files(*args, delete: bool = False, **kwargs):
+    """Import the lyrics files of the lyrics folder into the lyrics store."""
+    lyrics_paths = {}
+    for lyrics_path in Path(settings.LYRICS_DIR).glob('*.txt'):
+        if match := LYRICS_FILE_ID_RE.search(lyrics_path.name):
+            lyrics_paths[int(match.group(1))] = lyrics_path
+    songs = Song.objects.filter(id__in=lyrics_paths).select_related('artist').in_bulk()
+    stored_ids = set(Lyric.objects.filter(song__in=songs).values_list('song_id', flat=True))
+
+    lyrics = []
+    for song_id, lyrics_path in lyrics_paths.items():
+        if not (song := songs.get(song_id)):
+            logger.warning(f'No song {song_id} for {lyrics_path.name}')
+            continue
+        if song_id in stored_ids:
+            logger.info(f'Lyrics of {song} already stored')
+            continue
+        lyrics_txt = lyrics_path.read_text(encoding='utf-8')
+        if lyrics_txt.endswith('[Instrumental]'):
+            source = LYRICS_SOURCE_INSTRUMENTAL
+        elif lyrics_path.name == f'{song.artist.slug}-{song.slug}-{song.id}.txt':
+            source = LYRICS_SOURCE_CHARTLYRICS
+        else:
+            source = LYRICS_SOURCE_AZLYRICS
+        mtime = datetime.fromtimestamp(
+            lyrics_path.stat().st_mtime, tz=timezone.get_current_timezone()
+        )
+        lyric = Lyric(song=song, source=source, fetched_at=mtime)
+        lyric.text = lyrics_txt
+        lyrics.append(lyric)
+
+    with transaction.atomic():
+        Lyric.objects.bulk_create(lyrics, batch_size=500)
+        for lyric in lyrics:
+            index_lyrics(lyric.song_id, lyric.text)
+    logger.info(f'Imported {len(lyrics)} of {len(lyrics_paths)} lyrics files')
+
+    if delete:
+        for song_id in stored_ids.union(lyric.song_id for lyric in lyrics):
+            lyrics_paths[song_id].unlink()
+        logger.info(f'Removed imported lyrics files from {settings.LYRICS_DIR}')
+
+
+def scrape_azlyrics(artist_name: str, song_name: str, refresh: bool = False) -> str:
     """Search AZ lyrics for song."""
     # url = 'https://search.azlyrics.com/search.php'
     #
@@ -150,6 +352,23 @@ def scrape_azlyrics(artist_name: str, song_name: str) -> str:
     # url_page = first_row['href']
     # logger.info(f'AZLyrics: found page: {url_page}')
 
+    url_page = get_azlyrics_url(artist_name, song_name)
+    res_l = http_client.get(url_page, timeout=15, refresh=refresh)
+    res_l.raise_for_status()
+    return parse_azlyrics(res_l.content, url_page)
+
+
+async def ascrape_azlyrics(artist_name: str, song_name: str, refresh: bool = False) -> str:
+    """Get lyrics page of song from AZ lyrics without blocking the event loop."""
+    url_page = get_azlyrics_url(artist_name, song_name)
+    res_l = await http_client.aget(url_page, timeout=15, refresh=refresh)
+    res_l.raise_for_status()
+    # parsing a whole page takes a while, keep the loop serving other requests
+    return await asyncio.to_thread(parse_azlyrics, res_l.content, url_page)
+
+
+def get_azlyrics_url(artist_name: str, song_name: str) -> str:
+    """Get url of the lyrics page of song on AZ lyrics."""
     # Check if the name starts with 'the ' and remove it
     if artist_name.startswith('the'):
         artist_name = artist_name[3:]
@@ -161,16 +380,21 @@ def scrape_azlyrics(artist_name: str, song_name: str) -> str:
         song_name = AZLYRICS_SONGS[song_name]
     # logger.info(f'AZLyrics: song name: {song_name}')
 
-    # get lyrics
-    url_page = f'https://www.azlyrics.com/lyrics/{artist_name}/{song_name}.html'
-    res_l = requests.get(url_page, timeout=15)
-    res_l.raise_for_status()
-    soup = BeautifulSoup(res_l.content, 'html.parser')
+    return f'https://www.azlyrics.com/lyrics/{artist_name}/{song_name}.html'
+
+
+def parse_azlyrics(content: bytes, url_page: str) -> str:
+    """Parse lyrics from an AZ lyrics page, evicting unusable pages from the cache."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, 'html.parser')
     main_div = soup.find('div', class_='container main-page')
     if 'detected unusual activity from your IP address' in soup.text:
+        http_client.get_client().evict(url_page)
         raise ValueError('Browser check required!')
     b_tags = main_div.find_all('b')
     if len(b_tags) < 2:  # noqa: PLR2004
+        http_client.get_client().evict(url_page)
         logger.info(f'{soup.prettify()}')
         logger.info(b_tags)
         raise ValueError(f'not enough b_tags: {len(b_tags)}')
@@ -182,6 +406,57 @@ def scrape_azlyrics(artist_name: str, song_name: str) -> str:
     return lyrics
 
 
+def parse_billboard(content: bytes, chart: str) -> List[Billboard]:
+    """Parse the top of a billboard chart page into unsaved rows."""
+    # the date is plain text, so a regex on the raw page beats walking the tree
+    date_match = BILLBOARD_WEEK_RE.search(content)
+    chart_day = datetime.strptime(date_match.group(1).decode(), '%B %d, %Y')
+    chart_at = timezone.make_aware(chart_day.replace(hour=23, minute=59, second=59))
+
+    # only build the tree of the chart rows, not of the whole page
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    strainer = SoupStrainer('div', class_='o-chart-results-list-row-container')
+    soup = BeautifulSoup(content, 'html.parser', parse_only=strainer)
+    scraped_at = timezone.now()
+    billboards = []
+    for row in soup.find_all('div', recursive=False)[:BILLBOARD_TOP]:
+        lis = row.find_all('li')
+        pos_str = lis[0].text
+        pos = int(re.search(r'\d+', pos_str).group())
+        artist_name = lis[4].find('span').text.strip()
+        img = lis[1].find('img')['src']
+        album_name = lis[4].find('h3').text.strip()
+        last_week = lis[7].text.strip()
+        last_week = None if last_week == '-' else int(last_week)
+
+        billboards.append(
+            Billboard(
+                chart=chart,
+                artist_slug=slugify(unidecode(artist_name)),
+                album_slug=slugify(unidecode(album_name)),
+                pos=pos,
+                artist_name=artist_name,
+                album_name=album_name,
+                chart_at=chart_at,
+                img_src=img,
+                last_week=last_week,
+                peak_pos=int(lis[8].text),
+                wks_on_chart=int(lis[9].text),
+                scraped_at=scraped_at,
+            )
+        )
+    return billboards
+
+
+def fetch_billboard(chart: str, url: str) -> List[Billboard]:
+    """Fetch and parse a billboard chart."""
+    logger.info(f'Scraping billboard {chart}: {url}')
+    res = http_client.get(url, timeout=30)
+    res.raise_for_status()
+    return parse_billboard(res.content, chart)
+
+
 def scrape_billboards(*args, **kwargs):
     """Get top rock albums from billboard."""
     latest_charts = Billboard.objects.values('chart').annotate(latest_chart_at=Max('chart_at'))
@@ -190,47 +465,37 @@ def scrape_billboards(*args, **kwargs):
         logger.info('All billboards already scraped.')
         return
 
-    for chart, url in BILLBOARD_CHART_URLS.items():
-        logger.info(f'Scraping billboard {chart}: {url}')
-        res = requests.get(url, timeout=30)
-        res.raise_for_status()
-
-        soup = BeautifulSoup(res.content, 'html.parser')
-        # get date of chart
-        date_str = soup.find(string=re.compile('Week of ')).text
-        chart_day = datetime.strptime(date_str.replace('Week of', '').strip(), '%B %d, %Y')
-        chart_at = chart_day.replace(hour=23, minute=59, second=59)
-
-        rows = soup.find_all('div', class_='o-chart-results-list-row-container')
-        for ix, row in enumerate(rows):
-            if ix >= 25:  # noqa: PLR2004
-                break
-            lis = row.find_all('li')
-            pos_str = lis[0].text
-            pos = int(re.search(r'\d+', pos_str).group())
-            artist_name = lis[4].find('span').text.strip()
-            img = lis[1].find('img')['src']
-            album_name = lis[4].find('h3').text.strip()
-            last_week = lis[7].text.strip()
-            last_week = None if last_week == '-' else int(last_week)
-            peak_pos = int(lis[8].text)
-            wks_on_chart = int(lis[9].text)
-
-            billboard, _ = Billboard.objects.update_or_create(
-                chart=chart,
-                artist_slug=slugify(unidecode(artist_name)),
-                album_slug=slugify(unidecode(album_name)),
-                defaults={
-                    'pos': pos,
-                    'artist_name': artist_name,
-                    'album_name': album_name,
-                    'chart_at': chart_at,
-                    'img_src': img,
-                    'last_week': last_week,
-                    'peak_pos': peak_pos,
-                    'wks_on_chart': wks_on_chart,
-                    'scraped_at': timezone.now(),
-                },
+    # fetch all charts at once, but keep writing to the database on this thread
+    with ThreadPoolExecutor(max_workers=len(BILLBOARD_CHART_URLS)) as executor:
+        charts = executor.map(
+            fetch_billboard, BILLBOARD_CHART_URLS.keys(), BILLBOARD_CHART_URLS.values()
+        )
+        for chart, billboards in zip(BILLBOARD_CHART_URLS, charts, strict=True):
+            if not billboards:
+                logger.warning(f'No albums parsed from the {chart} chart')
+                continue
+            Billboard.objects.bulk_create(
+                billboards,
+                update_conflicts=True,
+                unique_fields=['chart', 'artist_slug', 'album_slug'],
+                update_fields=[
+                    'pos',
+                    'artist_name',
+                    'album_name',
+                    'chart_at',
+                    'img_src',
+                    'last_week',
+                    'peak_pos',
+                    'wks_on_chart',
+                    'scraped_at',
+                    'updated_at',
+                ],
             )
-            logger.info(f'Processed {billboard}')
+            logger.info(f'Processed {len(billboards)} albums of {chart}')
     logger.info('Finished scraping billboards!')
+
+
+@task(every=6 * 3600)
+def refresh_billboards():
+    """Scrape the billboard charts when a new week is out."""
+    scrape_billboards()
@@ -0,0 +1,86 @@
+import logging
+import re
+from typing import List, Optional
+
+from django.db import connection, transaction
+
+from main.models import Lyric, Song
+
+logger = logging.getLogger(__name__)
+
+# FTS5 table with its own uncompressed copy of the lyrics of main_lyric, keyed by song id
+LYRICS_FTS_TABLE = 'main_lyric_fts'
+SEARCH_LIMIT = 50
+
+
+def index_lyrics(song_id: int, text: str):
+    """Add or replace lyrics of song in the full-text index."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {LYRICS_FTS_TABLE} WHERE rowid = %s', [song_id])  # noqa: S608
+        cursor.execute(
+            f'INSERT INTO {LYRICS_FTS_TABLE} (rowid, text) VALUES (%s, %s)',  # noqa: S608
+            [song_id, text],
+        )
+
+
+def unindex_lyrics(song_id: int):
+    """Remove lyrics of song from the full-text index."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {LYRICS_FTS_TABLE} WHERE rowid = %s', [song_id])  # noqa: S608
+
+
+def rebuild_lyrics_index(*args, **kwargs):
+    """Rebuild the full-text index from the lyrics store."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {LYRICS_FTS_TABLE}')  # noqa: S608
+        count = 0
+        for lyric in Lyric.objects.iterator(chunk_size=500):
+            cursor.execute(
+                f'INSERT INTO {LYRICS_FTS_TABLE} (rowid, text) VALUES (%s, %s)',  # noqa: S608
+                [lyric.song_id, lyric.text],
+            )
+            count += 1
+    logger.info(f'Indexed lyrics of {count} songs')
+
+
+def to_match_query(query: str) -> Optional[str]:
+    """Turn typed text into an FTS5 query matching all words, the last one as a prefix."""
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def get_matching_line(text: str, query: str) -> str:
+    """Get the first line of text with the longest word of query."""
+    longest_word = max(re.findall(r'\w+', query), key=len).casefold()
+    for line in text.splitlines():
+        if longest_word in line.casefold():
+            return line.strip()
+    return ''
+
+
+def search_lyrics(query: str, limit: int = SEARCH_LIMIT) -> List[Song]:
+    """Get songs with lyrics matching query, best bm25 rank first."""
+    if not (match_query := to_match_query(query)):
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {LYRICS_FTS_TABLE} WHERE {LYRICS_FTS_TABLE} MATCH %s '  # noqa: S608
+            f'ORDER BY rank LIMIT %s',
+            [match_query, limit],
+        )
+        song_ids = [row[0] for row in cursor.fetchall()]
+
+    songs = Song.objects.select_related('artist', 'album', 'lyric').in_bulk(song_ids)
+    ranked_songs = []
+    for song_id in song_ids:
+        # the index can outlive deleted songs until it is rebuilt
+        song = songs.get(song_id)
+        if song and hasattr(song, 'lyric'):
+            song.matching_line = get_matching_line(song.lyric.text, query)
+            ranked_songs.append(song)
+    logger.info(f'Found {len(ranked_songs)} songs with lyrics matching {match_query}')
+    return ranked_songs
@@ -0,0 +1,172 @@
+import json
+import logging
+from pathlib import Path
+
+from django.core.management import BaseCommand, CommandError
+
+from main.benchmarks import (
+    bench_asgi,
+    bench_billboard,
+    bench_compression,
+    bench_loop,
+    bench_matches,
+    bench_ratings,
+    bench_startup,
+    format_asgi_results,
+    format_compression_results,
+    format_loop_results,
+    format_match_results,
+    format_rating_results,
+    format_startup_results,
+    format_step_results,
+    save_results,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run benchmarks against throwaway databases and save the results as JSON.'
+
+    def add_arguments(self, parser):
+        """Add arguments."""
+        subparsers = parser.add_subparsers(
+            title='sub-commands',
+            required=True,
+        )
+
+        # Listening loop parser
+        loop_parser = subparsers.add_parser(
+            'loop',
+            help='Benchmark next song, plays, matches and ratings.',
+        )
+        loop_parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[1_000, 10_000],
+            help='Library sizes in songs to seed.',
+        )
+        loop_parser.add_argument('--iterations', type=int, default=50)
+        loop_parser.add_argument('--seed', type=int, default=1)
+        loop_parser.set_defaults(method=bench_loop, formatter=format_loop_results)
+
+        # Billboard parser
+        billboard_parser = subparsers.add_parser(
+            'billboard',
+            help='Benchmark parsing of recorded billboard chart pages.',
+        )
+        billboard_parser.add_argument('--iterations', type=int, default=20)
+        billboard_parser.set_defaults(method=bench_billboard, formatter=format_step_results)
+
+        # Rating engines parser
+        ratings_parser = subparsers.add_parser(
+            'ratings',
+            help='Benchmark convergence of the rating engines on a replayed rating history.',
+        )
+        ratings_parser.add_argument('--size', type=int, default=2_000, help='Songs to seed.')
+        ratings_parser.add_argument(
+            '--ratings-per-song',
+            type=float,
+            default=12,
+            help='Ratings per song in the seeded history.',
+        )
+        ratings_parser.add_argument('--top', type=int, default=100, help='Top songs to compare.')
+        ratings_parser.add_argument('--seed', type=int, default=1)
+        ratings_parser.set_defaults(method=bench_ratings, formatter=format_rating_results)
+
+        # Match selection parser
+        matches_parser = subparsers.add_parser(
+            'matches',
+            help='Simulate offline how many comparisons the match selectors need.',
+        )
+        matches_parser.add_argument('--songs', type=int, default=2_000, help='Songs to simulate.')
+        matches_parser.add_argument('--top', type=int, default=100, help='Top songs to find.')
+        matches_parser.add_argument(
+            '--window',
+            type=int,
+            default=10,
+            help='Recently played songs to pick matches from.',
+        )
+        matches_parser.add_argument(
+            '--target',
+            type=float,
+            default=0.7,
+            help='Share of the true top songs that counts as stable.',
+        )
+        matches_parser.add_argument('--seed', type=int, default=1)
+        matches_parser.set_defaults(method=bench_matches, formatter=format_match_results)
+
+        # Compression parser
+        compression_parser = subparsers.add_parser(
+            'compression',
+            help='Measure bytes saved by compressing the partials and tables per endpoint.',
+        )
+        compression_parser.add_argument('--size', type=int, default=2_000, help='Songs to seed.')
+        compression_parser.add_argument('--iterations', type=int, default=20)
+        compression_parser.add_argument('--seed', type=int, default=1)
+        compression_parser.set_defaults(
+            method=bench_compression, formatter=format_compression_results
+        )
+
+        # ASGI parser
+        asgi_parser = subparsers.add_parser(
+            'asgi',
+            help='Compare player latency under WSGI threads and ASGI while lyrics are fetched.',
+        )
+        asgi_parser.add_argument('--size', type=int, default=1_000, help='Songs to seed.')
+        asgi_parser.add_argument('--iterations', type=int, default=20, help='Songs to play.')
+        asgi_parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='Tabs fetching lyrics while playing.',
+        )
+        asgi_parser.add_argument(
+            '--threads',
+            type=int,
+            default=4,
+            help='Threads serving requests in the WSGI run.',
+        )
+        asgi_parser.add_argument(
+            '--delay',
+            type=float,
+            default=0.5,
+            help='Seconds the simulated lyrics site takes to answer.',
+        )
+        asgi_parser.add_argument('--seed', type=int, default=1)
+        asgi_parser.set_defaults(method=bench_asgi, formatter=format_asgi_results)
+
+        # Startup parser
+        startup_parser = subparsers.add_parser(
+            'startup',
+            help='Measure import time of fresh processes with -X importtime, against a budget.',
+        )
+        startup_parser.add_argument('--iterations', type=int, default=5)
+        startup_parser.add_argument(
+            '--budget',
+            type=float,
+            default=450,
+            help='Import time in ms a serving process may take, fails the command beyond it.',
+        )
+        startup_parser.add_argument('--top', type=int, default=10, help='Heaviest packages.')
+        startup_parser.set_defaults(method=bench_startup, formatter=format_startup_results)
+
+        for sub_parser in subparsers.choices.values():
+            sub_parser.add_argument('--output', type=Path, help='JSON file to save results to.')
+            sub_parser.add_argument(
+                '--compare',
+                type=Path,
+                help='JSON results of a previous run to compare against.',
+            )
+
+    def handle(self, *args, method, formatter, output, compare, **options):
+        """Run cmd."""
+        results = method(*args, **options)
+        baseline = json.loads(compare.read_text()) if compare else None
+        for line in formatter(results, baseline):
+            self.stdout.write(line)
+        output = save_results(results, output)
+        self.stdout.write(f'Results saved to {output}')
+        if results.get('failures'):
+            raise CommandError(f'{len(results["failures"])} benchmark checks failed')
@@ -0,0 +1,37 @@
+import logging
+
+from django.core.management import BaseCommand
+
+from main.crawler import crawl
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Crawl wikipedia discographies and last.fm similar artists in the background.'
+
+    def add_arguments(self, parser):
+        """Add arguments."""
+        parser.add_argument(
+            '--discographies',
+            type=int,
+            default=10,
+            help='Artists with the stalest discography to crawl per batch.',
+        )
+        parser.add_argument(
+            '--similars',
+            type=int,
+            default=10,
+            help='Artists without similar artists to crawl per batch.',
+        )
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent fetches.')
+        parser.add_argument(
+            '--forever',
+            action='store_true',
+            help='Keep crawling a batch every interval.',
+        )
+        parser.add_argument('--interval', type=float, default=300, help='Seconds between batches.')
+
+    def handle(self, *args, **options):
+        """Run cmd."""
+        crawl(**options)
@@ -2,8 +2,11 @@ import logging
 
 from django.core.management import BaseCommand
 
-from main.lyrics import scrape_billboards
+from main.lyrics import import_lyrics_files, scrape_billboards
+from main.lyrics_index import rebuild_lyrics_index
 from main.musicfiles import recheck_metadata, scan_directory, validate_songs
+from main.rollups import rebuild_rollups
+from main.stats import rebuild_all_stats
 
 logger = logging.getLogger(__name__)
 
@@ -52,6 +55,39 @@ class Command(BaseCommand):
         )
         scrape_parser.set_defaults(method=scrape_billboards)
 
+        # Rebuild rollups parser
+        rollups_parser = subparsers.add_parser(
+            'rebuildrollups',
+            help='Rebuild the stats rollups.',
+        )
+        rollups_parser.set_defaults(method=rebuild_rollups)
+
+        # Rebuild stats parser
+        stats_parser = subparsers.add_parser(
+            'rebuildstats',
+            help='Rebuild play and rating stats of all songs, albums and artists.',
+        )
+        stats_parser.set_defaults(method=rebuild_all_stats)
+
+        # Import lyrics parser
+        lyrics_parser = subparsers.add_parser(
+            'importlyrics',
+            help='Import lyrics files into the lyrics store.',
+        )
+        lyrics_parser.add_argument(
+            '--delete',
+            action='store_true',
+            help='Delete the lyrics files once imported',
+        )
+        lyrics_parser.set_defaults(method=import_lyrics_files)
+
+        # Reindex lyrics parser
+        reindex_parser = subparsers.add_parser(
+            'reindexlyrics',
+            help='Rebuild the full-text index of the lyrics store.',
+        )
+        reindex_parser.set_defaults(method=rebuild_lyrics_index)
+
     def handle(self, *args, method, **options):
         """Run cmd."""
         method(*args, **options)
@@ -0,0 +1,56 @@
+import logging
+from pathlib import Path
+
+from django.core.management import BaseCommand
+
+from main.ratings import compact_ratings, rebuild_rating_pairs
+from main.strengths import refit_strengths
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Maintain the rating log and the pairwise results.'
+
+    def add_arguments(self, parser):
+        """Add arguments."""
+        subparsers = parser.add_subparsers(
+            title='sub-commands',
+            required=True,
+        )
+
+        # Compact parser
+        compact_parser = subparsers.add_parser(
+            'compact',
+            help='Archive old ratings and remove them from the rating log.',
+        )
+        compact_parser.add_argument(
+            '--days',
+            type=int,
+            default=90,
+            help='Keep ratings of the last days in the log.',
+        )
+        compact_parser.add_argument(
+            '--archive-dir',
+            type=Path,
+            help='Folder to write the gzipped archive to.',
+        )
+        compact_parser.set_defaults(method=compact_ratings)
+
+        # Rebuild pairs parser
+        pairs_parser = subparsers.add_parser(
+            'rebuildpairs',
+            help='Rebuild the pairwise results from the rating log (loses compacted ratings).',
+        )
+        pairs_parser.set_defaults(method=rebuild_rating_pairs)
+
+        # Refit strengths parser
+        strengths_parser = subparsers.add_parser(
+            'refit',
+            help='Refit the bradley-terry strengths of all songs and rebuild the stats.',
+        )
+        strengths_parser.set_defaults(method=refit_strengths)
+
+    def handle(self, *args, method, **options):
+        """Run cmd."""
+        method(*args, **options)
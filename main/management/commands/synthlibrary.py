@@ -0,0 +1,90 @@
+import logging
+import tempfile
+from pathlib import Path
+
+from django.core.management import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from main.models import Song
+from main.musicfiles import scan_directory
+from main.synthetic import generate_library, seed_library_activity
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic music library for load and scale testing.'
+
+    def add_arguments(self, parser):
+        """Add arguments."""
+        parser.add_argument(
+            '--songs',
+            type=int,
+            default=1_000,
+            help='Number of songs to generate (1k to 1M).',
+        )
+        parser.add_argument(
+            '--files',
+            action='store_true',
+            help='Write tiny mp3 files with ID3 tags instead of inserting rows.',
+        )
+        parser.add_argument(
+            '--music-dir',
+            type=Path,
+            help='Folder to write mp3 files into, defaults to a new temp folder.',
+        )
+        parser.add_argument(
+            '--scan',
+            action='store_true',
+            help='Scan the mp3 files into the database and seed their activity. Like a normal '
+            'scan this removes songs that have no file in the music folder.',
+        )
+        parser.add_argument(
+            '--no-activity',
+            action='store_false',
+            dest='activity',
+            help='Do not create play history and ratings.',
+        )
+        parser.add_argument('--plays-per-song', type=float, default=4)
+        parser.add_argument('--ratings-per-song', type=float, default=6)
+        parser.add_argument('--days', type=int, default=365, help='Days of play history.')
+        parser.add_argument('--seed', type=int, help='Random seed for repeatable libraries.')
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Generate even if the database already has songs.',
+        )
+
+    def handle(self, *args, **options):
+        """Run cmd."""
+        writes_rows = not options['files'] or options['scan']
+        if writes_rows and not options['force'] and Song.objects.exists():
+            raise CommandError('Database already has songs, use --force to add synthetic ones.')
+
+        activity_kwargs = {
+            'plays_per_song': options['plays_per_song'],
+            'ratings_per_song': options['ratings_per_song'],
+            'days': options['days'],
+        }
+
+        if not options['files']:
+            cnt = generate_library(
+                options['songs'],
+                seed=options['seed'],
+                activity=options['activity'],
+                **activity_kwargs,
+            )
+            self.stdout.write(f'Inserted {cnt} synthetic songs.')
+            return
+
+        music_dir = options['music_dir'] or Path(tempfile.mkdtemp(prefix='speler2-music-'))
+        cnt = generate_library(options['songs'], seed=options['seed'], music_dir=music_dir)
+        self.stdout.write(f'Wrote {cnt} synthetic mp3 files to {music_dir}')
+        if options['scan']:
+            with override_settings(MUSIC_DIR=music_dir):
+                scan_directory()
+            if options['activity']:
+                seed_library_activity(seed=options['seed'], **activity_kwargs)
+            self.stdout.write(f'Scanned {Song.objects.count()} songs from {music_dir}')
+        else:
+            self.stdout.write(f'Scan them with MUSIC_DIR={music_dir} manage.py parsemusic scan')
@@ -0,0 +1,18 @@
+import logging
+
+from django.core.management import BaseCommand
+
+from main.warmup import warm_cache
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Precompute priority values, ranks, charts and the next songs. Cached values only '
+        'outlive the command with a shared cache backend, lyrics and album art are stored.'
+    )
+
+    def handle(self, *args, **options):
+        """Run cmd."""
+        warm_cache(**options)
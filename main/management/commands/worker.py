@@ -0,0 +1,23 @@
+import logging
+
+from django.core.management import BaseCommand
+
+from main.tasks import work
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run queued tasks in the background, with TASKS_ASYNC on for them to be queued.'
+
+    def add_arguments(self, parser):
+        """Add arguments."""
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run the tasks that are due and stop.',
+        )
+
+    def handle(self, *args, **options):
+        """Run cmd."""
+        work(**options)
@@ -0,0 +1,107 @@
+import gzip
+import logging
+import re
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+logger = logging.getLogger(__name__)
+
+ENCODING_BROTLI = 'br'
+ENCODING_GZIP = 'gzip'
+
+# already compressed, or streamed from disk
+SKIPPED_CONTENT_TYPES = ('audio/', 'image/', 'video/', 'application/octet-stream')
+
+# quality 5 is about as fast as gzip level 6 with smaller output, 11 is for static files
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+
+re_accepts_brotli = re.compile(r'\bbr\b')
+re_accepts_gzip = re.compile(r'\bgzip\b')
+
+
+def compress(content: bytes, encoding: str) -> bytes:
+    """Compress content with encoding."""
+    if encoding == ENCODING_BROTLI:
+        return brotli.compress(content, quality=BROTLI_QUALITY)
+    return gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def get_encoding(accept_encoding: str) -> Optional[str]:
+    """Get the best encoding the client accepts, brotli when it is installed."""
+    if (
+        brotli is not None
+        and settings.COMPRESSION_BROTLI
+        and re_accepts_brotli.search(accept_encoding)
+    ):
+        return ENCODING_BROTLI
+    if re_accepts_gzip.search(accept_encoding):
+        return ENCODING_GZIP
+    return None
+
+
+def is_compressible(response) -> bool:
+    """Check if response is a complete text body worth compressing."""
+    content_type = response.get('Content-Type', '')
+    return (
+        not response.streaming
+        and not response.has_header('Content-Encoding')
+        and not content_type.startswith(SKIPPED_CONTENT_TYPES)
+        and len(response.content) >= settings.COMPRESSION_MIN_SIZE
+    )
+
+
+def weaken_etag(etag: str) -> str:
+    """Get a weak ETag, the compressed body is not byte identical to the one it was made of."""
+    if etag.startswith('W/'):
+        return etag
+    return f'W/{etag}'
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """Compress text responses with brotli or gzip, as the client accepts.
+
+    Place it above ConditionalGetMiddleware, so ETags and 304s are derived from the
+    uncompressed body, and responses only get compressed when they are sent.
+    """
+
+    def process_response(self, request, response):
+        """Compress response."""
+        if not is_compressible(response):
+            return response
+        # caches must keep the variants apart, also the uncompressed one
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = get_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+
+        compressed, ratio = self.compress_content(response.content, encoding)
+        if compressed is None:
+            return response
+        logger.debug(f'Compressed {request.path} with {encoding} to {ratio:.0%}')
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        if response.has_header('ETag'):
+            response['ETag'] = weaken_etag(response['ETag'])
+        return response
+
+    @staticmethod
+    def compress_content(content: bytes, encoding: str) -> Tuple[Optional[bytes], float]:
+        """Compress content, or get None when it would not get smaller."""
+        compressed = compress(content, encoding)
+        if len(compressed) >= len(content):
+            return None, 1.0
+        return compressed, len(compressed) / len(content)
@@ -0,0 +1,44 @@
+import logging
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from main.player_state import (
+    PLAYER_COOKIE,
+    PLAYER_COOKIE_MAX_AGE,
+    dump_player_state,
+    load_player_state,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PlayerStateMiddleware(MiddlewareMixin):
+    """Load the now playing state of the browser as request.player, and send it back changed.
+
+    The state lives in a signed cookie, so unlike the session it costs no queries.
+    """
+
+    def process_request(self, request):
+        """Load player state."""
+        request.player = load_player_state(request.COOKIES.get(PLAYER_COOKIE))
+
+    def process_response(self, request, response):
+        """Set cookie of changed player state."""
+        player = getattr(request, 'player', None)
+        if player is None:
+            return response
+        # partials highlighting the current song differ per cookie, album art and lyrics not
+        if player.accessed:
+            patch_vary_headers(response, ('Cookie',))
+        if player.modified:
+            response.set_cookie(
+                PLAYER_COOKIE,
+                dump_player_state(player),
+                max_age=PLAYER_COOKIE_MAX_AGE,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
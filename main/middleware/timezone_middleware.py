@@ -2,17 +2,14 @@ import logging
 import zoneinfo
 
 from django.utils import timezone
+from django.utils.deprecation import MiddlewareMixin
 
 logger = logging.getLogger(__name__)
 
 
-class TimezoneMiddleware:
-    def __init__(self, get_response):
-        """Get response to set timezone."""
-        self.get_response = get_response
-
-    def __call__(self, request):
-        """Middleware called."""
+class TimezoneMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        """Activate timezone of the browser, in sync and async stacks alike."""
         # Get django_timezone from the cookie
         tzname = request.COOKIES.get('django_timezone')
         if tzname:
@@ -20,6 +17,3 @@ class TimezoneMiddleware:
         else:
             logger.info(f'Timezone deactivated: {tzname}')
             timezone.deactivate()
-
-        response = self.get_response(request)
-        return response
@@ -0,0 +1,143 @@
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template
+
+logger = logging.getLogger(__name__)
+
+_current_timings = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        """Counters for a single request."""
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Execute wrapper that times every query on the connection."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+def time_query(execute, sql, params, many, context):
+    """Execute wrapper that times queries for the request being handled, if any.
+
+    The request is found through its context, which sync_to_async copies into the thread
+    running the queries of async views, so those are counted too.
+    """
+    if (timings := _current_timings.get()) is None:
+        return execute(sql, params, many, context)
+    return timings(execute, sql, params, many, context)
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """Time the queries of every new database connection."""
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+def instrument_templates():
+    """Patch the django template backend once so top level renders are timed."""
+    if getattr(Template.render, 'is_timed', False):
+        return
+    original_render = Template.render
+
+    def timed_render(self, context=None, request=None):
+        timings = _current_timings.get()
+        # only time the outer render, included templates are part of it
+        if timings is None or timings.template_depth:
+            return original_render(self, context, request)
+        timings.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return original_render(self, context, request)
+        finally:
+            timings.template_time += time.perf_counter() - start
+            timings.template_depth -= 1
+
+    timed_render.is_timed = True
+    Template.render = timed_render
+
+
+class TimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        """Only install when enabled, so it costs nothing otherwise."""
+        if not settings.TIMING_ENABLE:
+            raise MiddlewareNotUsed('Request timing disabled')
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        connection_created.connect(instrument_connection)
+        for connection in connections.all(initialized_only=True):
+            instrument_connection(self, connection)
+        instrument_templates()
+
+    def __call__(self, request):
+        """Record query count, db time, template time and total time of the view."""
+        if self.async_mode:
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_timings.reset(token)
+        return self.add_timings(request, response, timings, start)
+
+    async def __acall__(self, request):
+        """Record timings of async views under ASGI."""
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_timings.reset(token)
+        return self.add_timings(request, response, timings, start)
+
+    def add_timings(self, request, response, timings: RequestTimings, start: float):
+        """Add Server-Timing header, and log requests over budget."""
+        total_ms = (time.perf_counter() - start) * 1000
+        db_ms = timings.db_time * 1000
+        tpl_ms = timings.template_time * 1000
+
+        response['Server-Timing'] = ', '.join(
+            [
+                f'db;dur={db_ms:.2f};desc="{timings.queries} queries"',
+                f'tpl;dur={tpl_ms:.2f}',
+                f'total;dur={total_ms:.2f}',
+            ]
+        )
+
+        summary = (
+            f'{request.method} {request.path}: {timings.queries} queries, '
+            f'db {db_ms:.0f}ms, tpl {tpl_ms:.0f}ms, total {total_ms:.0f}ms'
+        )
+        over_budget = (
+            total_ms > settings.TIMING_BUDGET_TOTAL_MS
+            or db_ms > settings.TIMING_BUDGET_DB_MS
+            or timings.queries > settings.TIMING_BUDGET_QUERIES
+        )
+        if over_budget:
+            logger.warning(f'Over budget {summary}')
+        else:
+            logger.debug(summary)
+        return response
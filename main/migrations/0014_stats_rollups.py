@@ -0,0 +1,104 @@
+# Generated by Django 5.1.1 on 2026-10-19 14:10
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def populate_rollups(apps, schema_editor):
+    """Fill the rollups from existing plays, songs, albums and artists."""
+    History = apps.get_model('main', 'History')
+    Album = apps.get_model('main', 'Album')
+    Song = apps.get_model('main', 'Song')
+    Artist = apps.get_model('main', 'Artist')
+    played_dates = (
+        History.objects.filter(played_at__isnull=False)
+        .annotate(played_date=TruncDate('played_at', tzinfo=timezone.get_default_timezone()))
+        .values('played_date')
+        .annotate(count_played=Count('id'))
+        .order_by()
+    )
+    apps.get_model('main', 'DailyPlayCount').objects.bulk_create(
+        apps.get_model('main', 'DailyPlayCount')(
+            date=row['played_date'], count_played=row['count_played']
+        )
+        for row in played_dates
+    )
+    apps.get_model('main', 'YearAlbumRating').objects.bulk_create(
+        apps.get_model('main', 'YearAlbumRating')(**row)
+        for row in Album.objects.values('year').annotate(
+            count_albums=Count('id'), total_rating=Sum('rating')
+        )
+    )
+    apps.get_model('main', 'PlayCountBucket').objects.bulk_create(
+        apps.get_model('main', 'PlayCountBucket')(**row)
+        for row in Song.objects.values('count_played').annotate(count_songs=Count('id'))
+    )
+    apps.get_model('main', 'AlbumCountBucket').objects.bulk_create(
+        apps.get_model('main', 'AlbumCountBucket')(**row)
+        for row in Artist.objects.values('count_albums').annotate(count_artists=Count('id'))
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0013_album_avg_played_at_artist_avg_played_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlbumCountBucket',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('count_albums', models.IntegerField(unique=True)),
+                ('count_artists', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyPlayCount',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('date', models.DateField(unique=True)),
+                ('count_played', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PlayCountBucket',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('count_played', models.IntegerField(unique=True)),
+                ('count_songs', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='YearAlbumRating',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('year', models.IntegerField(unique=True)),
+                ('count_albums', models.IntegerField(default=0)),
+                ('total_rating', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.1 on 2026-10-19 14:16
+
+from django.db import migrations, models
+from django.db.models import Max, Sum
+
+
+def populate_candidates(apps, schema_editor):
+    """Fill the candidates from the similars of existing artists."""
+    Artist = apps.get_model('main', 'Artist')
+    Similar = apps.get_model('main', 'Similar')
+    SimilarCandidate = apps.get_model('main', 'SimilarCandidate')
+    grouped = (
+        Similar.objects.exclude(artist_slug__in=Artist.objects.values('slug'))
+        .values('artist_slug')
+        .annotate(total_score=Sum('score'), artist_name=Max('artist_name'))
+        .order_by()
+    )
+    SimilarCandidate.objects.bulk_create(SimilarCandidate(**row) for row in grouped)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0014_stats_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarCandidate',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('artist_slug', models.SlugField(max_length=250, unique=True)),
+                ('artist_name', models.CharField(max_length=250)),
+                ('total_score', models.FloatField(db_index=True)),
+            ],
+            options={
+                'ordering': ['-total_score'],
+            },
+        ),
+        migrations.RunPython(populate_candidates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.1 on 2026-10-19 14:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0015_similar_candidates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MissingAlbum',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('album_title', models.CharField(max_length=250)),
+                ('album_link', models.CharField(max_length=250, null=True)),
+                (
+                    'artist',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='missing_albums',
+                        to='main.artist',
+                    ),
+                ),
+            ],
+            options={
+                'unique_together': {('artist', 'album_title')},
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.1 on 2026-10-19 14:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0016_missingalbum'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lyric',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                (
+                    'song',
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name='lyric',
+                        serialize=False,
+                        to='main.song',
+                    ),
+                ),
+                ('text_compressed', models.BinaryField()),
+                (
+                    'source',
+                    models.CharField(
+                        choices=[
+                            ('azlyrics', 'azlyrics'),
+                            ('chartlyrics', 'chartlyrics'),
+                            ('instrumental', 'instrumental'),
+                        ],
+                        max_length=50,
+                    ),
+                ),
+                ('fetched_at', models.DateTimeField()),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.1 on 2026-10-19 14:35
+
+import zlib
+
+from django.db import migrations
+
+
+def index_existing_lyrics(apps, schema_editor):
+    """Index lyrics stored before the full-text index existed."""
+    Lyric = apps.get_model('main', 'Lyric')
+    with schema_editor.connection.cursor() as cursor:
+        for song_id, text_compressed in Lyric.objects.values_list('song_id', 'text_compressed'):
+            cursor.execute(
+                'INSERT INTO main_lyric_fts (rowid, text) VALUES (%s, %s)',
+                [song_id, zlib.decompress(text_compressed).decode('utf-8')],
+            )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0017_lyric'),
+    ]
+
+    operations = [
+        # stores its own copy of the text, so rows delete by rowid on any SQLite with FTS5
+        migrations.RunSQL(
+            'CREATE VIRTUAL TABLE main_lyric_fts USING fts5('
+            "text, tokenize='unicode61 remove_diacritics 2')",
+            'DROP TABLE main_lyric_fts',
+        ),
+        migrations.RunPython(index_existing_lyrics, migrations.RunPython.noop),
+    ]
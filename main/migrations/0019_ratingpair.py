@@ -0,0 +1,68 @@
+# Generated by Django 5.1.1 on 2026-10-19 14:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_pairs(apps, schema_editor):
+    """Summarize existing ratings per song pair."""
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO main_ratingpair (song_a_id, song_b_id, a_wins, b_wins, last_rated_at)
+            SELECT MIN(winner_id, loser_id), MAX(winner_id, loser_id),
+                   SUM(winner_id < loser_id), SUM(winner_id > loser_id), MAX(rated_at)
+            FROM main_rating
+            WHERE winner_id != loser_id
+            GROUP BY 1, 2
+            """
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0018_lyric_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingPair',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('a_wins', models.IntegerField(default=0)),
+                ('b_wins', models.IntegerField(default=0)),
+                ('last_rated_at', models.DateTimeField()),
+                (
+                    'song_a',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='+',
+                        to='main.song',
+                    ),
+                ),
+                (
+                    'song_b',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='+',
+                        to='main.song',
+                    ),
+                ),
+            ],
+            options={
+                'constraints': [
+                    models.CheckConstraint(
+                        condition=models.Q(('song_a__lt', models.F('song_b'))),
+                        name='rating_pair_ordered',
+                    )
+                ],
+                'unique_together': {('song_a', 'song_b')},
+            },
+        ),
+        migrations.RunPython(populate_pairs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-19 14:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0019_ratingpair'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='strength',
+            field=models.FloatField(default=0),
+        ),
+    ]
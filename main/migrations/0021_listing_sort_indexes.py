@@ -0,0 +1,32 @@
+# Generated by Django 5.1.1 on 2026-10-19 14:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0020_song_strength'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='album',
+            name='rating',
+            field=models.FloatField(db_index=True, default=0),
+        ),
+        migrations.AlterField(
+            model_name='artist',
+            name='rating',
+            field=models.FloatField(db_index=True, default=0),
+        ),
+        migrations.AlterField(
+            model_name='song',
+            name='played_at',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='song',
+            name='rating',
+            field=models.FloatField(db_index=True, default=0),
+        ),
+    ]
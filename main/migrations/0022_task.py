@@ -0,0 +1,58 @@
+# Generated by Django 5.1.1 on 2026-10-19 14:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0021_listing_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(max_length=250)),
+                ('kwargs', models.JSONField(default=dict)),
+                ('priority', models.IntegerField(default=0)),
+                (
+                    'status',
+                    models.CharField(
+                        choices=[
+                            ('pending', 'pending'),
+                            ('running', 'running'),
+                            ('done', 'done'),
+                            ('failed', 'failed'),
+                        ],
+                        default='pending',
+                        max_length=20,
+                    ),
+                ),
+                ('run_at', models.DateTimeField()),
+                ('attempts', models.IntegerField(default=0)),
+                ('max_attempts', models.IntegerField(default=3)),
+                ('dedupe_key', models.CharField(max_length=250, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('started_at', models.DateTimeField(null=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_at'], name='task_due')],
+                'constraints': [
+                    models.UniqueConstraint(
+                        condition=models.Q(('status__in', ['pending', 'running'])),
+                        fields=('dedupe_key',),
+                        name='task_dedupe_key_queued',
+                    )
+                ],
+            },
+        ),
+    ]
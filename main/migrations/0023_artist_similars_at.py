@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-19 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0022_task'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artist',
+            name='similars_at',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -1,13 +1,26 @@
+import zlib
 from pathlib import Path
+from typing import Optional
 
 from django.conf import settings
 from django.core.cache import cache
 from django.db import models
+from django.db.models import F, Window
+from django.db.models.functions import Rank as RankFunc
 from django.utils.http import urlencode
 from unidecode import unidecode
 
 from main import managers
-from main.constants import BILLBOARD_CHOICES, GENRE_CHOICES, GENRE_HARD_ROCK
+from main.constants import (
+    BILLBOARD_CHOICES,
+    GENRE_CHOICES,
+    GENRE_HARD_ROCK,
+    LYRICS_SOURCE_CHOICES,
+    TASK_STATUS_CHOICES,
+    TASK_STATUS_PENDING,
+    TASK_STATUS_RUNNING,
+)
+from main.fragments import SCOPE_RATINGS, get_versions
 
 
 class Timestamp(models.Model):
@@ -19,11 +32,29 @@ class Timestamp(models.Model):
 
 
 class Rank:
+    @classmethod
+    def rank_cache_key(cls, pk: int, version: Optional[int] = None) -> str:
+        """Get cache key of rank of item, for the current version of the ratings."""
+        if version is None:
+            version = get_versions([SCOPE_RATINGS])[0]
+        return f'{cls.__name__}_rank_{version}_{pk}'
+
+    @classmethod
+    def cache_ranks(cls) -> int:
+        """Cache ranks of all items, ranked in a single windowed query instead of a count each."""
+        ranked = cls.objects.annotate(
+            ranked=Window(RankFunc(), order_by=F('rating').desc())
+        ).values_list('pk', 'ranked')
+        version = get_versions([SCOPE_RATINGS])[0]
+        ranks = {cls.rank_cache_key(pk, version): rank for pk, rank in ranked}
+        cache.set_many(ranks, timeout=3600)
+        return len(ranks)
+
     @property
     def rank(self):
         """Get item rank."""
         # Create a cache key based on the instance's class and primary key
-        cache_key = f'{self.__class__.__name__}_rank_{self.pk}'
+        cache_key = self.rank_cache_key(self.pk)
         rank = cache.get(cache_key)
 
         if rank is None:
@@ -46,11 +77,12 @@ class Artist(Timestamp, Rank):
     avg_played_at = models.DateTimeField(null=True)
     count_rated = models.IntegerField(default=0)
     rated_at = models.DateTimeField(null=True)
-    rating = models.FloatField(default=0)
+    rating = models.FloatField(default=0, db_index=True)
 
     # classification
     genre = models.CharField(max_length=50, choices=GENRE_CHOICES, default=GENRE_HARD_ROCK)
     disco_at = models.DateTimeField(null=True)
+    similars_at = models.DateTimeField(null=True)
 
     def __str__(self):
         txt = f'<Artist-{self.id} {self.name}>'
@@ -80,7 +112,7 @@ class Album(Timestamp, Rank):
     avg_played_at = models.DateTimeField(null=True)
     count_rated = models.IntegerField(default=0)
     rated_at = models.DateTimeField(null=True)
-    rating = models.FloatField(default=0)
+    rating = models.FloatField(default=0, db_index=True)
 
     # classification
     genre = models.CharField(max_length=50, choices=GENRE_CHOICES, default=GENRE_HARD_ROCK)
@@ -102,12 +134,13 @@ class Song(Timestamp, Rank):
 
     # plays
     count_played = models.IntegerField(default=0)
-    played_at = models.DateTimeField(null=True)
+    played_at = models.DateTimeField(null=True, db_index=True)
 
     # ratings
     count_rated = models.IntegerField(default=0)
     rated_at = models.DateTimeField(null=True)
-    rating = models.FloatField(default=0)
+    rating = models.FloatField(default=0, db_index=True)
+    strength = models.FloatField(default=0)  # bradley-terry log strength
 
     # classification
     genre = models.CharField(max_length=50, choices=GENRE_CHOICES, default=GENRE_HARD_ROCK)
@@ -153,6 +186,47 @@ class Rating(Timestamp):
         return unidecode(txt)
 
 
+class RatingPair(models.Model):
+    song_a = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='+')
+    song_b = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='+')
+    a_wins = models.IntegerField(default=0)
+    b_wins = models.IntegerField(default=0)
+    last_rated_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ['song_a', 'song_b']
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(song_a__lt=models.F('song_b')),
+                name='rating_pair_ordered',
+            ),
+        ]
+
+    def __str__(self):
+        return f'<RatingPair {self.song_a_id} {self.a_wins}-{self.b_wins} {self.song_b_id}>'
+
+
+class Lyric(Timestamp):
+    song = models.OneToOneField(
+        Song, on_delete=models.CASCADE, primary_key=True, related_name='lyric'
+    )
+    text_compressed = models.BinaryField()
+    source = models.CharField(max_length=50, choices=LYRICS_SOURCE_CHOICES)
+    fetched_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'<Lyric-{self.song_id} {self.source}>'
+
+    @property
+    def text(self) -> str:
+        """Get decompressed lyrics."""
+        return zlib.decompress(self.text_compressed).decode('utf-8')
+
+    @text.setter
+    def text(self, value: str):
+        self.text_compressed = zlib.compress(value.encode('utf-8'), level=9)
+
+
 class Billboard(Timestamp):
     chart = models.CharField(max_length=250, choices=BILLBOARD_CHOICES)
     chart_at = models.DateTimeField()
@@ -195,3 +269,94 @@ class Similar(Timestamp):
         perc = f'{self.score * 100:.0f}%'
         txt = f'<Similar-{self.id} {self.artist.name} => {self.artist_name} {perc}>'
         return unidecode(txt)
+
+
+class MissingAlbum(Timestamp):
+    artist = models.ForeignKey(Artist, on_delete=models.CASCADE, related_name='missing_albums')
+    album_title = models.CharField(max_length=250)
+    album_link = models.CharField(max_length=250, null=True)
+
+    class Meta:
+        unique_together = ['artist', 'album_title']
+
+    def __str__(self):
+        txt = f'<MissingAlbum-{self.id} {self.artist.name} {self.album_title}>'
+        return unidecode(txt)
+
+
+class DailyPlayCount(models.Model):
+    date = models.DateField(unique=True)
+    count_played = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'<DailyPlayCount {self.date:%Y-%m-%d} {self.count_played}>'
+
+
+class YearAlbumRating(models.Model):
+    year = models.IntegerField(unique=True)
+    count_albums = models.IntegerField(default=0)
+    total_rating = models.FloatField(default=0)
+
+    def __str__(self):
+        return f'<YearAlbumRating {self.year} {self.total_rating:.2f}>'
+
+
+class PlayCountBucket(models.Model):
+    count_played = models.IntegerField(unique=True)
+    count_songs = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'<PlayCountBucket {self.count_played} plays: {self.count_songs}>'
+
+
+class AlbumCountBucket(models.Model):
+    count_albums = models.IntegerField(unique=True)
+    count_artists = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'<AlbumCountBucket {self.count_albums} albums: {self.count_artists}>'
+
+
+class SimilarCandidate(models.Model):
+    artist_slug = models.SlugField(max_length=250, unique=True)
+    artist_name = models.CharField(max_length=250)
+    total_score = models.FloatField(db_index=True)
+
+    class Meta:
+        ordering = ['-total_score']
+
+    def __str__(self):
+        txt = f'<SimilarCandidate {self.artist_name} {self.total_score:.2f}>'
+        return unidecode(txt)
+
+
+class Task(Timestamp):
+    name = models.CharField(max_length=250)
+    kwargs = models.JSONField(default=dict)
+    priority = models.IntegerField(default=0)
+    status = models.CharField(
+        max_length=20, choices=TASK_STATUS_CHOICES, default=TASK_STATUS_PENDING
+    )
+    run_at = models.DateTimeField()
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    dedupe_key = models.CharField(max_length=250, null=True)
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='task_due'),
+        ]
+        constraints = [
+            # a task is queued once per key, it can be queued again once it finished
+            models.UniqueConstraint(
+                fields=['dedupe_key'],
+                condition=models.Q(status__in=[TASK_STATUS_PENDING, TASK_STATUS_RUNNING]),
+                name='task_dedupe_key_queued',
+            ),
+        ]
+
+    def __str__(self):
+        return f'<Task-{self.id} {self.name} {self.status}>'
@@ -1,18 +1,16 @@
 import logging
-from datetime import datetime
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
 from django.conf import settings
 from django.db import IntegrityError, transaction
-from django.db.models import Avg, FloatField, Max, Sum
-from django.db.models.functions import Cast
 from django.utils.text import slugify
-from django.utils.timezone import make_aware
-from mutagen import id3, mp3, mp4
 from unidecode import unidecode
 
 from main.models import Album, Artist, Song
+from main.percentiles import invalidate_artist_percentiles
+from main.rollups import rebuild_rollups, remove_similar_candidates
+from main.stats import rebuild_stats
 
 logger = logging.getLogger(__name__)
 
@@ -33,7 +31,7 @@ def scan_directory(*args, **kwargs):
     logger.info(f'Checking music path against {len(existing_slugs)} existing paths.')
 
     # find new files
-    albums = set()
+    song_ids = []
     for pattern in patterns:
         logger.info(f'Checking files: {pattern}')
         cnt = 0
@@ -45,29 +43,18 @@ def scan_directory(*args, **kwargs):
             slug = slugify(unidecode(rel_path))
             if slug not in existing_slugs:
                 song = add_new_audio_file(file_path, rel_path, slug, missing_audio_songs)
-                albums.add(song.album)
+                song_ids.append(song.id)
         logger.info(f'Found {cnt} {pattern} files in directory')
 
     # update album and artist stats
-    artists = set()
-    for album in albums:
-        album.count_songs = album.songs.count()
-        album.total_length = album.songs.aggregate(Sum('track_length'))['track_length__sum']
-        album.save()
-        artists.add(album.artist)
-        logger.info(f'Updated album {album.name}: count_songs={album.count_songs}')
-    for artist in artists:
-        artist.count_albums = artist.albums.count()
-        artist.count_songs = artist.songs.count()
-        artist.total_length = artist.albums.aggregate(Sum('total_length'))['total_length__sum']
-        logger.info(
-            f'Updated artist {unidecode(artist.name)}: '
-            f'count_albums={artist.count_albums} count_songs={artist.count_songs}'
-        )
-        artist.save()
+    rebuild_stats(song_ids)
 
     validate_songs()
 
+    # new songs, albums and artists change every rollup, not only the plays
+    if song_ids:
+        rebuild_rollups()
+
 
 def add_new_audio_file(
     file_path: Path, rel_path: str, song_slug: str, missing_audio_files: List[Song]
@@ -98,6 +85,7 @@ def add_new_audio_file(
     )
     if artist_created:
         logger.info(f'Created {artist}')
+        remove_similar_candidates([artist.slug])
 
     album_slug = artist_slug + '-' + slugify(unidecode(metadata['album_name']))
     album, album_created = Album.objects.update_or_create(
@@ -136,6 +124,7 @@ def add_new_audio_file(
         song.save()
         logger.info(f'Updated song slug to: {song_slug}')
 
+    invalidate_artist_percentiles([artist.id])
     return song
 
 
@@ -154,6 +143,8 @@ def parse_id3_tag(file_path: str) -> dict:
 
 def get_mp3_metadata(file_path: str) -> dict:
     """Extract metadata from MP3 files."""
+    from mutagen import id3, mp3
+
     info = {}
 
     # Access audio properties
@@ -179,6 +170,8 @@ def get_mp3_metadata(file_path: str) -> dict:
 
 def get_m4a_metadata(file_path) -> dict:
     """Extract metadata from M4A files."""
+    from mutagen import mp4
+
     info = {}
     meta = mp4.MP4(file_path)
     info['song_title'] = meta.get('\xa9nam', ['Unknown Title'])[0]
@@ -197,6 +190,7 @@ def validate_songs(delete: bool = True) -> List[Song]:
     """Ensure songs in db has files."""
     logger.info('Validating songs...')
     listing = []
+    removed_rows = False
     songs = Song.objects.all()
 
     with transaction.atomic():
@@ -213,6 +207,7 @@ def validate_songs(delete: bool = True) -> List[Song]:
             if not album.songs.exists():
                 logger.info(f'Removing album {album} with no songs')
                 album.delete()
+                removed_rows = True
 
         # Remove artists with no albums left
         artists = Artist.objects.all()
@@ -220,12 +215,21 @@ def validate_songs(delete: bool = True) -> List[Song]:
             if not artist.albums.exists():
                 logger.info(f'Removing artist {artist} with no albums')
                 artist.delete()
+                removed_rows = True
+
+    # library changed, so recount what is left and the stats charts
+    if delete and listing:
+        rebuild_stats()
+    if (delete and listing) or removed_rows:
+        rebuild_rollups()
 
     return listing
 
 
 def get_album_art(song: Song):
     """Get album art from metadata."""
+    from mutagen import id3, mp3
+
     file_path = settings.MUSIC_DIR / song.rel_path
     audio_file = mp3.MP3(file_path, ID3=id3.ID3)
     for tag in audio_file.tags.values():
@@ -233,6 +237,20 @@ def get_album_art(song: Song):
             return tag
 
 
+def get_album_art_path(album: Album) -> Path:
+    """Get path of the album art extracted to the static directory."""
+    return settings.ALBUMS_DIR / f'{album.artist.slug}-{album.slug}-{album.id}.jpg'
+
+
+def save_album_art(song: Song) -> Optional[bytes]:
+    """Extract album art of song to the static directory, or get None when it has none."""
+    tag = get_album_art(song)
+    if not tag:
+        return None
+    get_album_art_path(song.album).write_bytes(tag.data)
+    return tag.data
+
+
 def recheck_metadata(*args, **kwargs):  # noqa: PLR0912 PLR0915
     """Checks metadata of songs."""
     outdated_albums = set()
@@ -256,6 +274,7 @@ def recheck_metadata(*args, **kwargs):  # noqa: PLR0912 PLR0915
                 song.artist.slug = artist_slug
                 song.artist.name = metadata['artist_name']
                 song.artist.save()
+                remove_similar_candidates([artist_slug])
 
         album_slug = artist_slug + '-' + slugify(unidecode(metadata['album_name']))
         if song.album.slug != album_slug:
@@ -314,48 +333,9 @@ def recheck_metadata(*args, **kwargs):  # noqa: PLR0912 PLR0915
         if album_dirty or song_dirty:
             outdated_albums.add(song.album)
 
-    # update stats on albums
-    outdated_artists = set()
-    for album in outdated_albums:
-        album.refresh_from_db()
-        album.count_songs = album.songs.count()
-        album.total_length = album.songs.aggregate(Sum('track_length'))['track_length__sum']
-        album.count_played = album.songs.aggregate(Sum('count_played'))['count_played__sum']
-        album.played_at = album.songs.aggregate(Max('played_at'))['played_at__max']
-        # Convert 'played_at' to a numeric format for averaging
-        avg_played_at = album.songs.annotate(
-            played_at_timestamp=Cast('played_at', FloatField())
-        ).aggregate(Avg('played_at_timestamp'))['played_at_timestamp__avg']
-        album.avg_played_at = (
-            make_aware(datetime.fromtimestamp(avg_played_at)) if avg_played_at else None
-        )
-        album.count_rated = album.songs.aggregate(Sum('count_rated'))['count_rated__sum']
-        album.rated_at = album.songs.aggregate(Max('rated_at'))['rated_at__max']
-        album.rating = album.songs.aggregate(Avg('rating'))['rating__avg']
-        album.save()
-        logger.info(f'Updated stats for {album}')
-        outdated_artists.add(album.artist)
-
-    # update stats on artists
-    for artist in outdated_artists:
-        artist.refresh_from_db()
-        artist.count_albums = artist.albums.count()
-        artist.count_songs = artist.songs.count()
-        artist.total_length = artist.albums.aggregate(Sum('total_length'))['total_length__sum']
-        artist.count_played = artist.albums.aggregate(Sum('count_played'))['count_played__sum']
-        artist.played_at = artist.albums.aggregate(Max('played_at'))['played_at__max']
-        # Convert 'played_at' to a numeric format for averaging
-        avg_played_at = artist.songs.annotate(
-            played_at_timestamp=Cast('played_at', FloatField())
-        ).aggregate(Avg('played_at_timestamp'))['played_at_timestamp__avg']
-        artist.avg_played_at = (
-            make_aware(datetime.fromtimestamp(avg_played_at)) if avg_played_at else None
-        )
-        artist.count_rated = artist.albums.aggregate(Sum('count_rated'))['count_rated__sum']
-        artist.rated_at = artist.albums.aggregate(Max('rated_at'))['rated_at__max']
-        artist.rating = artist.songs.aggregate(Avg('rating'))['rating__avg']
-        logger.info(f'Updated stats for {artist}')
-        artist.save()
+    # songs may have moved between albums and artists, so recount everything
+    if outdated_albums:
+        rebuild_stats()
 
     # ensure to remove dud artists or albums that could be orphans
     validate_songs()
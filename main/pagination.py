@@ -0,0 +1,220 @@
+import base64
+import hashlib
+import json
+import logging
+import math
+from functools import cached_property
+from typing import List, Optional, Tuple
+
+from django.core.cache import cache
+from django.db.models import F, Q, QuerySet
+from django_tables2.rows import BoundRows
+
+logger = logging.getLogger(__name__)
+
+CURSOR_AFTER = 'after'
+CURSOR_BEFORE = 'before'
+
+# counts of filtered listings only change with scans, they may lag a few minutes
+COUNT_CACHE_TTL = 300
+
+
+def encode_cursor(direction: str, values: list) -> str:
+    """Encode the sort keys of a row as an url safe cursor."""
+    # str keeps the microseconds of datetimes, which equality of the sort keys depends on
+    payload = json.dumps([direction, values], default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, list]]:
+    """Decode a cursor, or get None for a missing or malformed one."""
+    if not cursor:
+        return None
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, values = json.loads(payload)
+    except (ValueError, TypeError):
+        logger.warning(f'Ignoring malformed cursor {cursor}')
+        return None
+    if direction not in (CURSOR_AFTER, CURSOR_BEFORE) or not isinstance(values, list):
+        return None
+    return direction, values
+
+
+def get_sort_keys(queryset: QuerySet) -> List[Tuple[str, bool]]:
+    """Get the ordering of queryset as (field, descending), ending with the primary key.
+
+    The primary key follows the direction of the last sort key, so an index on that key
+    can be scanned in one direction.
+    """
+    keys = []
+    for term in queryset.query.order_by or queryset.model._meta.ordering:
+        field = term.lstrip('-')
+        keys.append(('pk' if field == 'id' else field, term.startswith('-')))
+    if not any(field == 'pk' for field, _ in keys):
+        keys.append(('pk', keys[-1][1] if keys else False))
+    return keys
+
+
+def keyset_filter(keys: List[Tuple[str, bool]], values: list, backward: bool) -> Q:
+    """Get the condition for rows after the sort key values, or before them going backward.
+
+    Nulls sort as the smallest values, so last when descending and first when ascending.
+    """
+    condition = Q(pk__in=[])
+    equal = Q()
+    for (field, descending), value in zip(keys, values, strict=True):
+        if descending != backward:  # towards smaller values
+            if value is not None:
+                condition |= equal & (
+                    Q(**{f'{field}__lt': value}) | Q(**{f'{field}__isnull': True})
+                )
+        elif value is None:
+            condition |= equal & Q(**{f'{field}__isnull': False})
+        else:
+            condition |= equal & Q(**{f'{field}__gt': value})
+        equal &= Q(**{f'{field}__isnull': True}) if value is None else Q(**{field: value})
+    return condition
+
+
+def order_by_keys(queryset: QuerySet, keys: List[Tuple[str, bool]], backward: bool) -> QuerySet:
+    """Order queryset by the sort keys, with the nulls placed explicitly."""
+    ordering = []
+    for field, descending in keys:
+        if descending != backward:
+            ordering.append(F(field).desc(nulls_last=True))
+        else:
+            ordering.append(F(field).asc(nulls_first=True))
+    return queryset.order_by(*ordering)
+
+
+def get_cached_count(queryset: QuerySet) -> int:
+    """Get the row count of queryset, cached for a few minutes per query."""
+    query = str(queryset.order_by().query)
+    cache_key = f'count_{hashlib.sha256(query.encode()).hexdigest()}'
+    if (count := cache.get(cache_key)) is None:
+        count = queryset.order_by().count()
+        cache.set(cache_key, count, timeout=COUNT_CACHE_TTL)
+    return count
+
+
+class KeysetPage:
+    def __init__(
+        self,
+        object_list: BoundRows,
+        number: int,
+        paginator: 'KeysetPaginator',
+        previous_cursor: Optional[str],
+        next_cursor: Optional[str],
+    ):
+        """Page of rows with the cursors of its neighbouring pages."""
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self.previous_cursor = previous_cursor
+        self.next_cursor = next_cursor
+
+    def __len__(self):
+        """Get number of rows."""
+        return len(self.object_list)
+
+    def has_next(self) -> bool:
+        """Check if there is a next page."""
+        return self.next_cursor is not None
+
+    def has_previous(self) -> bool:
+        """Check if there is a previous page."""
+        return self.previous_cursor is not None
+
+    def has_other_pages(self) -> bool:
+        """Check if there are other pages."""
+        return self.has_previous() or self.has_next()
+
+    def next_page_number(self) -> int:
+        """Get number of the next page, only for display."""
+        return self.number + 1
+
+    def previous_page_number(self) -> int:
+        """Get number of the previous page, only for display."""
+        return max(self.number - 1, 1)
+
+
+class KeysetPaginator:
+    def __init__(self, object_list: BoundRows, per_page: int, cursor: Optional[str] = None):
+        """Paginate table rows by their sort keys instead of an OFFSET.
+
+        Page links carry a cursor with the sort keys of the last row of the page, or of the
+        first one going back, so every page is a range scan on the sort keys however deep it
+        is. Page numbers are only passed along for display.
+        """
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.cursor = cursor
+
+    @property
+    def queryset(self) -> QuerySet:
+        """Get the ordered queryset of the table."""
+        return self.object_list.data.data
+
+    @cached_property
+    def count(self) -> int:
+        """Get the cached count of all rows."""
+        return get_cached_count(self.queryset)
+
+    @property
+    def num_pages(self) -> int:
+        """Get the number of pages from the cached count."""
+        return max(math.ceil(self.count / self.per_page), 1)
+
+    def page(self, number: int = 1) -> KeysetPage:
+        """Get the page at the cursor, the number is only used for display."""
+        keys = get_sort_keys(self.queryset)
+        annotations = {f'keyset_{ix}': F(field) for ix, (field, _) in enumerate(keys)}
+        decoded = decode_cursor(self.cursor)
+        if decoded and len(decoded[1]) != len(keys):
+            decoded = None  # cursor of another ordering
+        backward = bool(decoded) and decoded[0] == CURSOR_BEFORE
+
+        queryset = order_by_keys(self.queryset.annotate(**annotations), keys, backward)
+        if decoded:
+            queryset = queryset.filter(keyset_filter(keys, decoded[1], backward))
+        records = list(queryset[: self.per_page + 1])
+        has_more = len(records) > self.per_page
+        records = records[: self.per_page]
+        if backward:
+            records.reverse()
+
+        previous_cursor = next_cursor = None
+        if records and (has_more if backward else decoded):
+            previous_cursor = self.get_cursor(records[0], CURSOR_BEFORE, len(keys))
+        if records and (decoded if backward else has_more):
+            next_cursor = self.get_cursor(records[-1], CURSOR_AFTER, len(keys))
+        return KeysetPage(
+            object_list=BoundRows(records, table=self.object_list.table),
+            number=max(int(number or 1), 1) if decoded else 1,
+            paginator=self,
+            previous_cursor=previous_cursor,
+            next_cursor=next_cursor,
+        )
+
+    def get_cursor(self, record, direction: str, count_keys: int) -> str:
+        """Get the cursor of the page next to the record in direction."""
+        return encode_cursor(
+            direction, [getattr(record, f'keyset_{ix}') for ix in range(count_keys)]
+        )
+
+
+class KeysetPaginationMixin:
+    """Paginate the table of a SingleTableView by keyset, with cached counts."""
+
+    def get_paginate_by(self, table_data) -> None:
+        """Leave pagination of the object list to the table, which would count it again."""
+        return None
+
+    def get_table_pagination(self, table) -> dict:
+        """Paginate by the cursor of the request."""
+        return {
+            'paginator_class': KeysetPaginator,
+            'per_page': self.paginate_by,
+            'cursor': self.request.GET.get('cursor'),
+        }
@@ -0,0 +1,82 @@
+import logging
+from typing import Dict, Iterable, Optional, Union
+
+from django.core.cache import cache
+from django.db.models import Count, F, Window
+from django.db.models.functions import Ntile, PercentRank, RowNumber
+
+from main.models import Album, Artist, Song
+
+logger = logging.getLogger(__name__)
+
+DECILES = 10
+
+
+def artist_cache_key(artist_id: int) -> str:
+    """Get cache key of percentiles of artist."""
+    return f'percentiles_artist_{artist_id}'
+
+
+def get_artist_percentiles(artist_id: int) -> Dict[int, dict]:
+    """Get percent rank and decile of every song of artist, within the artist and its album.
+
+    Computed in a single windowed query and cached until ratings of the artist change.
+    """
+    cache_key = artist_cache_key(artist_id)
+    if (percentiles := cache.get(cache_key)) is not None:
+        return percentiles
+
+    by_rating = F('rating').desc()
+    rows = (
+        Song.objects.filter(artist_id=artist_id)
+        .annotate(
+            artist_percent_rank=Window(PercentRank(), order_by=by_rating),
+            artist_decile=Window(Ntile(DECILES), order_by=by_rating),
+            album_percent_rank=Window(
+                PercentRank(), partition_by=[F('album_id')], order_by=by_rating
+            ),
+            album_decile=Window(Ntile(DECILES), partition_by=[F('album_id')], order_by=by_rating),
+        )
+        .values(
+            'id',
+            'artist_percent_rank',
+            'artist_decile',
+            'album_percent_rank',
+            'album_decile',
+        )
+    )
+    percentiles = {row.pop('id'): row for row in rows}
+    cache.set(cache_key, percentiles, timeout=None)
+    return percentiles
+
+
+def invalidate_artist_percentiles(artist_ids: Iterable[int]):
+    """Clear cached percentiles after ratings changed."""
+    cache.delete_many([artist_cache_key(artist_id) for artist_id in artist_ids])
+
+
+def get_top_percentile_songs(artist: Artist, percentile: float):
+    """Get songs of artist within the top percentile by rating."""
+    percentiles = get_artist_percentiles(artist.id)
+    top_ids = [
+        song_id
+        for song_id, ranks in percentiles.items()
+        if ranks['artist_percent_rank'] < percentile
+    ]
+    logger.info(f'{len(top_ids)} from {len(percentiles)} songs in top {percentile:.0%}')
+    return artist.songs.filter(id__in=top_ids).order_by('-rating')
+
+
+def get_median_rating(model: type[Union[Album, Artist, Song]] = Album) -> Optional[float]:
+    """Get median rating, the average of the middle one or two ratings."""
+    # twice the row number is within [total, total + 2] for exactly the middle rows
+    ratings = (
+        model.objects.annotate(
+            double_row=Window(RowNumber(), order_by=F('rating').asc()) * 2,
+            total=Window(Count('id')),
+        )
+        .filter(double_row__gte=F('total'), double_row__lte=F('total') + 2)
+        .values_list('rating', flat=True)
+    )
+    ratings = list(ratings)
+    return sum(ratings) / len(ratings) if ratings else None
@@ -0,0 +1,67 @@
+import logging
+from typing import List, Optional
+
+from django.core import signing
+
+logger = logging.getLogger(__name__)
+
+PLAYER_COOKIE = 'player'
+PLAYER_COOKIE_SALT = 'main.player_state'
+# state of a browser that has not played for this long is dropped
+PLAYER_COOKIE_MAX_AGE = 30 * 24 * 3600
+
+
+class PlayerState:
+    def __init__(self, song_id: Optional[int] = None, match_ids: Optional[List[int]] = None):
+        """Now playing state of a browser, the current song and the songs of its match.
+
+        Kept in a signed cookie instead of the session, so the listening loop reads and
+        writes it without a round trip to the session table.
+        """
+        self._song_id = song_id
+        self._match_ids = match_ids
+        # like the session, responses only vary on the cookie once it was read
+        self.accessed = False
+        self.modified = False
+
+    @property
+    def song_id(self) -> Optional[int]:
+        """Get id of the current song."""
+        self.accessed = True
+        return self._song_id
+
+    @property
+    def match_ids(self) -> Optional[List[int]]:
+        """Get ids of the songs of the pending match."""
+        self.accessed = True
+        return self._match_ids
+
+    def update(self, song_id: Optional[int] = ..., match_ids: Optional[List[int]] = ...):
+        """Update state, for the response to send it back."""
+        if song_id is not ...:
+            self._song_id = song_id
+        if match_ids is not ...:
+            self._match_ids = match_ids
+        self.accessed = True
+        self.modified = True
+
+    def to_dict(self) -> dict:
+        """Get state as dict."""
+        return {'song_id': self._song_id, 'match_ids': self._match_ids}
+
+
+def load_player_state(cookie: Optional[str]) -> PlayerState:
+    """Load state from the signed cookie, or start over when it is missing or tampered with."""
+    if not cookie:
+        return PlayerState()
+    try:
+        data = signing.loads(cookie, salt=PLAYER_COOKIE_SALT, max_age=PLAYER_COOKIE_MAX_AGE)
+        return PlayerState(song_id=data.get('song_id'), match_ids=data.get('match_ids'))
+    except (signing.BadSignature, AttributeError) as exc:
+        logger.warning(f'Dropping player state from cookie: {exc}')
+        return PlayerState()
+
+
+def dump_player_state(state: PlayerState) -> str:
+    """Dump state as a signed cookie value."""
+    return signing.dumps(state.to_dict(), salt=PLAYER_COOKIE_SALT, compress=True)
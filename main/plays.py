@@ -1,21 +1,32 @@
 import logging
 import random
 from collections import defaultdict
-from datetime import datetime
-from typing import Tuple, Union
+from typing import List, Tuple, Union
 
+from django.conf import settings
 from django.core.cache import cache
 from django.db import connection
-from django.db.models import Avg, ExpressionWrapper, F, FloatField, Max, Sum, Value
+from django.db.models import (
+    ExpressionWrapper,
+    F,
+    FloatField,
+    Max,
+    QuerySet,
+    Value,
+)
 from django.db.models.expressions import Func, RawSQL
 from django.utils import timezone
-from django.utils.timezone import make_aware
 from unidecode import unidecode
 
 from main.constants import LIST_GENRES, RATINGS_WINDOW
-from main.lastfm_service import scrobble
+from main.events import EVENT_GENRE, EVENT_PLAY, publish
+from main.fragments import SCOPE_RANKINGS, artist_scope, bump_fragments
+from main.lastfm_service import scrobble_history
 from main.models import Album, Artist, History, Song
+from main.rollups import record_play
 from main.selectors import get_recent_artist_ids
+from main.stats import rebuild_stats
+from main.tasks import enqueue
 
 logger = logging.getLogger(__name__)
 
@@ -28,32 +39,7 @@ def get_next_song() -> Song:
         logger.info(f'Returning unplayed random song: {song}')
         return song
 
-    max_played, time_till_last_played = get_next_song_priority_values()
-
-    # Calculate time since played using raw SQL
-    time_since_played_expr = RawSQL("(julianday('now') - julianday(main_song.played_at))", [])
-
-    query = Song.objects
-
-    # filter on facet
-    if filter_facet := cache.get('filter_facet'):
-        logger.info(f'Filtering on facet {filter_facet}')
-        query = query.filter(**filter_facet)
-
-    # filter on genre
-    if filter_genres := cache.get('filter_genres'):
-        logger.info(f'Filtering on genres {filter_genres}')
-        query = query.filter(**filter_genres)
-
-    # Annotate priority
-    songs_with_priority = query.annotate(
-        time_since_played=ExpressionWrapper(time_since_played_expr, output_field=FloatField()),
-        priority=(
-            F('rating')
-            - (F('count_played') / Value(max_played))
-            + (F('time_since_played') / Value(time_till_last_played))
-        ),
-    ).order_by('-priority')
+    songs_with_priority = get_priority_songs()
 
     # Get the song with the highest priority
     # but exclude recent artist, to prevent single artist spam
@@ -92,39 +78,68 @@ def get_next_song() -> Song:
     return next_song
 
 
+def get_priority_songs() -> QuerySet:
+    """Get songs ordered by play priority, within the facet and genre filters."""
+    max_played, time_till_last_played = get_next_song_priority_values()
+
+    # Calculate time since played using raw SQL
+    time_since_played_expr = RawSQL("(julianday('now') - julianday(main_song.played_at))", [])
+
+    query = Song.objects
+
+    # filter on facet
+    if filter_facet := cache.get('filter_facet'):
+        logger.info(f'Filtering on facet {filter_facet}')
+        query = query.filter(**filter_facet)
+
+    # filter on genre
+    if filter_genres := cache.get('filter_genres'):
+        logger.info(f'Filtering on genres {filter_genres}')
+        query = query.filter(**filter_genres)
+
+    # Annotate priority
+    songs_with_priority = query.annotate(
+        time_since_played=ExpressionWrapper(time_since_played_expr, output_field=FloatField()),
+        priority=(
+            F('rating')
+            - (F('count_played') / Value(max_played))
+            + (F('time_since_played') / Value(time_till_last_played))
+        ),
+    ).order_by('-priority')
+    return songs_with_priority
+
+
+def get_upcoming_songs(song: Song, count: int) -> List[Song]:
+    """Get songs likely to play after song, skipping recently played artists like it does."""
+    # unplayed songs are picked at random, so nothing can be predicted
+    if Song.objects.filter(count_played=0).exists():
+        return []
+
+    skip_artist_ids = {song.artist_id, *get_recent_artist_ids()}
+    candidates = get_priority_songs().exclude(id=song.id).select_related('artist')
+    upcoming = []
+    for next_song in candidates[: RATINGS_WINDOW // 60]:
+        if next_song.artist_id in skip_artist_ids:
+            continue
+        skip_artist_ids.add(next_song.artist_id)
+        upcoming.append(next_song)
+        if len(upcoming) >= count:
+            break
+    return upcoming
+
+
 def set_played(song: Song) -> History:
     """Increase play stats for song."""
     history = History.objects.create(song=song, played_at=timezone.now())
 
-    song.count_played = song.histories.count()
-    song.played_at = song.histories.aggregate(Max('played_at'))['played_at__max']
-    song.save()
-
-    album = song.album
-    album.count_played = album.songs.aggregate(Sum('count_played'))['count_played__sum']
-    album.played_at = album.songs.aggregate(Max('played_at'))['played_at__max']
-    # Convert 'played_at' to a Unix timestamp using SQLite's strftime
-    avg_played_at = album.songs.aggregate(
-        avg_played_at=Avg(RawSQL("strftime('%%s', played_at)", []))
-    )['avg_played_at']
-    album.avg_played_at = (
-        make_aware(datetime.fromtimestamp(avg_played_at)) if avg_played_at else None
-    )
-    album.save()
-
-    artist = album.artist
-    artist.count_played = artist.albums.aggregate(Sum('count_played'))['count_played__sum']
-    artist.played_at = artist.albums.aggregate(Max('played_at'))['played_at__max']
-    # Convert 'played_at' to a Unix timestamp using SQLite's strftime
-    avg_played_at = artist.songs.aggregate(
-        avg_played_at=Avg(RawSQL("strftime('%%s', played_at)", []))
-    )['avg_played_at']
-    artist.avg_played_at = (
-        make_aware(datetime.fromtimestamp(avg_played_at)) if avg_played_at else None
-    )
-    artist.save()
+    previous_count_played = song.count_played
+    rebuild_stats([song.id], ratings=False)
+    song.refresh_from_db()
 
-    scrobble(history)
+    record_play(history, previous_count_played)
+    if settings.LASTFM_ENABLE:
+        enqueue(scrobble_history, history_id=history.id, dedupe_key=f'scrobble_{history.id}')
+    publish(EVENT_PLAY, [song.artist_id], song_id=song.id, album_id=song.album_id)
 
     return history
 
@@ -204,6 +219,10 @@ def set_genre(instance: Union[Artist, Album, Song], genre: str):
         instance.songs.update(genre=genre)
         logger.info(f'Genre: {instance.songs.count()} albums set to {genre}')
 
+    artist_id = instance.id if isinstance(instance, Artist) else instance.artist_id
+    bump_fragments([artist_scope(artist_id), SCOPE_RANKINGS])
+    publish(EVENT_GENRE, [artist_id], genre=genre)
+
 
 def handle_genre_filter(genre: str):
     """Handle genre selection."""
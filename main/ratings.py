@@ -1,122 +1,213 @@
+import gzip
+import json
 import logging
+import math
 from datetime import timedelta
 from itertools import combinations
-from typing import List, Optional
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
 
-from django.db import connection
-from django.db.models import Avg, Max, Q, Sum
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
 from django.utils import timezone
 
-from main.constants import RATINGS_WINDOW
-from main.models import History, Rating, Song
+from main.constants import RATING_ENGINE_BRADLEY_TERRY, RATINGS_WINDOW
+from main.events import EVENT_RATING, publish
+from main.models import Album, History, Rating, RatingPair, Song
+from main.percentiles import invalidate_artist_percentiles
+from main.rollups import record_album_rating
+from main.stats import rebuild_stats
+from main.strengths import update_strengths
 
 logger = logging.getLogger(__name__)
 
-RATINGS_PER_PLAY = 5
-
-
-def get_recent_songs_from_history() -> List[Song]:
-    """Get recent histories of last half hour, limited to 10."""
+RATINGS_ARCHIVE_DIR = settings.BASE_DIR / '.archive'
+# recent songs to select a match from, every triple of them is scored
+MATCH_CANDIDATES = 20
+
+# add results to the pair, song_a is always the lower id
+UPSERT_PAIR_SQL = """
+    INSERT INTO main_ratingpair (song_a_id, song_b_id, a_wins, b_wins, last_rated_at)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (song_a_id, song_b_id) DO UPDATE SET
+        a_wins = a_wins + excluded.a_wins,
+        b_wins = b_wins + excluded.b_wins,
+        last_rated_at = MAX(last_rated_at, excluded.last_rated_at)
+"""
+
+REBUILD_PAIRS_SQL = """
+    INSERT INTO main_ratingpair (song_a_id, song_b_id, a_wins, b_wins, last_rated_at)
+    SELECT MIN(winner_id, loser_id), MAX(winner_id, loser_id),
+           SUM(winner_id < loser_id), SUM(winner_id > loser_id), MAX(rated_at)
+    FROM main_rating
+    WHERE winner_id != loser_id
+    GROUP BY 1, 2
+"""
+
+
+def record_pair_results(ratings: List[Rating]):
+    """Add new ratings to the pairwise results."""
+    params = []
+    for rating in ratings:
+        a_won = rating.winner_id < rating.loser_id
+        song_a_id, song_b_id = sorted([rating.winner_id, rating.loser_id])
+        params.append([song_a_id, song_b_id, int(a_won), int(not a_won), rating.rated_at])
+    with connection.cursor() as cursor:
+        cursor.executemany(UPSERT_PAIR_SQL, params)
+    invalidate_rated_songs({song_id for pair in params for song_id in pair[:2]})
+
+
+def rebuild_rating_pairs(*args, **kwargs):
+    """Rebuild the pairwise results from the rating log, only complete before compaction."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        RatingPair.objects.all().delete()
+        cursor.execute(REBUILD_PAIRS_SQL)
+    invalidate_rated_songs(Song.objects.values_list('id', flat=True))
+    logger.info(f'Rebuilt {RatingPair.objects.count()} rating pairs')
+
+
+def compact_ratings(*args, days: int = 90, archive_dir: Optional[Path] = None, **kwargs) -> Path:
+    """Move ratings older than days from the rating log to a gzipped JSON lines archive.
+
+    The pairwise results already hold their outcome, so stats are unaffected.
+    """
+    archive_dir = archive_dir or RATINGS_ARCHIVE_DIR
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    stamp = timezone.now().strftime('%Y%m%d-%H%M%S')
+    archive_path = archive_dir / f'ratings-{stamp}.jsonl.gz'
+
+    old_ratings = Rating.objects.filter(rated_at__lt=timezone.now() - timedelta(days=days))
+    rows = old_ratings.order_by('id').values('id', 'winner_id', 'loser_id', 'rated_at')
+    with gzip.open(archive_path, 'wt', encoding='utf-8') as archive:
+        for row in rows.iterator(chunk_size=5_000):
+            row['rated_at'] = row['rated_at'].isoformat()
+            archive.write(json.dumps(row) + '\n')
+    count, _ = old_ratings.delete()
+    logger.info(f'Archived {count} ratings older than {days} days to {archive_path}')
+    return archive_path
+
+
+def get_recent_songs_from_history(limit: int = MATCH_CANDIDATES) -> List[Song]:
+    """Get distinct songs of the recent histories, most recent first, limited to limit."""
     time_ago = timezone.now() - timedelta(seconds=RATINGS_WINDOW)
-    histories = History.objects.prefetch_related('song').filter(played_at__gt=time_ago).all()
-    songs = []
-    for h in histories:
-        if h.song not in songs:
-            songs.append(h.song)
-    return songs
+    song_ids = History.objects.filter(played_at__gt=time_ago).values_list('song_id', flat=True)
+    song_ids = list(dict.fromkeys(song_ids.iterator()).keys())[:limit]
+    songs = Song.objects.in_bulk(song_ids)
+    return [songs[song_id] for song_id in song_ids]
+
+
+def rated_songs_cache_key(song_id: int) -> str:
+    """Get cache key of the songs rated against song."""
+    return f'rated_songs_{song_id}'
+
+
+def get_rated_songs(song_ids: List[int]) -> Dict[int, Set[int]]:
+    """Get the songs each song was rated against, its edges in the comparison graph.
+
+    Cached per song until one of its pairs changes, so only songs without cached edges are
+    looked up in a single query.
+    """
+    keys = {rated_songs_cache_key(song_id): song_id for song_id in song_ids}
+    rated_songs = {keys[key]: rated for key, rated in cache.get_many(keys).items()}
+    if missing_ids := [song_id for song_id in song_ids if song_id not in rated_songs]:
+        for song_id in missing_ids:
+            rated_songs[song_id] = set()
+        pairs = RatingPair.objects.filter(
+            Q(song_a_id__in=missing_ids) | Q(song_b_id__in=missing_ids)
+        ).values_list('song_a_id', 'song_b_id')
+        for song_a_id, song_b_id in pairs:
+            if song_a_id in rated_songs:
+                rated_songs[song_a_id].add(song_b_id)
+            if song_b_id in rated_songs:
+                rated_songs[song_b_id].add(song_a_id)
+        cache.set_many(
+            {rated_songs_cache_key(song_id): rated_songs[song_id] for song_id in missing_ids},
+            timeout=None,
+        )
+    return rated_songs
+
+
+def invalidate_rated_songs(song_ids: Iterable[int]):
+    """Clear cached edges of the comparison graph after pairs changed."""
+    cache.delete_many([rated_songs_cache_key(song_id) for song_id in song_ids])
+
+
+def match_information(song_a: Song, song_b: Song) -> float:
+    """Get the expected information of rating two songs against each other.
+
+    Songs with close ratings have the most uncertain outcome, and songs with few ratings the
+    least settled rating. Highly rated songs weigh more, as the top of the ranking matters most.
+    """
+    if settings.RATING_ENGINE == RATING_ENGINE_BRADLEY_TERRY:
+        diff = song_a.strength - song_b.strength
+    else:
+        diff = 4 * (song_a.rating - song_b.rating)  # win ratios as rough logits
+    p_a = 1 / (1 + math.exp(-diff))
+    uncertainty = 1 / math.sqrt(1 + song_a.count_rated) + 1 / math.sqrt(1 + song_b.count_rated)
+    return p_a * (1 - p_a) * uncertainty * max(song_a.rating, song_b.rating) ** 2
+
+
+def select_match(
+    current_song: Song, songs: List[Song], rated_songs: Dict[int, Set[int]]
+) -> Optional[List[Song]]:
+    """Select the match of current song and two other songs with the most information.
+
+    Songs of a match have never been rated against each other.
+    """
+    best_match = None
+    best_information = 0.0
+    for song_b, song_c in combinations(songs, 2):
+        triple = (current_song, song_b, song_c)
+        if any(y.id in rated_songs[x.id] for x, y in combinations(triple, 2)):
+            continue
+        information = sum(match_information(x, y) for x, y in combinations(triple, 2))
+        if best_match is None or information > best_information:
+            best_match = list(triple)
+            best_information = information
+    return best_match
 
 
 def get_match(current_song: Song) -> Optional[List[Song]]:
     """Get next match."""
-    rate_count_cut_off = current_song.count_played * RATINGS_PER_PLAY
+    rate_count_cut_off = current_song.count_played * settings.RATINGS_PER_PLAY
     logger.info(f'Get match: is rated {current_song.count_rated} < {rate_count_cut_off}')
     if current_song.count_rated > rate_count_cut_off:
         return
 
-    songs = get_recent_songs_from_history()
-    songs.insert(0, current_song)
-    song_ids = [s.id for s in songs]
-    # logger.info(f'Searching {song_ids} for a match...')
-
-    # Filter ratings for the relevant song pairs
-    ratings = Rating.objects.filter(
-        Q(winner_id__in=song_ids) | Q(loser_id__in=song_ids)
-    ).values_list('winner_id', 'loser_id')
-
-    # Convert ratings to a set for faster lookup
-    rated_pairs = set()
-    for winner, loser in ratings:
-        rated_pairs.add((winner, loser))
-        rated_pairs.add((loser, winner))  # Add reverse pair for bidirectional check
-
-    # Find combinations of songs that have no ratings between them
-    songs_bag = []
-    for ix, song in enumerate(songs):
-        logger.debug(f'Get match: song bag {ix}: {song}')
-        songs_bag.append(song)
-        for b, c in combinations(songs_bag, 2):
-            # Ensure current_song is not one of b or c
-            if current_song in (b, c):
-                continue
-            # logger.info(f'Get match: checking {b} && {c}')
-            comb_ids = {current_song.id, b.id, c.id}
-            # Check if any pair in comb_ids has been rated
-            if not any((winner in comb_ids and loser in comb_ids) for winner, loser in rated_pairs):
-                match = [current_song, b, c]
-                logger.info(f'Get match: {match}')
-                return match
-    logger.info(f'Could not find any match for {song_ids}')
+    songs = [s for s in get_recent_songs_from_history() if s.id != current_song.id]
+    rated_songs = get_rated_songs([current_song.id, *(s.id for s in songs)])
+    if match := select_match(current_song, songs, rated_songs):
+        logger.info(f'Get match: {match}')
+        return match
+    logger.info(f'Could not find any match for {current_song} in {len(songs)} recent songs')
 
 
 def set_match_result(winner_id: int, loser_ids: List[int]):
     """Set winner against the losers."""
     winner = Song.objects.get(id=winner_id)
-    songs = {winner}
-    for loser_id in loser_ids:
-        if loser_id == winner_id:
-            continue
-        loser = Song.objects.get(id=loser_id)
-        rating = Rating.objects.create(winner=winner, loser=loser, rated_at=timezone.now())
-        logger.info(f'Created rating: {rating}')
-        songs.add(loser)
-
-    albums = set()
-    for song in songs:
-        ratings = Rating.objects.filter(Q(winner=song) | Q(loser=song))
-        count_wins = Rating.objects.filter(winner=song).count()
-        song.count_rated = ratings.count()
-        song.rated_at = ratings.aggregate(Max('rated_at'))['rated_at__max']
-        song.rating = count_wins / ratings.count()
-        song.save()
-        albums.add(song.album)
-
-    artists = set()
-    for album in albums:
-        album.count_rated = album.songs.aggregate(Sum('count_rated'))['count_rated__sum']
-        album.rated_at = album.songs.aggregate(Max('rated_at'))['rated_at__max']
-        album.rating = album.songs.aggregate(Avg('rating'))['rating__avg']
-        album.save()
-        artists.add(album.artist)
-
-    for artist in artists:
-        artist.count_rated = artist.albums.aggregate(Sum('count_rated'))['count_rated__sum']
-        artist.rated_at = artist.albums.aggregate(Max('rated_at'))['rated_at__max']
-        artist.rating = artist.songs.aggregate(Avg('rating'))['rating__avg']
-        artist.save()
-
-
-def get_median_rating():
-    """Get median rating."""
-    with connection.cursor() as cursor:
-        cursor.execute("""
-            SELECT AVG(rating)
-            FROM (
-                SELECT rating
-                FROM your_app_album
-                ORDER BY rating
-                LIMIT 2
-                OFFSET (SELECT (COUNT(*) - 1) / 2 FROM your_app_album)
-            );
-        """)
-        result = cursor.fetchone()
-    return result[0] if result else None
+    rated_at = timezone.now()
+    ratings = [
+        Rating(winner=winner, loser_id=loser_id, rated_at=rated_at)
+        for loser_id in set(loser_ids)
+        if loser_id != winner_id
+    ]
+    with transaction.atomic():
+        Rating.objects.bulk_create(ratings)
+        record_pair_results(ratings)
+    logger.info(f'Rated {winner} over {len(ratings)} songs')
+    song_ids = [winner.id, *(rating.loser_id for rating in ratings)]
+    if settings.RATING_ENGINE == RATING_ENGINE_BRADLEY_TERRY:
+        update_strengths(winner.id, song_ids[1:])
+
+    albums = Album.objects.filter(songs__id__in=song_ids).distinct()
+    previous_ratings = {album.id: album.rating for album in albums}
+    rebuild_stats(song_ids, plays=False)
+
+    artist_ids = set()
+    for album in albums.all():
+        record_album_rating(album, previous_ratings[album.id])
+        artist_ids.add(album.artist_id)
+    invalidate_artist_percentiles(artist_ids)
+    publish(EVENT_RATING, artist_ids, song_ids=song_ids)
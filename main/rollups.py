@@ -0,0 +1,126 @@
+import logging
+from typing import Iterable, List
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Model, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from main.models import (
+    Album,
+    AlbumCountBucket,
+    Artist,
+    DailyPlayCount,
+    History,
+    PlayCountBucket,
+    Similar,
+    SimilarCandidate,
+    Song,
+    YearAlbumRating,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def bump(model: type[Model], key: dict, **deltas):
+    """Add deltas to the rollup row of key, creating it when missing."""
+    updated = model.objects.filter(**key).update(**{f: F(f) + d for f, d in deltas.items()})
+    if not updated:
+        model.objects.create(**key, **deltas)
+
+
+def record_play(history: History, previous_count_played: int):
+    """Update rollups for a new play of the song.
+
+    Days are those of TIME_ZONE, not of the browser timezone, so rollups are shared by all.
+    """
+    played_date = timezone.localdate(history.played_at, timezone.get_default_timezone())
+    bump(DailyPlayCount, {'date': played_date}, count_played=1)
+
+    song = history.song
+    if song.count_played != previous_count_played:
+        bump(PlayCountBucket, {'count_played': previous_count_played}, count_songs=-1)
+        bump(PlayCountBucket, {'count_played': song.count_played}, count_songs=1)
+
+
+def record_album_rating(album: Album, previous_rating: float):
+    """Update rollups for a changed album rating."""
+    if album.rating != previous_rating:
+        bump(YearAlbumRating, {'year': album.year}, total_rating=album.rating - previous_rating)
+
+
+def record_similars(similars: List[Similar], previous_scores: dict):
+    """Add the score changes of upserted similars to the candidates not in the library."""
+    deltas = {}
+    names = {}
+    for similar in similars:
+        delta = similar.score - previous_scores.get(similar.artist_slug, 0)
+        deltas[similar.artist_slug] = deltas.get(similar.artist_slug, 0) + delta
+        names[similar.artist_slug] = similar.artist_name
+    known_slugs = set(Artist.objects.filter(slug__in=deltas).values_list('slug', flat=True))
+    existing = SimilarCandidate.objects.in_bulk(list(deltas), field_name='artist_slug')
+
+    candidates = [
+        SimilarCandidate(
+            artist_slug=slug,
+            artist_name=existing[slug].artist_name if slug in existing else names[slug],
+            total_score=(existing[slug].total_score if slug in existing else 0) + delta,
+        )
+        for slug, delta in deltas.items()
+        if slug not in known_slugs
+    ]
+    SimilarCandidate.objects.bulk_create(
+        candidates,
+        update_conflicts=True,
+        unique_fields=['artist_slug'],
+        update_fields=['total_score'],
+    )
+
+
+def remove_similar_candidates(artist_slugs: Iterable[str]):
+    """Drop candidates that are now in the library."""
+    SimilarCandidate.objects.filter(artist_slug__in=artist_slugs).delete()
+
+
+def rebuild_similar_candidates():
+    """Rebuild the candidates from all similars, e.g. after artists were removed."""
+    grouped = (
+        Similar.objects.exclude(artist_slug__in=Artist.objects.values('slug'))
+        .values('artist_slug')
+        .annotate(total_score=Sum('score'), artist_name=Max('artist_name'))
+        .order_by()
+    )
+    with transaction.atomic():
+        SimilarCandidate.objects.all().delete()
+        SimilarCandidate.objects.bulk_create(SimilarCandidate(**row) for row in grouped)
+
+
+def rebuild_rollups(*args, **kwargs):
+    """Rebuild all rollups from scratch, e.g. after songs were added or removed."""
+    played_dates = (
+        History.objects.filter(played_at__isnull=False)
+        .annotate(played_date=TruncDate('played_at', tzinfo=timezone.get_default_timezone()))
+        .values('played_date')
+        .annotate(count_played=Count('id'))
+        .order_by()
+    )
+    years = Album.objects.values('year').annotate(
+        count_albums=Count('id'), total_rating=Sum('rating')
+    )
+    play_counts = Song.objects.values('count_played').annotate(count_songs=Count('id'))
+    album_counts = Artist.objects.values('count_albums').annotate(count_artists=Count('id'))
+
+    with transaction.atomic():
+        DailyPlayCount.objects.all().delete()
+        DailyPlayCount.objects.bulk_create(
+            DailyPlayCount(date=row['played_date'], count_played=row['count_played'])
+            for row in played_dates
+        )
+        YearAlbumRating.objects.all().delete()
+        YearAlbumRating.objects.bulk_create(YearAlbumRating(**row) for row in years)
+        PlayCountBucket.objects.all().delete()
+        PlayCountBucket.objects.bulk_create(PlayCountBucket(**row) for row in play_counts)
+        AlbumCountBucket.objects.all().delete()
+        AlbumCountBucket.objects.bulk_create(AlbumCountBucket(**row) for row in album_counts)
+        rebuild_similar_candidates()
+    logger.info('Rebuilt stats rollups')
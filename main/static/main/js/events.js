@@ -0,0 +1,58 @@
+// Follow plays, ratings and genre changes of other tabs through the server-sent events of /events/.
+// Plays and ratings only swap the rows of the changed songs, genre changes refresh the album
+// fragment on screen when its artist changed. The tab that caused an event refreshes itself.
+$(document).ready(function () {
+    const tabId = window.crypto && crypto.randomUUID
+        ? crypto.randomUUID()
+        : Math.random().toString(36).slice(2);
+
+    // events carry the id of the tab whose request caused them
+    document.body.addEventListener('htmx:configRequest', function (event) {
+        event.detail.headers['X-Tab-Id'] = tabId;
+    });
+
+    if (!window.EventSource) {
+        return;
+    }
+    const source = new EventSource('/events/');
+
+    function refreshChangedRows(event) {
+        const data = JSON.parse(event.data);
+        if (data.origin === tabId) {
+            return;
+        }
+        const songIds = data.song_ids || [data.song_id];
+        songIds.forEach(function (songId) {
+            if (document.getElementById(`album-song-${songId}`)) {
+                console.log(`${event.type} event ${event.lastEventId}, refreshing song ${songId}`);
+                htmx.ajax('GET', `/album/song/${songId}/`, {
+                    target: `#album-song-${songId}`,
+                    swap: 'outerHTML',
+                });
+            }
+        });
+    }
+
+    function refreshChangedAlbum(event) {
+        const data = JSON.parse(event.data);
+        if (data.origin === tabId) {
+            return;
+        }
+        const $album = $('#album-fragment');
+        if ($album.length && data.artist_ids.includes($album.data('artist-id'))) {
+            console.log(`${event.type} event ${event.lastEventId}, refreshing album`);
+            htmx.trigger(document.body, 'refreshAlbum');
+        }
+    }
+
+    source.addEventListener('play', refreshChangedRows);
+    source.addEventListener('rating', refreshChangedRows);
+    source.addEventListener('genre', refreshChangedAlbum);
+
+    source.onerror = function () {
+        // closed for good when not served under ASGI, otherwise the browser reconnects
+        if (source.readyState === EventSource.CLOSED) {
+            console.log('Event stream unavailable, only this tab updates its fragments');
+        }
+    };
+});
@@ -0,0 +1,35 @@
+// Render stats charts client side from the JSON served by /stats/graph/<name>/
+function renderStatsGraphs(elt) {
+    $(elt).find('.stats-graph[data-graph-url]').addBack('.stats-graph[data-graph-url]').each(function () {
+        const container = this;
+        fetch(container.dataset.graphUrl)
+            .then(response => response.json())
+            .then(function (chart) {
+                if (chart.error || !chart.x.length) {
+                    $(container).html('<p>No data/graph was provided.</p>');
+                    return;
+                }
+                const trace = {type: 'bar', x: chart.x, y: chart.y};
+                if (chart.text) {
+                    trace.text = chart.text;
+                }
+                if (chart.hovertemplate) {
+                    trace.hovertemplate = chart.hovertemplate;
+                }
+                const layout = {
+                    title: chart.title,
+                    xaxis: Object.assign({title: chart.x_title}, chart.xaxis),
+                    yaxis: {title: chart.y_title},
+                    autosize: true,
+                    margin: {l: 20, r: 20, t: 30, b: 20},
+                };
+                Plotly.newPlot(container, [trace], layout, {responsive: true});
+                console.log("Rendered stats graph", chart.title);
+            });
+    });
+}
+
+// Charts arrive with the stats partial
+document.addEventListener('htmx:load', function (event) {
+    renderStatsGraphs(event.detail.elt);
+});
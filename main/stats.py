@@ -0,0 +1,170 @@
+import logging
+from typing import Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from main.constants import RATING_ENGINE_BRADLEY_TERRY, RATING_ENGINE_RATIO
+from main.fragments import (
+    SCOPE_LIBRARY,
+    SCOPE_RANKINGS,
+    SCOPE_RATINGS,
+    artist_scope,
+    bump_fragments,
+)
+from main.models import Artist
+from main.percentiles import invalidate_artist_percentiles
+from main.rollups import rebuild_rollups
+
+logger = logging.getLogger(__name__)
+
+# average played_at as unix seconds, SQLite datetimes are stored in UTC
+# (statements always run with params, so % is escaped)
+AVG_PLAYED_AT_SQL = "datetime(AVG(strftime('%%s', played_at)), 'unixepoch')"
+
+SONG_PLAYS_SQL = """
+    UPDATE main_song
+    SET count_played = agg.count_played, played_at = agg.played_at
+    FROM (
+        SELECT s.id, COUNT(h.id) AS count_played, MAX(h.played_at) AS played_at
+        FROM main_song s LEFT JOIN main_history h ON h.song_id = s.id
+        {where}
+        GROUP BY s.id
+    ) AS agg
+    WHERE main_song.id = agg.id
+"""
+
+SONG_RATINGS_SQL = """
+    UPDATE main_song
+    SET count_rated = agg.count_rated,
+        rated_at = agg.rated_at,
+        rating = {rating}
+    FROM (
+        SELECT s.id, COALESCE(SUM(p.count_rated), 0) AS count_rated,
+               SUM(p.count_wins) AS count_wins, MAX(p.rated_at) AS rated_at
+        FROM main_song s LEFT JOIN (
+            SELECT song_a_id AS song_id, a_wins AS count_wins, a_wins + b_wins AS count_rated,
+                   last_rated_at AS rated_at
+            FROM main_ratingpair
+            UNION ALL
+            SELECT song_b_id AS song_id, b_wins AS count_wins, a_wins + b_wins AS count_rated,
+                   last_rated_at AS rated_at
+            FROM main_ratingpair
+        ) p ON p.song_id = s.id
+        {where}
+        GROUP BY s.id
+    ) AS agg
+    WHERE main_song.id = agg.id
+"""
+
+# song rating per engine, the bradley-terry one is the chance of beating an average song
+RATING_SQL = {
+    RATING_ENGINE_RATIO: (
+        'COALESCE(agg.count_wins * 1.0 / NULLIF(agg.count_rated, 0), main_song.rating)'
+    ),
+    RATING_ENGINE_BRADLEY_TERRY: '1.0 / (1.0 + exp(-main_song.strength))',
+}
+
+ALBUMS_SQL = f"""
+    UPDATE main_album
+    SET count_songs = agg.count_songs,
+        total_length = agg.total_length,
+        count_played = agg.count_played,
+        played_at = agg.played_at,
+        avg_played_at = agg.avg_played_at,
+        count_rated = agg.count_rated,
+        rated_at = agg.rated_at,
+        rating = agg.rating
+    FROM (
+        SELECT album_id, COUNT(*) AS count_songs, SUM(track_length) AS total_length,
+               SUM(count_played) AS count_played, MAX(played_at) AS played_at,
+               {AVG_PLAYED_AT_SQL} AS avg_played_at,
+               SUM(count_rated) AS count_rated, MAX(rated_at) AS rated_at, AVG(rating) AS rating
+        FROM main_song
+        {{where}}
+        GROUP BY album_id
+    ) AS agg
+    WHERE main_album.id = agg.album_id
+"""  # noqa: S608
+
+ARTISTS_SQL = f"""
+    UPDATE main_artist
+    SET count_albums = (SELECT COUNT(*) FROM main_album a WHERE a.artist_id = agg.artist_id),
+        count_songs = agg.count_songs,
+        total_length = agg.total_length,
+        count_played = agg.count_played,
+        played_at = agg.played_at,
+        avg_played_at = agg.avg_played_at,
+        count_rated = agg.count_rated,
+        rated_at = agg.rated_at,
+        rating = agg.rating
+    FROM (
+        SELECT artist_id, COUNT(*) AS count_songs, SUM(track_length) AS total_length,
+               SUM(count_played) AS count_played, MAX(played_at) AS played_at,
+               {AVG_PLAYED_AT_SQL} AS avg_played_at,
+               SUM(count_rated) AS count_rated, MAX(rated_at) AS rated_at, AVG(rating) AS rating
+        FROM main_song
+        {{where}}
+        GROUP BY artist_id
+    ) AS agg
+    WHERE main_artist.id = agg.artist_id
+"""  # noqa: S608
+
+
+def where_in(column: str, ids: Optional[List[int]]) -> Tuple[str, List[int]]:
+    """Get WHERE clause and params limiting column to ids, or everything without ids."""
+    if ids is None:
+        return '', []
+    return f'WHERE {column} IN ({", ".join(["%s"] * len(ids))})', ids
+
+
+def rebuild_stats(
+    song_ids: Optional[Iterable[int]] = None,
+    plays: bool = True,
+    ratings: bool = True,
+):
+    """Recompute denormalized stats of songs, and of their albums and artists, in set-based SQL.
+
+    Without song ids everything is rebuilt. Song play and rating stats come from the
+    histories and rating pairs, album and artist stats from their songs.
+    """
+    album_ids = artist_ids = None
+    if song_ids is not None:
+        song_ids = list(song_ids)
+        if not song_ids:
+            return
+        where, params = where_in('id', song_ids)
+        sql = f'SELECT DISTINCT album_id, artist_id FROM main_song {where}'  # noqa: S608
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        album_ids = sorted({album_id for album_id, _ in rows})
+        artist_ids = sorted({artist_id for _, artist_id in rows})
+
+    statements = []
+    if plays:
+        statements.append((SONG_PLAYS_SQL, where_in('s.id', song_ids)))
+    if ratings:
+        sql = SONG_RATINGS_SQL.replace('{rating}', RATING_SQL[settings.RATING_ENGINE])
+        statements.append((sql, where_in('s.id', song_ids)))
+    statements.append((ALBUMS_SQL, where_in('album_id', album_ids)))
+    statements.append((ARTISTS_SQL, where_in('artist_id', artist_ids)))
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        for sql, (where, params) in statements:
+            cursor.execute(sql.format(where=where), params)
+    if artist_ids is None:
+        scopes = [SCOPE_LIBRARY]
+    else:
+        scopes = [*map(artist_scope, artist_ids), SCOPE_RANKINGS]
+    if ratings:
+        scopes.append(SCOPE_RATINGS)
+    bump_fragments(scopes)
+    logger.info(f'Rebuilt stats for {"all" if song_ids is None else len(song_ids)} songs')
+
+
+def rebuild_all_stats(*args, **kwargs):
+    """Rebuild all denormalized stats, and the rollups and caches derived from them."""
+    rebuild_stats()
+    rebuild_rollups()
+    invalidate_artist_percentiles(Artist.objects.values_list('id', flat=True))
@@ -0,0 +1,114 @@
+import logging
+import math
+from typing import Dict, List, Tuple
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+from main.models import RatingPair, Song
+from main.stats import rebuild_all_stats
+
+logger = logging.getLogger(__name__)
+
+# step size of the incremental update, shrinking as a song collects comparisons
+STRENGTH_STEP = 1.0
+# virtual win and loss of every song against an average song, keeps strengths finite
+STRENGTH_PRIOR = 1.0
+FIT_MAX_ITERATIONS = 500
+FIT_TOLERANCE = 1e-6
+
+
+def strength_to_rating(strength: float) -> float:
+    """Get the chance of beating an average song, the rating of the bradley-terry engine."""
+    return 1 / (1 + math.exp(-strength))
+
+
+def elo_step(
+    strength_w: float, strength_l: float, count_w: int, count_l: int
+) -> Tuple[float, float]:
+    """Get the strength changes of winner and loser, a gradient step on the BT likelihood."""
+    surprise = 1 - 1 / (1 + math.exp(strength_l - strength_w))
+    step_w = STRENGTH_STEP / math.sqrt(1 + count_w)
+    step_l = STRENGTH_STEP / math.sqrt(1 + count_l)
+    return step_w * surprise, -step_l * surprise
+
+
+def update_strengths(winner_id: int, loser_ids: List[int]):
+    """Update strengths of a match incrementally, cheap enough to run after every rating."""
+    songs = (
+        Song.objects.select_related(None)
+        .only('id', 'strength', 'count_rated')
+        .in_bulk([winner_id, *loser_ids])
+    )
+    winner = songs[winner_id]
+    deltas = {song_id: 0.0 for song_id in songs}
+    # all results of the match are scored against the strengths from before it
+    for loser_id in loser_ids:
+        loser = songs[loser_id]
+        delta_w, delta_l = elo_step(
+            winner.strength, loser.strength, winner.count_rated, loser.count_rated
+        )
+        deltas[winner_id] += delta_w
+        deltas[loser_id] += delta_l
+    for song_id, delta in deltas.items():
+        songs[song_id].strength += delta
+    Song.objects.bulk_update(songs.values(), ['strength'])
+    logger.info(f'Updated strengths of {len(songs)} songs')
+
+
+def fit_strengths(
+    song_a_ids: List[int],
+    song_b_ids: List[int],
+    a_wins: List[int],
+    b_wins: List[int],
+) -> Dict[int, float]:
+    """Fit bradley-terry log strengths over the whole comparison graph.
+
+    Uses the minorization-maximization updates of Hunter (2004), vectorized over the pairs
+    with numpy. Every song also plays one virtual win and loss against a fixed average song,
+    so songs that never won, or never lost, keep finite strengths.
+    """
+    try:
+        import numpy as np
+    except ImportError as exc:
+        raise ImproperlyConfigured('The bradley-terry rating engine requires numpy') from exc
+
+    song_ids, index = np.unique(
+        np.array([song_a_ids, song_b_ids], dtype=np.int64), return_inverse=True
+    )
+    if not song_ids.size:
+        return {}
+    a, b = index.reshape(2, -1)
+    a_wins = np.asarray(a_wins, dtype=np.float64)
+    b_wins = np.asarray(b_wins, dtype=np.float64)
+    games = a_wins + b_wins
+    size = song_ids.size
+    wins = np.bincount(a, a_wins, size) + np.bincount(b, b_wins, size) + STRENGTH_PRIOR
+
+    p = np.ones(size)
+    change = math.inf
+    iterations = 0
+    while change > FIT_TOLERANCE and iterations < FIT_MAX_ITERATIONS:
+        per_pair = games / (p[a] + p[b])
+        prior = 2 * STRENGTH_PRIOR / (p + 1)
+        p_next = wins / (np.bincount(a, per_pair, size) + np.bincount(b, per_pair, size) + prior)
+        change = np.max(np.abs(np.log(p_next / p)))
+        p = p_next
+        iterations += 1
+    logger.info(f'Fitted strengths of {size} songs in {iterations} iterations')
+    return dict(zip(song_ids.tolist(), np.log(p).tolist(), strict=True))
+
+
+def refit_strengths(*args, **kwargs):
+    """Refit the strengths of all songs from the pairwise results, and rebuild the stats."""
+    pairs = RatingPair.objects.values_list('song_a_id', 'song_b_id', 'a_wins', 'b_wins')
+    columns = list(zip(*pairs, strict=True)) or [[], [], [], []]
+    strengths = fit_strengths(*columns)
+
+    songs = list(Song.objects.select_related(None).only('id', 'strength'))
+    for song in songs:
+        song.strength = strengths.get(song.id, 0.0)
+    with transaction.atomic():
+        Song.objects.bulk_update(songs, ['strength'], batch_size=1_000)
+    rebuild_all_stats()
+    logger.info(f'Refitted strengths of {len(songs)} songs')
@@ -0,0 +1,333 @@
+import logging
+import math
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+from mutagen import id3
+from unidecode import unidecode
+
+from main.constants import LIST_GENRES
+from main.models import Album, Artist, History, Rating, Song
+from main.ratings import record_pair_results
+from main.rollups import rebuild_rollups
+
+logger = logging.getLogger(__name__)
+
+SYLLABLES = [
+    'ba', 'cor', 'da', 'el', 'fen', 'gor', 'ha', 'in', 'jo', 'ka', 'lor', 'mi', 'nor', 'o',
+    'pa', 'quin', 'ra', 'sil', 'tor', 'u', 'val', 'wen', 'xa', 'yor', 'zel',
+]  # fmt: skip
+
+# MPEG-1 layer III, 32kbps, 44.1kHz, mono: 104 byte frames of silence
+MP3_FRAME = bytes([0xFF, 0xFB, 0x10, 0xC0]) + bytes(100)
+MP3_FRAMES = 40
+
+# artists are generated, inserted and seeded in batches to bound memory
+ARTISTS_PER_BATCH = 200
+UNPLAYED_RATIO = 0.03
+
+
+def make_name(rng: random.Random, count_words: int) -> str:
+    """Make a pronounceable name out of random syllables."""
+    words = []
+    for _ in range(count_words):
+        word = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3)))
+        words.append(word.title())
+    return ' '.join(words)
+
+
+def iter_library(count_songs: int, rng: random.Random) -> Iterator[dict]:
+    """Yield artist specs with albums and tracks until the song count is reached."""
+    artist_slugs = set()
+    remaining = count_songs
+    while remaining > 0:
+        name = make_name(rng, rng.randint(1, 3))
+        if slugify(name) in artist_slugs:
+            name = f'{name} {len(artist_slugs)}'
+        artist_slugs.add(slugify(name))
+
+        albums = []
+        album_slugs = set()
+        count_albums = min(1 + int(rng.expovariate(1 / 3)), 20)
+        for _ in range(count_albums):
+            if remaining <= 0:
+                break
+            album_name = make_name(rng, rng.randint(1, 4))
+            if slugify(album_name) in album_slugs:
+                album_name = f'{album_name} {len(album_slugs)}'
+            album_slugs.add(slugify(album_name))
+            total_discs = 2 if rng.random() < 0.05 else 1  # noqa: PLR2004
+            total_tracks = min(max(int(rng.gauss(11, 3)), 1), remaining)
+            tracks = []
+            for ix in range(total_tracks):
+                tracks.append(
+                    {
+                        'title': make_name(rng, rng.randint(1, 4)),
+                        'disc_number': 1 + ix * total_discs // total_tracks,
+                        'track_number': ix + 1,
+                        'track_length': max(rng.gauss(240, 60), 30),
+                    }
+                )
+            remaining -= total_tracks
+            albums.append(
+                {
+                    'name': album_name,
+                    'year': rng.randint(1965, 2024),
+                    'total_discs': total_discs,
+                    'total_tracks': total_tracks,
+                    'tracks': tracks,
+                }
+            )
+        yield {'name': name, 'genre': rng.choice(LIST_GENRES), 'albums': albums}
+
+
+def write_mp3(file_path: Path, artist: dict, album: dict, track: dict):
+    """Write a tiny but valid mp3 file with ID3 tags."""
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    file_path.write_bytes(MP3_FRAME * MP3_FRAMES)
+    tags = id3.ID3()
+    tags.add(id3.TIT2(encoding=3, text=track['title']))
+    tags.add(id3.TPE1(encoding=3, text=artist['name']))
+    tags.add(id3.TALB(encoding=3, text=album['name']))
+    tags.add(id3.TRCK(encoding=3, text=f'{track["track_number"]}/{album["total_tracks"]}'))
+    tags.add(id3.TPOS(encoding=3, text=f'{track["disc_number"]}/{album["total_discs"]}'))
+    tags.add(id3.TDRC(encoding=3, text=str(album['year'])))
+    tags.save(file_path)
+
+
+def rel_path_for(artist: dict, album: dict, track: dict) -> str:
+    """Get relative path of track in the music folder."""
+    return (
+        f'{artist["name"]}/{album["year"]} - {album["name"]}/'
+        f'{track["disc_number"]}{track["track_number"]:02} - {track["title"]}.mp3'
+    )
+
+
+def write_library_files(music_dir: Path, artists: List[dict]) -> int:
+    """Write mp3 files for the artist specs."""
+    cnt = 0
+    for artist in artists:
+        for album in artist['albums']:
+            for track in album['tracks']:
+                write_mp3(music_dir / rel_path_for(artist, album, track), artist, album, track)
+                cnt += 1
+    return cnt
+
+
+def build_library_rows(artists: List[dict]) -> List[Song]:
+    """Build unsaved artist, album and song rows for the specs."""
+    songs = []
+    for artist in artists:
+        artist_obj = Artist(
+            name=artist['name'],
+            slug=slugify(unidecode(artist['name'])),
+            genre=artist['genre'],
+            total_length=0,
+        )
+        for album in artist['albums']:
+            album_obj = Album(
+                artist=artist_obj,
+                name=album['name'],
+                slug=f'{artist_obj.slug}-{slugify(unidecode(album["name"]))}',
+                year=album['year'],
+                total_discs=album['total_discs'],
+                total_tracks=album['total_tracks'],
+                genre=artist_obj.genre,
+                total_length=0,
+            )
+            for track in album['tracks']:
+                rel_path = rel_path_for(artist, album, track)
+                songs.append(
+                    Song(
+                        artist=artist_obj,
+                        album=album_obj,
+                        rel_path=rel_path,
+                        slug=slugify(unidecode(rel_path)),
+                        name=track['title'],
+                        disc_number=track['disc_number'],
+                        track_number=track['track_number'],
+                        track_length=track['track_length'],
+                        genre=artist_obj.genre,
+                    )
+                )
+    return songs
+
+
+def simulate_activity(  # noqa: PLR0915
+    songs: List[Song],
+    rng: random.Random,
+    plays_per_song: float = 4,
+    ratings_per_song: float = 6,
+    days: int = 365,
+) -> Tuple[List[History], List[Rating]]:
+    """Simulate play history and ratings for songs and set their stats.
+
+    Plays are log-normal around `plays_per_song` and skewed towards songs with a higher
+    latent quality, and matches are decided Bradley-Terry style on that same quality.
+    Nothing is saved.
+    """
+    now = timezone.now()
+    quality = {id(song): rng.gauss(0, 1) for song in songs}
+
+    histories = []
+    played = []
+    for song in songs:
+        song.count_played = 0
+        song.played_at = None
+        if rng.random() < UNPLAYED_RATIO:
+            continue
+        mu = math.log(plays_per_song) + 0.3 * quality[id(song)]
+        song.count_played = max(int(rng.lognormvariate(mu, 0.6)), 1)
+        for _ in range(song.count_played):
+            # skew plays towards recent days
+            played_at = now - timedelta(days=days * rng.random() ** 2)
+            histories.append(History(song=song, played_at=played_at))
+            if song.played_at is None or played_at > song.played_at:
+                song.played_at = played_at
+        played.append(song)
+
+    ratings = []
+    wins = defaultdict(int)
+    rated = defaultdict(int)
+    rated_at = {}
+    count_ratings = int(len(played) * ratings_per_song / 2) if len(played) > 1 else 0
+    for _ in range(count_ratings):
+        song_a, song_b = rng.sample(played, 2)
+        p_a = 1 / (1 + math.exp(quality[id(song_b)] - quality[id(song_a)]))
+        winner, loser = (song_a, song_b) if rng.random() < p_a else (song_b, song_a)
+        at = now - timedelta(days=days * rng.random() ** 2)
+        ratings.append(Rating(winner=winner, loser=loser, rated_at=at))
+        wins[id(winner)] += 1
+        for song in (winner, loser):
+            rated[id(song)] += 1
+            rated_at[id(song)] = max(at, rated_at.get(id(song), at))
+    for song in songs:
+        song.count_rated = rated[id(song)]
+        song.rated_at = rated_at.get(id(song))
+        song.rating = wins[id(song)] / rated[id(song)] if rated[id(song)] else 0
+
+    return histories, ratings
+
+
+def aggregate_library_stats(songs: List[Song]) -> Tuple[List[Album], List[Artist]]:
+    """Set the denormalized stats of the albums and artists of the songs.
+
+    All songs of those albums and artists must be included.
+    """
+    # songs loaded from the db have their own album and artist instances
+    albums = {}
+    artists = {}
+    album_songs = defaultdict(list)
+    artist_songs = defaultdict(list)
+    for song in songs:
+        album = albums.setdefault(song.album.slug, song.album)
+        artist = artists.setdefault(song.artist.slug, song.artist)
+        album_songs[album.slug].append(song)
+        artist_songs[artist.slug].append(song)
+    for slug, album in albums.items():
+        set_aggregate_stats(album, album_songs[slug])
+    for slug, artist in artists.items():
+        set_aggregate_stats(artist, artist_songs[slug])
+        artist.count_albums = len({s.album.slug for s in artist_songs[slug]})
+    return list(albums.values()), list(artists.values())
+
+
+def seed_activity(songs: List[Song], rng: random.Random, **activity_kwargs):
+    """Create play history and ratings for existing songs and update their stats."""
+    histories, ratings = simulate_activity(songs, rng, **activity_kwargs)
+    albums, artists = aggregate_library_stats(songs)
+    stats_fields = ['count_played', 'played_at', 'count_rated', 'rated_at', 'rating']
+    agg_fields = ['count_songs', 'total_length', 'avg_played_at', *stats_fields]
+    with transaction.atomic():
+        History.objects.bulk_create(histories, batch_size=5_000)
+        Rating.objects.bulk_create(ratings, batch_size=5_000)
+        record_pair_results(ratings)
+        Song.objects.bulk_update(songs, stats_fields, batch_size=1_000)
+        Album.objects.bulk_update(albums, agg_fields, batch_size=1_000)
+        Artist.objects.bulk_update(artists, ['count_albums', *agg_fields], batch_size=1_000)
+    logger.info(f'Seeded {len(histories)} plays and {len(ratings)} ratings for {len(songs)} songs')
+
+
+def set_aggregate_stats(obj, songs: List[Song]):
+    """Set denormalized album or artist stats from its songs."""
+    played_ats = [s.played_at for s in songs if s.played_at]
+    rated_ats = [s.rated_at for s in songs if s.rated_at]
+    obj.count_songs = len(songs)
+    obj.total_length = sum(s.track_length for s in songs)
+    obj.count_played = sum(s.count_played for s in songs)
+    obj.played_at = max(played_ats, default=None)
+    obj.avg_played_at = (
+        timezone.make_aware(
+            datetime.fromtimestamp(sum(p.timestamp() for p in played_ats) / len(played_ats))
+        )
+        if played_ats
+        else None
+    )
+    obj.count_rated = sum(s.count_rated for s in songs)
+    obj.rated_at = max(rated_ats, default=None)
+    obj.rating = sum(s.rating for s in songs) / len(songs)
+
+
+def generate_library(
+    count_songs: int,
+    seed: Optional[int] = None,
+    music_dir: Optional[Path] = None,
+    activity: bool = True,
+    **activity_kwargs,
+) -> int:
+    """Generate a synthetic library of roughly `count_songs` songs.
+
+    With a `music_dir` only mp3 files are written (scan them in afterward), otherwise rows
+    are inserted directly and seeded with plays and ratings.
+    """
+    rng = random.Random(seed)  # noqa: S311
+    cnt = 0
+    batch = []
+    for artist in iter_library(count_songs, rng):
+        batch.append(artist)
+        if len(batch) >= ARTISTS_PER_BATCH:
+            cnt += _generate_batch(batch, rng, music_dir, activity, activity_kwargs)
+            batch = []
+    if batch:
+        cnt += _generate_batch(batch, rng, music_dir, activity, activity_kwargs)
+    # rows are bulk inserted past the incremental rollup updates
+    if not music_dir:
+        rebuild_rollups()
+    logger.info(f'Generated {cnt} songs')
+    return cnt
+
+
+def _generate_batch(
+    artists: List[dict], rng: random.Random, music_dir: Path, activity: bool, activity_kwargs
+) -> int:
+    if music_dir:
+        return write_library_files(music_dir, artists)
+    songs = build_library_rows(artists)
+    histories, ratings = simulate_activity(songs, rng, **activity_kwargs) if activity else ([], [])
+    albums, artists = aggregate_library_stats(songs)
+    # related rows pick up the primary keys of their parents as those are created
+    with transaction.atomic():
+        Artist.objects.bulk_create(artists)
+        Album.objects.bulk_create(albums)
+        Song.objects.bulk_create(songs)
+        History.objects.bulk_create(histories, batch_size=5_000)
+        Rating.objects.bulk_create(ratings, batch_size=5_000)
+        record_pair_results(ratings)
+    logger.info(f'Inserted {len(songs)} songs with {len(histories)} plays')
+    return len(songs)
+
+
+def seed_library_activity(seed: Optional[int] = None, **activity_kwargs):
+    """Seed plays and ratings for the songs already in the database, e.g. after a scan."""
+    rng = random.Random(seed)  # noqa: S311
+    artist_ids = list(Artist.objects.order_by('id').values_list('id', flat=True))
+    for ix in range(0, len(artist_ids), ARTISTS_PER_BATCH):
+        songs = list(Song.objects.filter(artist_id__in=artist_ids[ix : ix + ARTISTS_PER_BATCH]))
+        seed_activity(songs, rng, **activity_kwargs)
+    rebuild_rollups()
@@ -97,7 +97,7 @@ class SongTable(tables.Table):
 
     def render_rating(self, value: str, record: Song, column) -> str:
         """Render rating."""
-        if record.id == self.request.session.get('song_id'):
+        if record.id == self.request.player.song_id:
             column.attrs['td']['class'] += ' fw-bold'
         else:
             column.attrs['td']['class'] = column.attrs['td']['class'].replace(' fw-bold', '')
@@ -272,7 +272,7 @@ class AlbumTable(tables.Table):
 
     def render_rating(self, value: str, record: Album, column) -> str:
         """Render rating."""
-        song = Song.objects.get(id=self.request.session.get('song_id'))
+        song = Song.objects.get(id=self.request.player.song_id)
         if record.id == song.album.id:
             column.attrs['td']['class'] += ' fw-bold'
         else:
@@ -440,7 +440,7 @@ class ArtistTable(tables.Table):
 
     def render_rating(self, value: str, record: Artist, column) -> str:
         """Render rating."""
-        song = Song.objects.get(id=self.request.session.get('song_id'))
+        song = Song.objects.get(id=self.request.player.song_id)
         if record.id == song.artist.id:
             column.attrs['td']['class'] += ' fw-bold'
         else:
@@ -0,0 +1,224 @@
+import importlib
+import logging
+import time
+import traceback
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional, Set
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from main.constants import (
+    TASK_STATUS_DONE,
+    TASK_STATUS_FAILED,
+    TASK_STATUS_PENDING,
+    TASK_STATUS_RUNNING,
+)
+from main.models import Task
+
+logger = logging.getLogger(__name__)
+
+# modules registering tasks, the worker imports them before it claims any
+TASK_MODULES = ['main.crawler', 'main.lastfm_service', 'main.lyrics']
+# seconds the worker sleeps when no task is due
+POLL_INTERVAL = 1.0
+# running tasks older than this were lost with their worker, and are queued again
+TASK_TIMEOUT = 3600
+# finished tasks are kept this many days to look into
+TASK_RETENTION_DAYS = 7
+
+
+class TaskSpec:
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        priority: int,
+        max_attempts: int,
+        retry_delay: float,
+        every: Optional[float],
+    ):
+        """Registered task, with the defaults of the tasks queued for it."""
+        self.name = name
+        self.func = func
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.every = every
+
+
+TASKS: Dict[str, TaskSpec] = {}
+
+
+def task(
+    priority: int = 0,
+    max_attempts: int = 3,
+    retry_delay: float = 60,
+    every: Optional[float] = None,
+) -> Callable:
+    """Register function as a task, queued by enqueue with json serializable kwargs.
+
+    Failed attempts are retried with exponential backoff from retry_delay seconds. Tasks
+    with every seconds are queued by the worker, again every seconds after each run.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        name = f'{func.__module__}.{func.__name__}'
+        TASKS[name] = TaskSpec(name, func, priority, max_attempts, retry_delay, every)
+        func.task_name = name
+        return func
+
+    return decorator
+
+
+def load_tasks():
+    """Import the modules registering tasks."""
+    for module in TASK_MODULES:
+        importlib.import_module(module)
+
+
+def queue_task(
+    spec: TaskSpec,
+    kwargs: dict,
+    priority: Optional[int] = None,
+    delay: float = 0,
+    dedupe_key: Optional[str] = None,
+) -> Optional[Task]:
+    """Queue a task, unless one with the same dedupe key is queued or running."""
+    try:
+        with transaction.atomic():
+            return Task.objects.create(
+                name=spec.name,
+                kwargs=kwargs,
+                priority=spec.priority if priority is None else priority,
+                run_at=timezone.now() + timedelta(seconds=delay),
+                max_attempts=spec.max_attempts,
+                dedupe_key=dedupe_key,
+            )
+    except IntegrityError:
+        logger.debug(f'Task {dedupe_key} is already queued')
+        return None
+
+
+def enqueue(
+    func: Callable,
+    priority: Optional[int] = None,
+    delay: float = 0,
+    dedupe_key: Optional[str] = None,
+    **kwargs,
+) -> Optional[Task]:
+    """Queue func for the worker, or run it right away when TASKS_ASYNC is off."""
+    spec = TASKS[func.task_name]
+    if not settings.TASKS_ASYNC:
+        try:
+            spec.func(**kwargs)
+        except Exception:
+            logger.exception(f'Task {spec.name} failed')
+        return None
+    return queue_task(spec, kwargs, priority=priority, delay=delay, dedupe_key=dedupe_key)
+
+
+def get_failed_dedupe_keys(dedupe_keys: List[str], seconds: float) -> Set[str]:
+    """Get the dedupe keys of tasks that failed in the last seconds, in any process."""
+    failed_since = timezone.now() - timedelta(seconds=seconds)
+    failed_tasks = Task.objects.filter(
+        dedupe_key__in=dedupe_keys, status=TASK_STATUS_FAILED, finished_at__gte=failed_since
+    )
+    return set(failed_tasks.values_list('dedupe_key', flat=True))
+
+
+def periodic_dedupe_key(spec: TaskSpec) -> str:
+    """Get dedupe key of a periodic task, so only its next run is queued."""
+    return f'periodic_{spec.name}'
+
+
+def schedule_periodic_tasks():
+    """Queue the periodic tasks that have no next run queued."""
+    for spec in TASKS.values():
+        if spec.every:
+            queue_task(spec, {}, dedupe_key=periodic_dedupe_key(spec))
+
+
+def requeue_stale_tasks() -> int:
+    """Queue running tasks again that outlived their worker."""
+    started_before = timezone.now() - timedelta(seconds=TASK_TIMEOUT)
+    count = Task.objects.filter(status=TASK_STATUS_RUNNING, started_at__lt=started_before).update(
+        status=TASK_STATUS_PENDING, run_at=timezone.now()
+    )
+    if count:
+        logger.warning(f'Queued {count} stale tasks again')
+    return count
+
+
+def claim_task() -> Optional[Task]:
+    """Claim the most urgent due task.
+
+    Transactions take the write lock when they start, so no other worker claims it too.
+    """
+    with transaction.atomic():
+        due_tasks = Task.objects.filter(status=TASK_STATUS_PENDING, run_at__lte=timezone.now())
+        claimed = due_tasks.order_by('-priority', 'run_at', 'id').first()
+        if claimed is None:
+            return None
+        claimed.status = TASK_STATUS_RUNNING
+        claimed.attempts += 1
+        claimed.started_at = timezone.now()
+        claimed.save(update_fields=['status', 'attempts', 'started_at', 'updated_at'])
+    return claimed
+
+
+def run_task(claimed: Task):
+    """Run a claimed task, and retry it later when it fails and has attempts left."""
+    spec = TASKS.get(claimed.name)
+    label = f'Task-{claimed.id} {claimed.name}'
+    start = time.perf_counter()
+    try:
+        if spec is None:
+            raise LookupError(f'No task registered as {claimed.name}')
+        spec.func(**claimed.kwargs)
+    except Exception:
+        claimed.error = traceback.format_exc()
+        if spec and claimed.attempts < claimed.max_attempts:
+            backoff = spec.retry_delay * 2 ** (claimed.attempts - 1)
+            claimed.status = TASK_STATUS_PENDING
+            claimed.run_at = timezone.now() + timedelta(seconds=backoff)
+            logger.warning(f'{label} failed, retrying in {backoff:.0f}s')
+        else:
+            claimed.status = TASK_STATUS_FAILED
+            logger.error(f'{label} failed after {claimed.attempts} attempts')
+    else:
+        claimed.status = TASK_STATUS_DONE
+        logger.info(f'{label} done in {time.perf_counter() - start:.2f}s')
+    claimed.finished_at = timezone.now()
+    claimed.save()
+
+    if spec and spec.every and claimed.status != TASK_STATUS_PENDING:
+        queue_task(spec, {}, delay=spec.every, dedupe_key=periodic_dedupe_key(spec))
+
+
+def work(once: bool = False, **kwargs):
+    """Run due tasks by priority, polling for new ones, or until none is due when once."""
+    load_tasks()
+    requeue_stale_tasks()
+    schedule_periodic_tasks()
+    logger.info(f'Worker started with {len(TASKS)} tasks registered')
+    while True:
+        close_old_connections()
+        if claimed := claim_task():
+            run_task(claimed)
+        elif once:
+            return
+        else:
+            time.sleep(POLL_INTERVAL)
+
+
+@task(priority=-10, every=24 * 3600)
+def purge_tasks(days: int = TASK_RETENTION_DAYS):
+    """Delete tasks that finished days ago."""
+    finished_before = timezone.now() - timedelta(days=days)
+    finished = Task.objects.filter(
+        status__in=[TASK_STATUS_DONE, TASK_STATUS_FAILED], finished_at__lt=finished_before
+    )
+    count, _ = finished.delete()
+    logger.info(f'Purged {count} finished tasks')
@@ -1,32 +1,40 @@
+import asyncio
 import logging
-from pathlib import Path
+from typing import List
 
 import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
 from django.core.handlers.wsgi import WSGIRequest
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.http import Http404, HttpResponse
-from django.shortcuts import get_object_or_404, render
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404, render
 from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
 from django_filters.views import FilterMixin
 from django_tables2 import SingleTableView
 
 from main.constants import GENRE_CHOICES
+from main.events import published_by, stream_events
 from main.filters import AlbumFilter, ArtistFilter, SongFilter
-from main.lastfm_service import scrape_studio_albums, update_next_similar_artist
-from main.lyrics import search_azlyrics
-from main.models import Album, Artist, Song
-from main.musicfiles import get_album_art, validate_songs
-from main.plays import get_next_song, handle_genre_filter, set_genre, set_played
-from main.ratings import get_match, set_match_result
-from main.selectors import (
-    get_albums_by_year_chart,
-    get_albums_per_artist_chart,
-    get_play_count_chart,
-    get_songs_by_played_date_chart,
-    get_top_percentile_songs,
+from main.fragments import SCOPE_RATINGS, artist_scope, fragment_cache, ranking_scopes
+from main.lyrics import asearch_azlyrics, prefetch_lyrics
+from main.lyrics_index import search_lyrics
+from main.models import Album, Artist, MissingAlbum, SimilarCandidate, Song
+from main.musicfiles import get_album_art_path, save_album_art, validate_songs
+from main.pagination import KeysetPaginationMixin
+from main.percentiles import get_top_percentile_songs
+from main.plays import (
+    get_next_song,
+    get_upcoming_songs,
+    handle_genre_filter,
+    set_genre,
+    set_played,
 )
+from main.ratings import get_match, set_match_result
+from main.selectors import get_chart
 from main.tables import AlbumTable, ArtistTable, SongTable
 
 logger = logging.getLogger(__name__)
@@ -38,13 +46,18 @@ def home_view(request: WSGIRequest):
     return render(request, 'main/home.html', ctx)
 
 
-def next_song_view(request: WSGIRequest):  # noqa: PLR0912
-    """Return next song."""
-    last_song_id = request.session.get('song_id')
+async def next_song_view(request: ASGIRequest):  # noqa: PLR0912
+    """Return next song.
+
+    Async, so the player is not queued behind lyrics and album art fetches. Services that
+    write in transactions run on the shared sync thread.
+    """
+    last_song_id = request.player.song_id
     if last_song_id:
         try:
-            song = Song.objects.get(id=last_song_id)
-            set_played(song)
+            song = await Song.objects.aget(id=last_song_id)
+            with published_by(request):
+                await sync_to_async(set_played)(song)
         except Song.DoesNotExist:
             logger.warning(f'Looked to play {last_song_id} but not found!')
             pass
@@ -53,45 +66,52 @@ def next_song_view(request: WSGIRequest):  # noqa: PLR0912
 
     # demands facet filters
     if request.GET.get('remove_facet'):
-        cache.delete('filter_facet')
+        await cache.adelete('filter_facet')
     if demand := request.GET.get('demand'):
         logger.info(f'Demand received: {demand}')
         dem_type, dem_id = demand.split('_')
         if dem_type == 'song':
-            next_song = Song.objects.get(id=dem_id)
+            next_song = await Song.objects.aget(id=dem_id)
         else:
             facet_class = globals().get(dem_type.title())
-            facet_ins = get_object_or_404(facet_class, id=dem_id)
-            cache.set('filter_facet', {dem_type: facet_ins}, timeout=None)
+            facet_ins = await aget_object_or_404(facet_class, id=dem_id)
+            await cache.aset('filter_facet', {dem_type: facet_ins}, timeout=None)
 
     # filters of genres
     if request.GET.get('remove_genre'):
-        cache.delete('filter_genres')
+        await cache.adelete('filter_genres')
     if genre := request.GET.get('genre'):
         valid_genres = [genre[0] for genre in GENRE_CHOICES]
         if genre and genre not in valid_genres:
             return HttpResponse(f'Invalid genre selected: {genre}', status=400)
-        handle_genre_filter(genre)
+        await sync_to_async(handle_genre_filter)(genre)
 
     # normal priority queue
     if not next_song:
-        next_song = get_next_song()
+        next_song = await sync_to_async(get_next_song)()
 
     # check audio exists
-    if not next_song.file_exists():
-        validate_songs()
-        next_song = get_next_song()
+    if not await asyncio.to_thread(next_song.file_exists):
+        await sync_to_async(validate_songs)()
+        next_song = await sync_to_async(get_next_song)()
 
     # store for matches and history
-    request.session['song_id'] = next_song.id
+    request.player.update(song_id=next_song.id)
+
+    # have lyrics ready before they are opened
+    if settings.LYRICS_PREFETCH:
+        upcoming_songs = await sync_to_async(get_upcoming_songs)(
+            next_song, settings.LYRICS_PREFETCH_COUNT
+        )
+        await sync_to_async(prefetch_lyrics)([next_song, *upcoming_songs])
 
     # Check if filter_facet is not None and has at least one item
-    if filter_facet := cache.get('filter_facet'):
+    if filter_facet := await cache.aget('filter_facet'):
         filter_value = next(iter(filter_facet.values()))  # Get the first value
     else:
         filter_value = None
     # Check if filter_genre is not None and has at least one item
-    if filter_genres := cache.get('filter_genres'):
+    if filter_genres := await cache.aget('filter_genres'):
         genre_values = ', '.join(filter_genres['genre__in'])
     else:
         genre_values = None
@@ -108,15 +128,16 @@ def next_song_view(request: WSGIRequest):  # noqa: PLR0912
     return response
 
 
-def next_rating_view(request: WSGIRequest):
+async def next_rating_view(request: ASGIRequest):
     """Return next rating."""
     if winner_id := request.GET.get('winner_id'):
-        match_ids = request.session.get('match_ids')
-        set_match_result(int(winner_id), list(map(int, match_ids)))
+        match_ids = request.player.match_ids
+        with published_by(request):
+            await sync_to_async(set_match_result)(int(winner_id), list(map(int, match_ids)))
 
-    current_song = Song.objects.get(id=request.session.get('song_id'))
-    match = get_match(current_song)
-    request.session['match_ids'] = [s.id for s in match] if match else None
+    current_song = await Song.objects.aget(id=request.player.song_id)
+    match = await sync_to_async(get_match)(current_song)
+    request.player.update(match_ids=[s.id for s in match] if match else None)
 
     response = render(request, 'main/partial_song_rating.html', {'match': match})
 
@@ -127,40 +148,50 @@ def next_rating_view(request: WSGIRequest):
     return response
 
 
-def album_art_view(request, song_id):
+async def album_art_view(request, song_id):
     """Return album art from static directory if exists, otherwise extract from ID3."""
-    song = get_object_or_404(Song, id=song_id)
+    song = await aget_object_or_404(Song.objects.select_related('album__artist'), id=song_id)
     album = song.album
 
     # Define path to album art in the static directory
-    album_art_path = settings.ALBUMS_DIR / f'{album.artist.slug}-{album.slug}-{album.id}.jpg'
-
-    # Check if album art already exists in the static directory
-    if album_art_path.exists():
-        with Path.open(album_art_path, 'rb') as art_file:
-            response = HttpResponse(art_file.read(), content_type='image/jpeg')
-            # Add cache headers to the response (e.g., cache for 1 day)
-            patch_cache_control(response, public=True, max_age=86400)  # 86400 seconds = 1 day
-            return response
-
-    # If album art does not exist, extract from ID3 and save it
-    tag = get_album_art(song)
-    if not tag:
+    album_art_path = get_album_art_path(album)
+
+    # Check if album art already exists in the static directory, reading files off the loop
+    if await asyncio.to_thread(album_art_path.exists):
+        art = await asyncio.to_thread(album_art_path.read_bytes)
+        response = HttpResponse(art, content_type='image/jpeg')
+        # Add cache headers to the response (e.g., cache for 1 day)
+        patch_cache_control(response, public=True, max_age=86400)  # 86400 seconds = 1 day
+        return response
+
+    # If album art does not exist, extract from ID3 and save it to the static directory
+    art = await asyncio.to_thread(save_album_art, song)
+    if not art:
         raise Http404('Album art not found in ID3 tags')
 
-    # Save the album art to the static directory
-    with Path.open(album_art_path, 'wb') as art_file:
-        art_file.write(tag.data)
-
     # Serve the album art with cache headers
-    response = HttpResponse(tag.data, content_type='image/jpeg')
+    response = HttpResponse(art, content_type='image/jpeg')
     patch_cache_control(response, public=True, max_age=86400)
     return response
 
 
+def album_scopes(request: WSGIRequest, album_id: int) -> List[str]:
+    """Get fragment scopes of album, those of its artist as the other albums are listed too.
+
+    Ratings are a scope too, the ranks shown shift whenever any item is rated.
+    """
+    if album_id == 0:
+        songs = Song.objects.filter(id=request.player.song_id)
+        artist_id = songs.values_list('artist_id', flat=True).first()
+    else:
+        artist_id = Album.objects.filter(id=album_id).values_list('artist_id', flat=True).first()
+    return [artist_scope(artist_id), SCOPE_RATINGS] if artist_id else [SCOPE_RATINGS]
+
+
+@fragment_cache(album_scopes)
 def album_view(request, album_id):
     """Album view of song."""
-    current_song_id = request.session.get('song_id')
+    current_song_id = request.player.song_id
     if album_id == 0:
         album = Album.objects.get(songs__id=current_song_id)
     else:
@@ -188,6 +219,26 @@ def album_view(request, album_id):
     )
 
 
+def song_scopes(request: WSGIRequest, song_id: int) -> List[str]:
+    """Get fragment scopes of song, those of its artist and the ratings ranking it."""
+    artist_id = Song.objects.filter(id=song_id).values_list('artist_id', flat=True).first()
+    return [artist_scope(artist_id), SCOPE_RATINGS] if artist_id else [SCOPE_RATINGS]
+
+
+@fragment_cache(song_scopes)
+def album_song_view(request: WSGIRequest, song_id: int) -> HttpResponse:
+    """Get row of song in the album view, refreshed alone after plays and ratings."""
+    song = get_object_or_404(Song, id=song_id)
+    ctx = {'song': song, 'current_song_id': request.player.song_id}
+    return render(request, 'main/snippet_album_song.html', ctx)
+
+
+def artist_scopes(request: WSGIRequest, artist_id: int) -> List[str]:
+    """Get fragment scopes of artist, and the ratings ranking it."""
+    return [artist_scope(artist_id), SCOPE_RATINGS]
+
+
+@fragment_cache(artist_scopes)
 def artist_view(request: WSGIRequest, artist_id: int) -> HttpResponse:
     """Get artist details."""
     artist = get_object_or_404(Artist, id=artist_id)
@@ -203,9 +254,10 @@ def artist_view(request: WSGIRequest, artist_id: int) -> HttpResponse:
     return render(request, 'main/partial_artist.html', ctx)
 
 
+@fragment_cache(ranking_scopes)
 def ranking_view(request, facet):
     """Return ranking for whichever facet."""
-    current_song = get_object_or_404(Song, id=request.session.get('song_id'))
+    current_song = get_object_or_404(Song, id=request.player.song_id)
     if facet == 'artists':
         cls = Artist
         prefetch = 'albums'
@@ -249,7 +301,8 @@ def ranking_view(request, facet):
     )
 
 
-class SongListView(SingleTableView, FilterMixin):
+@method_decorator(fragment_cache(ranking_scopes), name='get')
+class SongListView(KeysetPaginationMixin, SingleTableView, FilterMixin):
     model = Song
     ordering = ['-played_at']
     filterset_class = SongFilter
@@ -271,7 +324,8 @@ class SongListView(SingleTableView, FilterMixin):
         return context
 
 
-class AlbumListView(SingleTableView, FilterMixin):
+@method_decorator(fragment_cache(ranking_scopes), name='get')
+class AlbumListView(KeysetPaginationMixin, SingleTableView, FilterMixin):
     model = Album
     ordering = ['-rating']
     filterset_class = AlbumFilter
@@ -293,7 +347,8 @@ class AlbumListView(SingleTableView, FilterMixin):
         return context
 
 
-class ArtistListView(SingleTableView, FilterMixin):
+@method_decorator(fragment_cache(ranking_scopes), name='get')
+class ArtistListView(KeysetPaginationMixin, SingleTableView, FilterMixin):
     model = Artist
     ordering = ['-rating']
     filterset_class = ArtistFilter
@@ -321,39 +376,34 @@ def stats_view(request):
 
 
 def stats_graph_view(request, graph_name: str):
-    """Get chart for stats view."""
-    if graph_name == 'album_ratings_by_year':
-        graph = get_albums_by_year_chart()
-    elif graph_name == 'play_count':
-        graph = get_play_count_chart()
-    elif graph_name == 'albums_per_artist':
-        graph = get_albums_per_artist_chart()
-    elif graph_name == 'songs_by_date':
-        graph = get_songs_by_played_date_chart()
-    else:
-        return HttpResponse(f'Unknown graph: {graph_name}')
-
-    response = render(request, 'main/partial_stats_graph.html', {'graph': graph})
-    patch_cache_control(response, public=True, max_age=3600)
+    """Get chart data for stats view, rendered client side."""
+    chart = get_chart(graph_name)
+    if chart is None:
+        return JsonResponse({'error': f'Unknown graph: {graph_name}'}, status=404)
+
+    # rollups are kept up to date, so only cache briefly
+    response = JsonResponse(chart)
+    patch_cache_control(response, public=True, max_age=60)
     return response
 
 
-def lyrics_view(request, song_id: int):
+async def lyrics_view(request, song_id: int):
     """Show lyric."""
     cache = True
-    song = get_object_or_404(Song, id=song_id)
+    song = await aget_object_or_404(Song, id=song_id)
     refresh = bool(request.GET.get('refresh'))
     instrument = bool(request.GET.get('instrument'))
 
     try:
-        lyrics = search_azlyrics(song, refresh, instrument)
+        lyrics = await asearch_azlyrics(song, refresh, instrument)
     except (requests.RequestException, ValueError) as exc:
         lyrics = str(exc)
         cache = False
 
+    # links refresh the lyrics shown, so the response does not depend on the player
     ctx = {
         'lyrics': lyrics,
-        'current_song_id': request.session.get('song_id'),
+        'current_song_id': song.id,
     }
     response = render(request, 'main/partial_lyrics.html', ctx)
     if cache:
@@ -363,6 +413,16 @@ def lyrics_view(request, song_id: int):
     return response
 
 
+def lyrics_search_view(request):
+    """Search songs by a line of their lyrics."""
+    query = request.GET.get('query', '').strip()
+    ctx = {
+        'query': query,
+        'songs': search_lyrics(query) if query else [],
+    }
+    return render(request, 'main/partial_lyrics_search.html', ctx)
+
+
 def genre_view(request, facet: str, facet_id: int, genre: str):
     """Set genre of artist, album or song."""
     # Check if facet class exists, otherwise return a string message
@@ -388,7 +448,8 @@ def genre_view(request, facet: str, facet_id: int, genre: str):
         )
 
     # Set the genre and render success
-    set_genre(facet_ins, genre)
+    with published_by(request):
+        set_genre(facet_ins, genre)
     response = render(
         request,
         'main/snippet_genre.html',
@@ -406,18 +467,26 @@ def genre_view(request, facet: str, facet_id: int, genre: str):
 
 
 def similars_view(request):
-    """Get artist to review and new bands from LastFM."""
-    album_details = scrape_studio_albums()
-
-    try:
-        grouped_similars = update_next_similar_artist()
-    except NotImplementedError as exc:
-        return HttpResponse(str(exc))
-
+    """Get artists missing studio albums and new bands from LastFM, as crawled."""
+    missing_albums = MissingAlbum.objects.select_related('artist').order_by('-created_at')
     ctx = {
-        'album_details': album_details,
-        'grouped_similars': grouped_similars,
+        'missing_albums': missing_albums[:20],
+        'grouped_similars': SimilarCandidate.objects.order_by('-total_score'),
     }
     response = render(request, 'main/partial_similars.html', ctx)
     # patch_cache_control(response, public=True, max_age=86400)
     return response
+
+
+async def events_view(request):
+    """Stream play, rating and genre events to the open tabs, only served under ASGI."""
+    if not isinstance(request, ASGIRequest):
+        # wsgi would hold a worker thread forever, 204 tells EventSource not to reconnect
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(
+        stream_events(request.headers.get('Last-Event-ID')),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
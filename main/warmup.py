@@ -0,0 +1,95 @@
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+
+from main.lyrics import prefetch_lyrics
+from main.models import Album, Artist, Song
+from main.musicfiles import get_album_art_path, save_album_art
+from main.plays import get_next_song, get_next_song_priority_values, get_upcoming_songs
+from main.selectors import CHARTS, get_chart
+
+logger = logging.getLogger(__name__)
+
+
+def warm_ranks() -> int:
+    """Cache ranks of all artists, albums and songs."""
+    return sum(model.cache_ranks() for model in (Artist, Album, Song))
+
+
+def warm_charts() -> int:
+    """Cache data of the stats charts."""
+    for graph_name in CHARTS:
+        get_chart(graph_name)
+    return len(CHARTS)
+
+
+def warm_lookahead(count: int) -> List[Song]:
+    """Get the songs likely to play next, with their lyrics and album art ready."""
+    # unplayed songs are picked at random, so nothing can be predicted
+    if Song.objects.filter(count_played=0).exists():
+        return []
+    song = get_next_song()
+    songs = [song, *get_upcoming_songs(song, count)]
+
+    if settings.LYRICS_PREFETCH:
+        prefetch_lyrics(songs)
+    for song in songs:
+        if get_album_art_path(song.album).exists() or not song.file_exists():
+            continue
+        try:
+            save_album_art(song)
+        except Exception:
+            logger.exception(f'Could not extract album art of {song}')
+    return songs
+
+
+def warm_cache(*args, **kwargs):
+    """Precompute what the first requests after a restart would otherwise compute."""
+    total_start = time.perf_counter()
+    steps = [
+        ('priority values', get_next_song_priority_values),
+        ('ranks', warm_ranks),
+        ('charts', warm_charts),
+        ('look-ahead songs', lambda: warm_lookahead(settings.LYRICS_PREFETCH_COUNT)),
+    ]
+    for name, step in steps:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            logger.exception(f'Warming {name} failed')
+        else:
+            logger.info(f'Warmed {name} in {time.perf_counter() - start:.2f}s')
+    logger.info(f'Warmed cache in {time.perf_counter() - total_start:.2f}s')
+
+
+def is_serving() -> bool:
+    """Check if this process serves requests, not a management command or reloader."""
+    if Path(sys.argv[0]).name != 'manage.py':
+        return True
+    if sys.argv[1:2] != ['runserver']:
+        return False
+    # the autoreloader parent only watches files, its child serves
+    return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
+
+
+def warm_in_background():
+    """Warm the cache of this process once all apps are ready."""
+
+    def run():
+        while not apps.ready:
+            time.sleep(0.1)
+        try:
+            warm_cache()
+        finally:
+            connection.close()
+
+    threading.Thread(target=run, name='warmup', daemon=True).start()
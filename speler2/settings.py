@@ -58,9 +58,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.middleware.timing_middleware.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'main.middleware.compression_middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'main.middleware.player_state_middleware.PlayerStateMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -96,6 +100,12 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # concurrent requests write too, take the write lock when a transaction starts so
+        # they wait for each other instead of failing on upgrading a read lock
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
@@ -124,7 +134,8 @@ AUTH_PASSWORD_VALIDATORS = [
 
 LANGUAGE_CODE = 'en-us'
 
-TIME_ZONE = 'UTC'
+# plays per day are bucketed in this timezone, run `parsemusic rebuildrollups` after changing it
+TIME_ZONE = env('TIME_ZONE', default='UTC')
 
 USE_I18N = True
 
@@ -192,12 +203,17 @@ LOGGING = {
 }
 
 
+# room for the ranks of every song, album and artist next to the fragments
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': env.int('CACHE_MAX_ENTRIES', 100_000)},
     }
 }
 
+# precompute priority values, ranks, charts and the next songs in a thread after starting
+WARMUP_ON_START = env.bool('WARMUP_ON_START', False)
+
 
 CRISPY_ALLOWED_TEMPLATE_PACKS = 'bootstrap5'
 CRISPY_TEMPLATE_PACK = 'bootstrap5'
@@ -207,6 +223,10 @@ MUSIC_DIR = Path(env('MUSIC_DIR'))
 USE_MP3 = env.bool('USE_MP3')
 ALBUMS_DIR = BASE_DIR / '.albums'
 LYRICS_DIR = BASE_DIR / '.lyrics'
+LYRICS_PREFETCH = env.bool('LYRICS_PREFETCH', True)
+LYRICS_PREFETCH_COUNT = env.int('LYRICS_PREFETCH_COUNT', 3)
+LYRICS_PREFETCH_WORKERS = env.int('LYRICS_PREFETCH_WORKERS', 2)
+LYRICS_FAILURE_TTL = env.int('LYRICS_FAILURE_TTL', 6 * 3600)
 
 STATICFILES_DIRS = [
     MUSIC_DIR,
@@ -215,7 +235,49 @@ STATICFILES_DIRS = [
 ]
 
 
+# song ratings as win ratio, or bradley-terry strengths over all comparisons (needs numpy)
+RATING_ENGINE = env('RATING_ENGINE', default='ratio')
+RATINGS_PER_PLAY = env.int('RATINGS_PER_PLAY', 5)
+
+
 LASTFM_API_KEY = env('LASTFM_API_KEY')
 LASTFM_SECRET = env('LASTFM_SECRET')
 LASTFM_ENABLE = bool(LASTFM_API_KEY and LASTFM_SECRET)
 LASTFM_SESSION_FILE = BASE_DIR / 'lastfm.session'
+
+
+# request instrumentation (Server-Timing headers and slow request logging)
+TIMING_ENABLE = env.bool('TIMING_ENABLE', False)
+TIMING_BUDGET_TOTAL_MS = env.float('TIMING_BUDGET_TOTAL_MS', 500)
+TIMING_BUDGET_DB_MS = env.float('TIMING_BUDGET_DB_MS', 200)
+TIMING_BUDGET_QUERIES = env.int('TIMING_BUDGET_QUERIES', 50)
+
+
+# deferred work runs in `manage.py worker` when async, or right away in the request otherwise
+TASKS_ASYNC = env.bool('TASKS_ASYNC', False)
+
+
+# response compression, brotli when installed and accepted, gzip otherwise
+COMPRESSION_MIN_SIZE = env.int('COMPRESSION_MIN_SIZE', 1024)
+COMPRESSION_BROTLI = env.bool('COMPRESSION_BROTLI', True)
+
+
+# shared HTTP client of the scrapers (live, record or replay from fixtures)
+HTTP_MODE = env('HTTP_MODE', default='live')
+HTTP_CACHE_DIR = BASE_DIR / '.http' / 'cache'
+HTTP_FIXTURES_DIR = Path(env('HTTP_FIXTURES_DIR', default='') or BASE_DIR / '.http' / 'fixtures')
+HTTP_CACHE_TTL = env.int('HTTP_CACHE_TTL', 3600)
+HTTP_CACHE_TTLS = {
+    'api.chartlyrics.com': 30 * 24 * 3600,
+    'www.azlyrics.com': 30 * 24 * 3600,
+    'www.billboard.com': 6 * 3600,
+    'www.wikipedia.org': 7 * 24 * 3600,
+    'en.wikipedia.org': 7 * 24 * 3600,
+}
+# minimum seconds between requests per host, also used for the last.fm api
+HTTP_RATE_LIMITS = {
+    'ws.audioscrobbler.com': 0.25,
+    'www.azlyrics.com': 5,
+    'www.wikipedia.org': 1,
+    'en.wikipedia.org': 1,
+}
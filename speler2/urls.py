@@ -27,6 +27,7 @@ urlpatterns = [
     path('next-rating/', views.next_rating_view, name='next_rating'),
     path('album-art/<int:song_id>/', views.album_art_view, name='album_art'),
     path('album/<int:album_id>/', views.album_view, name='album'),
+    path('album/song/<int:song_id>/', views.album_song_view, name='album_song'),
     path('artist/<int:artist_id>/', views.artist_view, name='artist'),
     path('ranking/<str:facet>/', views.ranking_view, name='ranking'),
     path('list/song/', views.SongListView.as_view(), name='song_list'),
@@ -35,6 +36,8 @@ urlpatterns = [
     path('stats/', views.stats_view, name='stats'),
     path('stats/graph/<str:graph_name>/', views.stats_graph_view, name='stats_graph'),
     path('lyrics/<int:song_id>/', views.lyrics_view, name='lyric_txt'),
+    path('lyrics/search/', views.lyrics_search_view, name='lyrics_search'),
     path('genre/<str:facet>/<int:facet_id>/<str:genre>/', views.genre_view, name='genre'),
     path('similars/', views.similars_view, name='similars'),
+    path('events/', views.events_view, name='events'),
 ]